@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""命令行 / 批量下载 - 不启动 API 服务和数据库，直接运行下载引擎
+
+    python cli.py "https://example.com/index.m3u8" -o video.mp4
+    python cli.py -i urls.txt -d ./downloads --jobs 3 --threads 16
+    python cli.py -i urls.txt --json > progress.jsonl
+
+列表文件每行一个地址，地址后可用空白分隔指定文件名，# 开头的行为注释。
+--json 时 stdout 每行一个 JSON 事件（start / status / progress / done / summary），
+下载器自身的日志输出到 stderr。
+
+任务ID由地址和输出文件决定，中断（Ctrl+C）后用同样的参数重新运行会从已下载的分片继续。
+全部成功退出码为 0，有失败为 1，被中断为 130。
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# 下载引擎（以及 requests、m3u8、pycryptodome）在解析完参数后才导入，--help 等操作无需加载
+
+
+class EventWriter:
+    """输出进度事件：--json 时写 JSON Lines，否则打印可读的摘要行"""
+
+    def __init__(self, stream, as_json: bool, interval: float = 1.0):
+        self.stream = stream
+        self.as_json = as_json
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_progress: Dict[str, float] = {}
+
+    def emit(self, event: str, **fields):
+        record = {"event": event, "time": round(time.time(), 3), **fields}
+        with self.lock:
+            if self.as_json:
+                self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.stream.flush()
+            elif event in ("done", "summary"):
+                self.stream.write(" ".join(f"{k}={v}" for k, v in record.items() if k != "time") + "\n")
+                self.stream.flush()
+
+    def progress(self, job: str, progress: float, current: int, total: int, speed: str, eta=None):
+        """进度事件按 interval 限流，完成时总会输出"""
+        now = time.time()
+        if progress < 100 and now - self.last_progress.get(job, 0) < self.interval:
+            return
+        self.last_progress[job] = now
+        self.emit("progress", job=job, progress=round(progress, 1), current=current, total=total,
+                  speed=speed, eta=eta)
+
+
+def default_filename(url: str) -> str:
+    """根据地址生成文件名: .../movie/index.m3u8 -> movie.mp4"""
+    path = urlparse(url).path.rstrip("/")
+    parts = [p for p in path.split("/") if p]
+    name = os.path.splitext(parts[-1])[0] if parts else ""
+    if name in ("", "index", "playlist", "master", "prog_index") and len(parts) > 1:
+        name = parts[-2]
+    return f"{name or 'video'}.mp4"
+
+
+def read_url_list(path: str) -> List[Tuple[str, Optional[str]]]:
+    """读取地址列表，返回 [(地址, 文件名或 None)]"""
+    entries = []
+    with open(sys.stdin.fileno() if path == "-" else path, "r", encoding="utf-8", closefd=path != "-") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 1)
+            entries.append((parts[0], parts[1].strip() if len(parts) > 1 else None))
+    return entries
+
+
+def plan_jobs(args) -> List[Dict]:
+    """确定每个地址的输出路径和任务ID，重名文件加序号"""
+    if args.input:
+        entries = read_url_list(args.input)
+    else:
+        entries = [(args.url, os.path.basename(args.output) if args.output else None)]
+    output_dir = os.path.dirname(args.output) if args.output and not args.input else args.output_dir
+    jobs, used = [], set()
+    for url, filename in entries:
+        filename = filename or default_filename(url)
+        base, ext = os.path.splitext(filename)
+        ext = ext or ".mp4"
+        candidate, n = base + ext, 1
+        while candidate in used:
+            n += 1
+            candidate = f"{base}_{n}{ext}"
+        used.add(candidate)
+        save_path = os.path.join(output_dir or ".", candidate)
+        task_id = hashlib.sha1(f"{url}|{os.path.abspath(save_path)}".encode()).hexdigest()[:8]
+        jobs.append({"job": task_id, "url": url, "output": save_path})
+    return jobs
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="M3U8 命令行下载（不依赖 API 服务）")
+    parser.add_argument("url", nargs="?", help="M3U8 地址")
+    parser.add_argument("-i", "--input", help="地址列表文件（- 为标准输入）")
+    parser.add_argument("-o", "--output", help="输出文件（单个地址）")
+    parser.add_argument("-d", "--output-dir", default="./downloads", help="输出目录（批量）")
+    parser.add_argument("-t", "--threads", type=int, default=10, help="每个任务的下载线程数（最大20）")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="同时下载的任务数")
+    parser.add_argument("--merges", type=int, default=None, help="同时合并的任务数（默认 CPU 核数的一半，最多4）")
+    parser.add_argument("--mirror", action="append", default=[], help="等价的镜像播放列表地址（可重复）")
+    parser.add_argument("--hedge", action="store_true", help="对慢分片发起对冲请求")
+    parser.add_argument("--transport", choices=("http1", "http2"), default=None, help="HTTP 传输方式")
+    parser.add_argument("--proxy", help="代理地址，如 http://127.0.0.1:7890")
+    parser.add_argument("--no-verify", action="store_true", help="不校验分片内容")
+    parser.add_argument("--checksums", action="store_true", help="记录分片校验和，续传时校验已下载的分片")
+    parser.add_argument("--work-dir", default=None,
+                        help="分片工作目录（默认 $M3U8_WORK_DIR 或系统临时目录下的 m3u8-cli）")
+    parser.add_argument("--json", action="store_true", help="stdout 输出 JSON Lines 进度事件")
+    parser.add_argument("--quiet", action="store_true", help="屏蔽下载器日志")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.url and not args.input:
+        parser.error("需要提供 M3U8 地址或 --input 列表文件")
+    if args.url and args.input:
+        parser.error("M3U8 地址和 --input 不能同时使用")
+
+    jobs = plan_jobs(args)
+    if not jobs:
+        parser.error("列表中没有地址")
+
+    # JSON 事件独占 stdout，下载器的 print 输出转到 stderr（或丢弃）
+    events = EventWriter(sys.stdout, args.json)
+    log_stream = open(os.devnull, "w") if args.quiet else sys.stderr
+    if args.json or args.quiet:
+        sys.stdout = log_stream
+    logging.basicConfig(level=logging.ERROR if args.quiet else logging.WARNING, stream=log_stream,
+                        format="%(levelname)s %(message)s")
+
+    # 与服务端的 m3u8_<任务ID> 目录分开存放，避免被服务启动时的残留目录清理删除
+    work_root = args.work_dir or os.path.join(os.environ.get("M3U8_WORK_DIR", tempfile.gettempdir()), "m3u8-cli")
+
+    from downloader_fixed import M3U8Downloader
+    from postprocess import MergePool, MERGE_WORKERS
+
+    merge_pool = MergePool(args.merges or MERGE_WORKERS)
+    download_slots = threading.Semaphore(max(1, args.jobs))
+    proxy = {"http": args.proxy, "https": args.proxy} if args.proxy else None
+    downloaders: Dict[str, M3U8Downloader] = {}
+    downloaders_lock = threading.Lock()
+    interrupted = threading.Event()
+
+    def run_job(job: Dict) -> bool:
+        task_id = job["job"]
+        download_slots.acquire()
+        holding = [True]
+
+        def release_slot():
+            if holding[0]:
+                holding[0] = False
+                download_slots.release()
+
+        start = time.time()
+        error = None
+        ok = False
+        last_status = [None]
+
+        def status_callback(status: str):
+            last_status[0] = status
+            events.emit("status", job=task_id, status=status)
+
+        try:
+            if interrupted.is_set():
+                return False
+            downloader = M3U8Downloader(
+                task_id=task_id, url=job["url"], save_path=job["output"],
+                max_threads=min(args.threads, 20), proxy=proxy, mirrors=args.mirror, hedge=args.hedge,
+                verify=not args.no_verify, checksums=args.checksums, transport=args.transport,
+                work_dir=os.path.join(work_root, f"m3u8_{task_id}"))
+            with downloaders_lock:
+                downloaders[task_id] = downloader
+            events.emit("start", job=task_id, url=job["url"], output=job["output"])
+
+            def merge_slot():
+                # 分片下载完成：让出下载名额，合并单独排队
+                release_slot()
+                return merge_pool.slot(task_id, on_wait=downloader.spill_staged,
+                                       cancelled=lambda: downloader.is_stopped)
+
+            ok = downloader.download(
+                progress_callback=lambda *a, **kw: events.progress(task_id, *a, **kw),
+                status_callback=status_callback,
+                merge_slot=merge_slot)
+            if not ok:
+                # 下载器失败时最后一条状态为 "失败: <原因>"
+                failure = last_status[0] if last_status[0] and last_status[0].startswith("失败") else None
+                error = "已中断" if downloader.interrupted else (downloader.error or failure or "下载失败")
+        except Exception as e:
+            error = str(e)
+        finally:
+            release_slot()
+            with downloaders_lock:
+                downloaders.pop(task_id, None)
+        size = os.path.getsize(job["output"]) if ok and os.path.exists(job["output"]) else None
+        events.emit("done", job=task_id, ok=ok, output=job["output"], bytes=size,
+                    seconds=round(time.time() - start, 1), error=error)
+        return ok
+
+    started = time.time()
+    executor = ThreadPoolExecutor(max_workers=max(1, args.jobs) + merge_pool.max_workers)
+    futures = [executor.submit(run_job, job) for job in jobs]
+    try:
+        results = [future.result() for future in futures]
+    except KeyboardInterrupt:
+        # 停止下载并保留已下载的分片，重新运行时继续
+        interrupted.set()
+        with downloaders_lock:
+            for downloader in downloaders.values():
+                downloader.interrupt()
+        executor.shutdown(wait=True)
+        events.emit("summary", total=len(jobs), interrupted=True, seconds=round(time.time() - started, 1))
+        return 130
+    executor.shutdown(wait=True)
+
+    succeeded = sum(1 for r in results if r)
+    events.emit("summary", total=len(jobs), succeeded=succeeded, failed=len(jobs) - succeeded,
+                seconds=round(time.time() - started, 1))
+    return 0 if succeeded == len(jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
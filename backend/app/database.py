@@ -1,6 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.pool import StaticPool
 #from .models import Base
 from models import Base
 import os
@@ -8,29 +7,61 @@ import threading
 
 # SQLite数据库 - 使用相对路径
 #db_path = os.path.join(os.path.dirname(__file__), "..", "m3u8_downloader.db")
-db_path = "/app/m3u8_downloader.db"
+db_path = os.environ.get("M3U8_DB_PATH", "/app/m3u8_downloader.db")
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{db_path}"
 
-# 创建线程安全的数据库引擎
+# 创建线程安全的数据库引擎 - 连接池中每个线程使用独立连接，
+# 接口线程池和下载线程不再共用同一个连接的事务
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
-    echo=True  #开启日志便于调试
+    connect_args={"check_same_thread": False, "timeout": 30},
+    pool_size=20,
+    max_overflow=40,
+    echo=os.environ.get("M3U8_DB_ECHO", "1") == "1"  #开启日志便于调试，压测时可关闭
 )
 
-# 创建线程安全的session工厂
+@event.listens_for(engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """WAL 模式下读写互不阻塞；写锁冲突时等待而不是直接报 database is locked"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
+
+# 创建线程安全的session工厂（供下载线程等后台线程使用，请求处理通过 get_db 依赖获取独立的 session）
 SessionLocal = scoped_session(
     sessionmaker(autocommit=False, autoflush=False, bind=engine),
     scopefunc=threading.get_ident
 )
 
+def migrate_columns():
+    """为已存在的旧表补充新增的列（create_all 不会修改已有表）"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+                    print(f"🔧 数据库迁移: {table.name} 新增列 {column.name}")
+            existing_indexes = {idx["name"] for idx in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    print(f"🔧 数据库迁移: {table.name} 新增索引 {index.name}")
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    migrate_columns()
     print(f"✅ 数据库初始化完成，路径: {db_path}")
 
 def get_db():
-    db = SessionLocal()
+    # 依赖的创建和清理可能在线程池的不同线程中执行，不能用按线程复用的 scoped_session
+    db = SessionLocal.session_factory()
     try:
         yield db
     except Exception:
@@ -38,4 +69,3 @@ def get_db():
         raise
     finally:
         db.close()
-        SessionLocal.remove()
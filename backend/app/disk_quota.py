@@ -0,0 +1,135 @@
+import os
+import shutil
+import threading
+from typing import Callable, Dict, List, Optional
+
+# 预留之外始终保留的空闲空间
+DISK_FREE_MARGIN = int(os.environ.get("M3U8_DISK_FREE_MARGIN", 512 * 1024 * 1024))
+
+
+class InsufficientDiskSpace(Exception):
+    """磁盘剩余空间不足以容纳任务的分片和合并输出"""
+
+    def __init__(self, needed: int, available: int):
+        super().__init__(f"磁盘空间不足: 需要 {format_bytes(needed)}，可用 {format_bytes(available)}")
+        self.needed = needed
+        self.available = available
+
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def _existing_path(path: str) -> str:
+    """路径不存在时取最近的已存在上级目录"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def _device(path: str) -> int:
+    """路径所在的文件系统"""
+    return os.stat(_existing_path(path)).st_dev
+
+
+class Reservation:
+    """单个任务的预留：工作目录中的分片 + 下载目录中的合并输出"""
+
+    def __init__(self, task_id: str, work_bytes: int, output_bytes: int,
+                 written: Optional[Callable[[], int]] = None):
+        self.task_id = task_id
+        self.work_bytes = work_bytes
+        self.output_bytes = output_bytes
+        self.written = written
+
+    def outstanding_work(self) -> int:
+        """已写入的分片已经体现在磁盘剩余空间中，只需扣除尚未写入的部分"""
+        written = self.written() if self.written else 0
+        return max(0, self.work_bytes - max(0, written))
+
+
+class DiskQuota:
+    """磁盘空间预留 - 任务开始下载分片前按估算大小预留，预留之和超过剩余空间的任务继续排队"""
+
+    def __init__(self, work_root: str, output_root: str, margin: int = DISK_FREE_MARGIN):
+        self.work_root = work_root
+        self.output_root = output_root
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.reservations: Dict[str, Reservation] = {}
+
+    def _outstanding(self) -> Dict[int, int]:
+        """各文件系统上尚未兑现的预留"""
+        work_dev, output_dev = _device(self.work_root), _device(self.output_root)
+        outstanding = {work_dev: 0, output_dev: 0}
+        for r in self.reservations.values():
+            outstanding[work_dev] += r.outstanding_work()
+            outstanding[output_dev] += r.output_bytes
+        return outstanding
+
+    def _shortfall(self, work_bytes: int, output_bytes: int):
+        """返回 (需要, 可用)，空间足够时返回 None"""
+        work_dev, output_dev = _device(self.work_root), _device(self.output_root)
+        needs = {work_dev: 0, output_dev: 0}
+        needs[work_dev] += work_bytes
+        needs[output_dev] += output_bytes
+        outstanding = self._outstanding()
+        roots = {work_dev: self.work_root, output_dev: self.output_root}
+        for dev, need in needs.items():
+            available = shutil.disk_usage(_existing_path(roots[dev])).free - outstanding[dev] - self.margin
+            if need > available:
+                return need, max(0, available)
+        return None
+
+    def can_admit(self, work_bytes: int, output_bytes: int) -> bool:
+        with self.lock:
+            return self._shortfall(work_bytes, output_bytes) is None
+
+    def reserve(self, task_id: str, work_bytes: int, output_bytes: int,
+                written: Optional[Callable[[], int]] = None):
+        """预留空间，不足时抛出 InsufficientDiskSpace"""
+        with self.lock:
+            self.reservations.pop(task_id, None)
+            shortfall = self._shortfall(work_bytes, output_bytes)
+            if shortfall:
+                raise InsufficientDiskSpace(*shortfall)
+            self.reservations[task_id] = Reservation(task_id, work_bytes, output_bytes, written)
+
+    def release(self, task_id: str):
+        with self.lock:
+            self.reservations.pop(task_id, None)
+
+    def reserved_bytes(self) -> int:
+        with self.lock:
+            return sum(r.outstanding_work() + r.output_bytes for r in self.reservations.values())
+
+    def snapshot(self) -> Dict:
+        """系统信息中展示的预留情况"""
+        with self.lock:
+            reservations: List[Dict] = [{
+                "task_id": r.task_id,
+                "reserved": format_bytes(r.work_bytes + r.output_bytes),
+                "outstanding": format_bytes(r.outstanding_work() + r.output_bytes),
+            } for r in self.reservations.values()]
+            outstanding = self._outstanding()
+            filesystems = []
+            for path in dict.fromkeys([self.work_root, self.output_root]):
+                dev = _device(path)
+                if any(fs["device"] == dev for fs in filesystems):
+                    continue
+                free = shutil.disk_usage(_existing_path(path)).free
+                filesystems.append({
+                    "device": dev,
+                    "path": os.path.abspath(path),
+                    "free": format_bytes(free),
+                    "reserved": format_bytes(outstanding[dev]),
+                    "available": format_bytes(max(0, free - outstanding[dev] - self.margin)),
+                })
+        for fs in filesystems:
+            fs.pop("device")
+        return {"reservations": reservations, "filesystems": filesystems, "margin": format_bytes(self.margin)}
@@ -1,5 +1,4 @@
 import os
-import requests
 import m3u8
 import threading
 import queue
@@ -9,46 +8,243 @@ import shutil
 from urllib.parse import urljoin, urlparse
 from Crypto.Cipher import AES
 import hashlib
-from typing import Optional, Dict, List, Callable
+from typing import Optional, Dict, List, Callable, Tuple
 import tempfile
 import logging
 import subprocess
 import sys
 import random
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from mirrors import MirrorPool
+from throughput import ThroughputMeter, GLOBAL_METER, format_duration
+from tracing import TaskTracer, TaskProfiler
+from integrity import (SegmentVerificationError, ChecksumManifest, PACKED_AUDIO_FORMATS, sniff_packed_audio,
+                       verify_segment)
+from disk_quota import InsufficientDiskSpace, format_bytes
+from staging import SegmentStore, write_atomic
+from transport import create_transport
+from playlist_parser import SegmentTable, parse_media_playlist, is_master_playlist
+from webvtt import merge_segments as merge_webvtt
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# 任务工作目录的根目录，每个任务使用固定的 m3u8_<task_id> 子目录（断点续传、边下边播）
+# 默认使用系统临时目录下的专用子目录，不与其他程序的 m3u8_* 目录混在一起
+WORK_ROOT = os.environ.get("M3U8_WORK_DIR", os.path.join(tempfile.gettempdir(), "m3u8-downloader"))
+
+
+def parse_byterange(value: Optional[str], default_offset: int = 0) -> Optional[Tuple[int, int]]:
+    """解析 BYTERANGE 属性 "<长度>[@<偏移>]"，返回闭区间 (start, end)"""
+    if not value:
+        return None
+    length, _, offset = str(value).partition('@')
+    start = int(offset) if offset else default_offset
+    return start, start + int(length) - 1
+
+
+class RequestCancelled(Exception):
+    """请求被取消（对冲请求中较慢的一方）"""
+
+
+class LatencyTracker:
+    """记录最近的分片耗时，用于计算对冲阈值"""
+
+    def __init__(self, max_samples: int = 200, min_samples: int = 10):
+        self.samples = deque(maxlen=max_samples)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """样本不足时返回 None"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class InFlightFetch:
+    """正在进行的分片请求，end-game 阶段空闲线程可请求对冲"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.wake = threading.Event()
+        self.hedge_requested = False
+        self.hedged = False
+
+
+class MediaTrack:
+    """待下载的媒体轨道（视频 / 备用音频 / 字幕）"""
+
+    def __init__(self, kind: str, table: SegmentTable, playlist_url: str, temp_dir: str = "",
+                 name: Optional[str] = None, language: Optional[str] = None):
+        self.kind = kind
+        self.table = table
+        self.playlist_url = playlist_url
+        self.name = name
+        self.language = language
+        self.temp_dir = temp_dir
+        self.manifest: Optional[ChecksumManifest] = None
+        # 分片在内存预算内暂存到合并阶段，字幕很小且需要文件输入，直接写盘
+        self.store = SegmentStore(temp_dir, budget=None) if kind == 'subtitles' else SegmentStore(temp_dir)
+
+        # 分片表按列存储，segments[i] 返回轻量视图
+        self.segments = table
+        # 每个分片对应的初始化段文件 (EXT-X-MAP)，TS 流为 None
+        self.init_files: List[Optional[str]] = [None] * len(table)
+        self.urls = table.uris
+        self.byte_ranges = table.byte_ranges
+        # 分片文件扩展名
+        self.segment_ext = self._segment_ext()
+        # 地址没有可识别的扩展名时，按第一个分片的内容识别出的容器
+        self.detected_container: Optional[str] = None
+        # 分片全部下载后固定的本地播放列表，合并阶段消费分片时不再随之变化
+        self.frozen_playlist: Optional[str] = None
+        # 已完成（已写入暂存区）的分片标记，边下边播生成播放列表时不再逐个检查文件
+        self.completed = bytearray(len(table))
+        # 从第一个分片开始连续完成的分片数
+        self.completed_prefix = 0
+
+    @property
+    def is_fmp4(self) -> bool:
+        """是否为 fMP4 / CMAF 分片（带 EXT-X-MAP 初始化段）"""
+        return bool(self.table.init_sections)
+
+    def _segment_ext(self) -> str:
+        """字幕为 vtt，fMP4 为 m4s，打包音频 (.aac/.mp3/.ac3/.ec3) 沿用分片地址的扩展名，其余为 ts"""
+        if self.kind == 'subtitles':
+            return 'vtt'
+        if self.is_fmp4:
+            return 'm4s'
+        ext = os.path.splitext(urlparse(self.urls[0]).path)[1][1:].lower() if len(self.table) else ''
+        return ext if ext in PACKED_AUDIO_FORMATS else 'ts'
+
+    @property
+    def container(self) -> str:
+        """分片容器: ts / m4s / vtt / aac / mp3 / ac3 / eac3，决定校验方式和合并时的输入格式"""
+        ext = self.segment_ext
+        if ext in PACKED_AUDIO_FORMATS:
+            return PACKED_AUDIO_FORMATS[ext]
+        if ext == 'ts' and self.detected_container:
+            return self.detected_container
+        return ext
+
+    @property
+    def is_packed_audio(self) -> bool:
+        return self.container in PACKED_AUDIO_FORMATS.values()
+
+    def detect_container(self, data: bytes):
+        """扩展名无法区分时按内容识别：以 ID3 标签或 ADTS/AC-3/MPEG 音频帧开头的是打包音频"""
+        if self.detected_container is None and self.segment_ext == 'ts':
+            self.detected_container = sniff_packed_audio(data) or 'ts'
+
+    def segment_name(self, index: int) -> str:
+        return f"{index:05d}.{self.segment_ext}"
+
+    def segment_path(self, index: int) -> str:
+        return os.path.join(self.temp_dir, self.segment_name(index))
+
+    def has_segment(self, index: int) -> bool:
+        """分片已下载（内存或磁盘中）"""
+        return self.store.exists(self.segment_name(index))
+
+    def mark_completed(self, index: int):
+        self.completed[index] = 1
+
+    def contiguous_completed(self) -> int:
+        """从第一个分片开始连续完成的分片数，只从上次的位置向后检查"""
+        prefix = self.completed_prefix
+        while prefix < len(self.completed) and self.completed[prefix]:
+            prefix += 1
+        self.completed_prefix = prefix
+        return prefix
+
+    def segment_files(self) -> List[str]:
+        """按顺序返回磁盘上已下载的分片文件"""
+        if not os.path.exists(self.temp_dir):
+            return []
+        suffix = f".{self.segment_ext}"
+        names = [f for f in os.listdir(self.temp_dir) if f.endswith(suffix) and f[:-len(suffix)].isdigit()]
+        # 按序号排序（超过 99999 个分片时文件名位数不同）
+        names.sort(key=lambda f: int(f[:-len(suffix)]))
+        return [os.path.join(self.temp_dir, f) for f in names]
+
+
 class M3U8Downloader:
     """M3U8下载器 - 高性能版本"""
     
     def __init__(self, task_id: str, url: str, save_path: str, 
                  max_threads: int = 10,  # 默认改为10线程
-                 cookies: Optional[Dict] = None, proxy: Optional[Dict] = None):
+                 cookies: Optional[Dict] = None, proxy: Optional[Dict] = None,
+                 mirrors: Optional[List[str]] = None, hedge: bool = False,
+                 trace: bool = False, verify: bool = True, checksums: bool = False,
+                 transport: Optional[str] = None, profile: bool = False,
+                 work_dir: Optional[str] = None):
         self.task_id = task_id
         self.url = url
+        # 固定的工作目录，默认为 WORK_ROOT/m3u8_<task_id>
+        self.work_dir = work_dir or os.path.join(WORK_ROOT, f"m3u8_{task_id}")
+        self.tracks: List[MediaTrack] = []  # 当前下载的轨道，供边下边播生成本地播放列表
+        self.variant_info: Dict = {}
+        self.estimated_size: Optional[int] = None
+        # 等价的镜像播放列表地址，按实时吞吐在各镜像间分配分片
+        self.mirror_pool = MirrorPool(url, mirrors)
         self.save_path = save_path
         self.max_threads = min(max_threads, 20)  # 限制最大20线程
         self.is_stopped = False
+        self.interrupted = False  # 服务关闭导致的停止，保留工作目录以便重启后继续
+        self.completed = False  # 合并完成，工作目录中的分片已不可用
         self.is_paused = False
         
-        # 下载速度跟踪
+        # 下载速度跟踪 - 滑动窗口统计所有线程的总吞吐
         self.downloaded_bytes = 0
         self.start_time = time.time()
-        self.current_speed = 0
+        self.meter = ThroughputMeter()
+        self.stats_lock = threading.Lock()
+        self.total_segments = 0
+        self.completed_segments = 0
+        self.completed_segment_bytes = 0
         
         # AES 解密相关
         self.key = None
         self.iv = None
+        self.keys: Dict[str, bytes] = {}  # 密钥URL -> 密钥内容，音视频轨道可能使用不同密钥
+        
+        # HTTP 传输：http1 为每任务独立的 requests 连接池，
+        # http2 在所有任务间共享连接，同一主机的并发分片多路复用
+        self.transport = create_transport(transport, cookies, proxy)
+        
+        # 相邻字节区间合并请求的上限
+        self.range_coalesce_bytes = 8 * 1024 * 1024
         
-        # 创建会话 - 使用连接池和更优的配置
-        self.session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(
-            pool_connections=10,  # 减少连接数
-            pool_maxsize=50,      # 减少最大连接
-            max_retries=2
-        )
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
+        # 对冲请求：分片耗时超过 p95 时发出重复请求，取先完成者
+        self.hedge = hedge
+        self.hedge_percentile = 95
+        self.latency_tracker = LatencyTracker()
+        self.inflight: Dict[int, InFlightFetch] = {}
+        self.inflight_lock = threading.Lock()
+        self.hedge_count = 0
+        self.hedge_wins = 0
+        
+        # 可选的分阶段/分片耗时追踪
+        self.tracer = TaskTracer(task_id, enabled=trace)
+        # 可选的 cProfile 分析，覆盖任务主线程和所有下载线程
+        self.profiler = TaskProfiler() if profile else None
+        
+        # 分片校验：长度和 TS 同步字节在接收时检查，失败立即重试；
+        # checksums 开启时记录校验和清单，断点续传时校验磁盘上的分片
+        self.verify = verify
+        self.checksums = checksums
+        self.max_segment_attempts = 5
+        self.error: Optional[str] = None
         
         # 增强的通用 User-Agent 列表
         self.user_agents = [
@@ -71,11 +267,7 @@ class M3U8Downloader:
                 'Origin': 'https://example.com'
             }
         }
-        
-        if cookies:
-            self.session.cookies.update(cookies)
-        if proxy:
-            self.session.proxies.update(proxy)
+
 
     def _get_random_user_agent(self) -> str:
         """获取随机 User-Agent"""
@@ -104,38 +296,91 @@ class M3U8Downloader:
         
         return headers
 
+    @property
+    def current_speed(self) -> float:
+        """当前下载速度 (bytes/s)"""
+        return self.meter.rate()
+
+    def eta_seconds(self) -> Optional[float]:
+        """预计剩余时间：剩余分片数 × 平均分片大小 / 当前速度"""
+        with self.stats_lock:
+            if not self.completed_segments or not self.total_segments:
+                return None
+            remaining = self.total_segments - self.completed_segments
+            avg_size = self.completed_segment_bytes / self.completed_segments
+        return self.meter.eta(remaining * avg_size)
+
     def _get_ffmpeg_path(self) -> Optional[str]:
         """获取FFmpeg路径"""
         if shutil.which('ffmpeg'):
             return 'ffmpeg'
         return None
 
-    def download_with_retry(self, url: str, max_retries: int = 3, timeout: int = 15):
-        """带重试的下载 - 增强防盗链支持"""
+    def download_with_retry(self, url: str, max_retries: int = 3, timeout: int = 15,
+                            byte_range: Optional[Tuple[int, int]] = None,
+                            cancel_event: Optional[threading.Event] = None):
+        """带重试的下载 - 增强防盗链支持，byte_range 为闭区间 (start, end)
+        
+        cancel_event 被设置时中止传输并抛出 RequestCancelled
+        """
         for i in range(max_retries):
             if self.is_stopped:
                 return None
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
                 
+            mirror, request_url = self.mirror_pool.acquire(url)
             try:
-                headers = self._get_domain_headers(url)
+                headers = self._get_domain_headers(request_url)
+                if byte_range:
+                    headers['Range'] = f"bytes={byte_range[0]}-{byte_range[1]}"
+                    # 压缩后的字节区间无意义
+                    headers['Accept-Encoding'] = 'identity'
                 
                 start_time = time.time()
-                resp = self.session.get(url, timeout=timeout, headers=headers)
+                request_start = time.perf_counter()
+                resp = self.transport.get(request_url, headers=headers, timeout=timeout)
+                headers_received = time.perf_counter()
                 resp.raise_for_status()
                 
-                content = resp.content
+                # 分块读取，边收边计入吞吐统计
+                chunks = []
+                for chunk in resp.iter_content(64 * 1024):
+                    if cancel_event is not None and cancel_event.is_set():
+                        resp.close()
+                        raise RequestCancelled()
+                    chunks.append(chunk)
+                    self.meter.add(len(chunk))
+                    GLOBAL_METER.add(len(chunk))
+                content = b''.join(chunks)
+                if self.verify:
+                    self._verify_length(resp, content, byte_range)
+                if self.tracer.enabled:
+                    self.tracer.add('ttfb', 'network', request_start, headers_received, url=request_url)
+                    self.tracer.add('transfer', 'network', headers_received, time.perf_counter(),
+                                    url=request_url, bytes=len(content))
+                if byte_range and resp.status_code != 206:
+                    # 服务器忽略了 Range 头，返回了完整文件
+                    content = content[byte_range[0]:byte_range[1] + 1]
                 content_size = len(content)
                 
                 # 更新下载统计
-                self.downloaded_bytes += content_size
+                with self.stats_lock:
+                    self.downloaded_bytes += content_size
+                metrics.BYTES_DOWNLOADED.inc(content_size, host=urlparse(request_url).netloc)
                 download_time = time.time() - start_time
-                
-                if download_time > 0:
-                    self.current_speed = content_size / download_time
+                self.mirror_pool.release(mirror, content_size, download_time)
                 
                 return content
                 
+            except RequestCancelled:
+                self.mirror_pool.release(mirror)
+                raise
             except Exception as e:
+                self.mirror_pool.release(mirror, error=True)
+                metrics.RETRIES.inc(error_class=type(e).__name__)
+                if isinstance(e, SegmentVerificationError):
+                    metrics.VERIFY_FAILURES.inc(reason=e.reason)
                 logger.warning(f"下载失败 (尝试 {i+1}/{max_retries}): {str(e)}")
                 if i < max_retries - 1:
                     time.sleep(1)
@@ -143,20 +388,132 @@ class M3U8Downloader:
                     raise
         return None
 
+    @staticmethod
+    def _verify_length(resp, content: bytes, byte_range: Optional[Tuple[int, int]]):
+        """响应体长度与 Content-Length / 请求的字节区间一致，否则视为截断"""
+        encoding = resp.headers.get('Content-Encoding', 'identity').lower()
+        expected = resp.headers.get('Content-Length')
+        if expected and expected.isdigit() and encoding == 'identity' and int(expected) != len(content):
+            raise SegmentVerificationError(
+                'content_length', f"响应不完整: 收到 {len(content)} / {expected} 字节")
+        if byte_range and resp.status_code == 206:
+            content_range = resp.headers.get('Content-Range', '')
+            if content_range and not content_range.startswith(f"bytes {byte_range[0]}-"):
+                raise SegmentVerificationError('content_range', f"Content-Range 不匹配: {content_range}")
+            if len(content) != byte_range[1] - byte_range[0] + 1:
+                raise SegmentVerificationError(
+                    'content_length', f"字节区间不完整: 收到 {len(content)} / {byte_range[1] - byte_range[0] + 1} 字节")
+
+    def fetch_segment(self, url: str, byte_range: Optional[Tuple[int, int]] = None,
+                      executor: Optional[ThreadPoolExecutor] = None) -> Optional[bytes]:
+        """下载分片，开启对冲时慢请求会被复制一份，取先完成者并取消另一个"""
+        start = time.time()
+        if not self.hedge or executor is None:
+            data = self.download_with_retry(url, byte_range=byte_range)
+            self.latency_tracker.add(time.time() - start)
+            return data
+        
+        fetch = InFlightFetch()
+        with self.inflight_lock:
+            self.inflight[id(fetch)] = fetch
+        
+        cancel_events = [threading.Event()]
+        futures = [executor.submit(self._profiled(self.download_with_retry), url, byte_range=byte_range,
+                                   cancel_event=cancel_events[0])]
+        futures[0].add_done_callback(lambda f: fetch.wake.set())
+        try:
+            while not futures[0].done():
+                threshold = self.latency_tracker.percentile(self.hedge_percentile)
+                if fetch.hedge_requested or (threshold is not None and time.time() - start >= threshold):
+                    break
+                fetch.wake.wait(0.5 if threshold is None else max(0.01, min(0.5, threshold - (time.time() - start))))
+            
+            if not futures[0].done() and not self.is_stopped:
+                # 发出对冲请求，镜像池会优先分配给空闲/更快的镜像
+                fetch.hedged = True
+                cancel_events.append(threading.Event())
+                futures.append(executor.submit(self._profiled(self.download_with_retry), url,
+                                               byte_range=byte_range, cancel_event=cancel_events[1]))
+                with self.inflight_lock:
+                    self.hedge_count += 1
+            
+            pending = set(futures)
+            error = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        data = future.result()
+                    except RequestCancelled:
+                        continue
+                    except Exception as e:
+                        error = e
+                        continue
+                    # 取先成功的一方，取消其余请求
+                    for ev in cancel_events:
+                        ev.set()
+                    if future is not futures[0]:
+                        with self.inflight_lock:
+                            self.hedge_wins += 1
+                    if data is not None:
+                        self.latency_tracker.add(time.time() - start)
+                    return data
+            if error:
+                raise error
+            return None
+        finally:
+            for ev in cancel_events:
+                ev.set()
+            with self.inflight_lock:
+                self.inflight.pop(id(fetch), None)
+
+    def _profiled(self, func: Callable) -> Callable:
+        """开启性能分析时，在其他线程中执行的函数各自记录"""
+        return self.profiler.wrap(func) if self.profiler else func
+
+    def request_endgame_hedge(self) -> bool:
+        """end-game：为最早开始、尚未对冲的在途请求申请对冲"""
+        with self.inflight_lock:
+            candidates = [f for f in self.inflight.values() if not f.hedged and not f.hedge_requested]
+            if not candidates:
+                return False
+            oldest = min(candidates, key=lambda f: f.started)
+            oldest.hedge_requested = True
+        oldest.wake.set()
+        return True
+
     def load_key(self, key_uri: str, base_uri: str):
         """加载AES密钥"""
         if not key_uri:
             return
             
         key_url = key_uri if key_uri.startswith('http') else urljoin(base_uri, key_uri)
+        if key_url in self.keys:
+            return
         key_content = self.download_with_retry(key_url)
         if key_content:
-            self.key = key_content
+            self.keys[key_url] = key_content
+            if self.key is None:
+                self.key = key_content
             print(f"✅ 密钥加载成功，长度: {len(key_content)} bytes")
 
+    def load_track_keys(self, track: MediaTrack):
+        """加载轨道中出现的全部密钥（已加载的跳过）"""
+        for key in track.table.keys:
+            print(f"🔐 检测到加密 ({track.kind}): {key.method}")
+            self.load_key(key.uri, track.playlist_url)
+
+    def _get_segment_key(self, segment) -> Optional[bytes]:
+        """获取分片对应的密钥"""
+        seg_key = getattr(segment, 'key', None)
+        if not seg_key or not seg_key.uri or seg_key.method == 'NONE':
+            return None
+        return self.keys.get(seg_key.uri, self.key)
+
     def decrypt_ts(self, data: bytes, segment) -> bytes:
         """解密TS分片"""
-        if not self.key:
+        key = self._get_segment_key(segment)
+        if not key:
             return data
             
         # 获取IV
@@ -167,37 +524,119 @@ class M3U8Downloader:
             iv = seq.to_bytes(16, byteorder='big')
         
         # AES解密
-        cipher = AES.new(self.key, AES.MODE_CBC, iv)
-        return cipher.decrypt(data)
+        with metrics.DECRYPT_SECONDS.time():
+            cipher = AES.new(key, AES.MODE_CBC, iv)
+            return cipher.decrypt(data)
+
+    def load_init_sections(self, track: MediaTrack):
+        """下载轨道的初始化段 (EXT-X-MAP)，相同初始化段只下载一次"""
+        if not track.table.init_sections:
+            return
+        init_paths: Dict[str, str] = {}
+        for i, segment in enumerate(track.segments):
+            init = segment.init_section
+            if not init or not init.uri:
+                continue
+            
+            init_url = init.uri
+            cache_key = f"{init_url}|{init.byterange or ''}"
+            if cache_key not in init_paths:
+                init_path = os.path.join(track.temp_dir, f"init_{len(init_paths):03d}.mp4")
+                # 断点续传时初始化段已在磁盘上
+                if not os.path.exists(init_path):
+                    init_data = self.download_with_retry(init_url, byte_range=parse_byterange(init.byterange))
+                    if not init_data:
+                        raise Exception(f"无法下载初始化段: {init_url}")
+                    seg_key = getattr(segment, 'key', None)
+                    if seg_key and seg_key.iv:
+                        init_data = self.decrypt_ts(init_data, segment)
+                    write_atomic(init_path, init_data)
+                    print(f"🧩 初始化段加载成功 ({track.kind}): {len(init_data)} bytes")
+                init_paths[cache_key] = init_path
+            track.init_files[i] = init_paths[cache_key]
+
+    def _can_coalesce(self, track: MediaTrack, batch: List, i: int) -> bool:
+        """判断分片 i 能否并入当前批次：同一资源且字节区间紧邻"""
+        prev = batch[-1][0]
+        prev_range = track.byte_ranges[prev]
+        cur_range = track.byte_ranges[i]
+        if not prev_range or not cur_range or prev != i - 1:
+            return False
+        if track.urls[prev] != track.urls[i] or cur_range[0] != prev_range[1] + 1:
+            return False
+        return cur_range[1] - track.byte_ranges[batch[0][0]][0] + 1 <= self.range_coalesce_bytes
 
-    def download_segments(self, segments: List, base_uri: str, temp_dir: str, 
+    def download_segments(self, tracks: List[MediaTrack],
                          progress_callback: Optional[Callable] = None) -> bool:
-        """下载分片 - 支持断点续传"""
-        # 检查临时目录中已下载的文件
-        existing_files = set()
-        if os.path.exists(temp_dir):
-            for f in os.listdir(temp_dir):
-                if f.endswith('.ts') and f.replace('.ts', '').isdigit():
-                    existing_files.add(int(f.replace('.ts', '')))
-        
+        """下载分片 - 支持断点续传，所有轨道共享同一个线程池"""
         task_queue = queue.Queue()
+        total_segments = 0
+        downloaded_segments = 0
         
-        # 只下载未完成的分片
-        for i, segment in enumerate(segments):
-            if i not in existing_files:
-                filename = f"{i:05d}.ts"
-                task_queue.put((i, segment, filename))
+        for track in tracks:
+            os.makedirs(track.temp_dir, exist_ok=True)
+            if track.is_fmp4:
+                with self.tracer.span('init_sections', track=track.kind):
+                    self.load_init_sections(track)
+            
+            if self.checksums:
+                track.manifest = ChecksumManifest(track.temp_dir)
+            
+            # 检查临时目录中已下载的文件，有校验和清单时丢弃损坏的分片
+            suffix = f".{track.segment_ext}"
+            existing_files = set()
+            for f in os.listdir(track.temp_dir):
+                if f.endswith(suffix) and f[:-len(suffix)].isdigit():
+                    if track.manifest and not track.manifest.verify_file(os.path.join(track.temp_dir, f)):
+                        logger.warning(f"已下载分片校验失败，重新下载: {track.kind}/{f}")
+                        os.remove(os.path.join(track.temp_dir, f))
+                        continue
+                    existing_files.add(int(f[:-len(suffix)]))
+            for i in existing_files:
+                if i < len(track.segments):
+                    track.mark_completed(i)
+            if existing_files and track.segment_ext == 'ts':
+                with open(track.segment_path(min(existing_files)), 'rb') as f:
+                    track.detect_container(f.read(4096))
+            
+            # 只下载未完成的分片，同一资源上相邻的字节区间合并为一个请求
+            # 每批分片数不超过 待下载数/线程数，保证线程都有活干
+            pending_count = len(track.segments) - len(existing_files)
+            max_batch = max(1, -(-pending_count // self.max_threads))
+            batch = []
+            for i, segment in enumerate(track.segments):
+                if i in existing_files:
+                    continue
+                if batch and (len(batch) >= max_batch or not self._can_coalesce(track, batch, i)):
+                    task_queue.put((track, batch, time.perf_counter()))
+                    batch = []
+                batch.append((i, segment, f"{i:05d}{suffix}"))
+            if batch:
+                task_queue.put((track, batch, time.perf_counter()))
+            
+            total_segments += len(track.segments)
+            downloaded_segments += len(existing_files)
         
-        total_segments = len(segments)
-        downloaded_segments = len(existing_files)
         total_tasks = task_queue.qsize()
+        remaining_segments = total_segments - downloaded_segments
+        with self.stats_lock:
+            self.total_segments = total_segments
+            self.completed_segments = downloaded_segments
+            self.completed_segment_bytes = sum(
+                os.path.getsize(f) for track in tracks for f in track.segment_files())
         
         if downloaded_segments > 0:
-            print(f"🔄 发现 {downloaded_segments} 个已下载分片，继续下载剩余 {total_tasks} 个分片")
+            print(f"🔄 发现 {downloaded_segments} 个已下载分片，继续下载剩余 {remaining_segments} 个分片")
+        if total_tasks < remaining_segments:
+            print(f"🧲 字节区间合并: {remaining_segments} 个分片合并为 {total_tasks} 个请求")
         
         completed_tasks = 0
         lock = threading.Lock()
         last_progress_update = 0
+        failed_attempts: Dict[Tuple[str, int], int] = {}
+        
+        # 对冲请求在独立线程池中执行，下载线程负责等待和择优
+        hedge_executor = ThreadPoolExecutor(max_workers=self.max_threads * 2) if self.hedge else None
         
         def worker():
             nonlocal completed_tasks, last_progress_update
@@ -206,56 +645,115 @@ class M3U8Downloader:
                     time.sleep(0.5)
                 
                 try:
-                    i, segment, filename = task_queue.get(timeout=1)
+                    track, batch, enqueued_at = task_queue.get(timeout=1)
                 except queue.Empty:
                     break
+                self.tracer.add('queue_wait', 'segment', enqueued_at, time.perf_counter(),
+                                track=track.kind, segment=batch[0][0])
+                metrics.SEGMENT_QUEUE_DEPTH.set(task_queue.qsize(), task_id=self.task_id)
                 
                 try:
-                    seg_url = segment.absolute_uri or urljoin(base_uri, segment.uri)
-                    ts_data = self.download_with_retry(seg_url)
+                    first = batch[0][0]
+                    last = batch[-1][0]
+                    seg_url = track.urls[first]
+                    byte_range = None
+                    if track.byte_ranges[first]:
+                        byte_range = (track.byte_ranges[first][0], track.byte_ranges[last][1])
+                    fetch_start = time.perf_counter()
+                    data = self.fetch_segment(seg_url, byte_range, hedge_executor)
+                    fetch_end = time.perf_counter()
+                    metrics.SEGMENT_FETCH_SECONDS.observe(fetch_end - fetch_start, host=urlparse(seg_url).netloc)
+                    self.tracer.add('fetch', 'segment', fetch_start, fetch_end,
+                                    track=track.kind, segment=first, count=len(batch))
                     
-                    if ts_data:
-                        if self.key:
-                            ts_data = self.decrypt_ts(ts_data, segment)
+                    if data:
+                        written = 0
+                        for i, segment, filename in batch:
+                            ts_data = data
+                            if byte_range:
+                                start, end = track.byte_ranges[i]
+                                ts_data = data[start - byte_range[0]:end - byte_range[0] + 1]
+                            with self.tracer.span('decrypt', 'segment', track=track.kind, segment=i):
+                                ts_data = self.decrypt_ts(ts_data, segment)
+                            track.detect_container(ts_data)
+                            if self.verify:
+                                try:
+                                    verify_segment(ts_data, track.container)
+                                except SegmentVerificationError as e:
+                                    metrics.VERIFY_FAILURES.inc(reason=e.reason)
+                                    logger.warning(f"分片校验失败 {track.kind}/{filename}: {str(e)}")
+                                    raise
+                            
+                            with metrics.WRITE_SECONDS.time(), \
+                                    self.tracer.span('write', 'segment', track=track.kind, segment=i):
+                                track.store.put(filename, ts_data)
+                            if track.manifest:
+                                track.manifest.record(filename, ts_data)
+                            track.mark_completed(i)
+                            written += len(ts_data)
+                        metrics.SEGMENTS_DOWNLOADED.inc(len(batch))
                         
-                        ts_path = os.path.join(temp_dir, filename)
-                        with open(ts_path, 'wb') as f:
-                            f.write(ts_data)
+                        with self.stats_lock:
+                            self.completed_segments += len(batch)
+                            self.completed_segment_bytes += written
                         
                         with lock:
-                            completed_tasks += 1
+                            completed_tasks += len(batch)
                             current_downloaded = downloaded_segments + completed_tasks
                             current_progress = (current_downloaded / total_segments) * 100
                             
                             if progress_callback:
                                 speed_str = self._format_speed(self.current_speed)
-                                progress_callback(current_progress, current_downloaded, total_segments, speed_str)
+                                progress_callback(current_progress, current_downloaded, total_segments,
+                                                  speed_str, self.eta_seconds())
                             
                             if int(current_progress) > last_progress_update or completed_tasks % 5 == 0:
                                 speed_str = self._format_speed(self.current_speed)
-                                print(f"📊 进度: {current_progress:.1f}% ({current_downloaded}/{total_segments}), 速度: {speed_str}")
+                                eta_str = format_duration(self.eta_seconds()) or '未知'
+                                print(f"📊 进度: {current_progress:.1f}% ({current_downloaded}/{total_segments}), 速度: {speed_str}, 剩余: {eta_str}")
                                 last_progress_update = int(current_progress)
                     
                 except Exception as e:
                     logger.error(f"分片下载失败: {str(e)}")
-                    task_queue.put((i, segment, filename))
+                    key = (track.kind, batch[0][0])
+                    with lock:
+                        failed_attempts[key] = failed_attempts.get(key, 0) + 1
+                        attempts = failed_attempts[key]
+                    if attempts >= self.max_segment_attempts:
+                        # 同一分片反复失败（源站内容损坏、密钥错误），尽早结束任务而不是无限重试
+                        self.error = f"分片 {track.kind}/{batch[0][2]} 连续 {attempts} 次失败: {str(e)}"
+                        self.is_stopped = True
+                    else:
+                        task_queue.put((track, batch, time.perf_counter()))
                 finally:
                     task_queue.task_done()
+            
+            # end-game：队列已空，空闲线程为剩余的慢分片发起对冲
+            if self.hedge and not self.is_stopped:
+                self.request_endgame_hedge()
         
         # 限制实际线程数不超过剩余任务数
         actual_threads = min(self.max_threads, total_tasks, 20)
         threads = []
         for _ in range(actual_threads):
-            t = threading.Thread(target=worker, daemon=True)
+            t = threading.Thread(target=self._profiled(worker), daemon=True)
             t.start()
             threads.append(t)
         
         for t in threads:
             t.join()
         
+        metrics.SEGMENT_QUEUE_DEPTH.remove(task_id=self.task_id)
+        
+        if hedge_executor:
+            hedge_executor.shutdown(wait=False)
+            if self.hedge_count:
+                print(f"🏁 对冲请求: {self.hedge_count} 次，其中 {self.hedge_wins} 次对冲先完成")
+        
         return not self.is_stopped and (completed_tasks > 0 or downloaded_segments == total_segments)
 
-    def _format_speed(self, speed_bytes: float) -> str:
+    @staticmethod
+    def _format_speed(speed_bytes: float) -> str:
         """格式化速度显示"""
         if speed_bytes <= 0:
             return "0 B/s"
@@ -267,41 +765,283 @@ class M3U8Downloader:
         else:
             return f"{speed_bytes/(1024*1024):.1f} MB/s"
 
-    def merge_with_ffmpeg(self, ts_files: List[str], output_path: str) -> bool:
-        """使用FFmpeg合并视频"""
+    def concat_segments(self, track: MediaTrack, output_path: str) -> bool:
+        """直接按字节拼接：fMP4 为初始化段 + 分片，打包音频为连续的裸流，无需 FFmpeg 重新封装"""
+        try:
+            current_init = None
+            with open(output_path, 'wb') as out:
+                for i, init_path in enumerate(track.init_files):
+                    if init_path and init_path != current_init:
+                        with open(init_path, 'rb') as f:
+                            shutil.copyfileobj(f, out, 1024 * 1024)
+                        current_init = init_path
+                    
+                    name = track.segment_name(i)
+                    out.write(track.store.read(name))
+                    track.store.discard(name)
+            return True
+        except Exception as e:
+            logger.error(f"fMP4拼接失败: {str(e)}")
+            return False
+
+    def merge_tracks(self, tracks: List[MediaTrack], output_path: str) -> bool:
+        """合并所有轨道，单个 fMP4 轨道直接拼接，其余交给 FFmpeg"""
+        if len(tracks) == 1 and tracks[0].is_fmp4:
+            print("🧩 fMP4 分片，直接拼接输出")
+            with metrics.MERGE_SECONDS.time(method="concat"):
+                return self.concat_segments(tracks[0], output_path)
+        with metrics.MERGE_SECONDS.time(method="ffmpeg"):
+            return self.merge_with_ffmpeg(tracks, output_path)
+
+    def merge_with_ffmpeg(self, tracks: List[MediaTrack], output_path: str) -> bool:
+        """使用FFmpeg合并视频 - 视频/音频/字幕轨道一次性封装"""
         ffmpeg_path = self._get_ffmpeg_path()
         if not ffmpeg_path:
             logger.error("FFmpeg未找到")
             return False
         
         try:
-            filelist_path = os.path.join(os.path.dirname(ts_files[0]), "filelist.txt")
-            with open(filelist_path, 'w', encoding='utf-8') as f:
-                for tf in ts_files:
-                    f.write(f"file '{os.path.basename(tf)}'\n")
+            cmd = [ffmpeg_path]
+            stdin_track = None
+            for track in tracks:
+                if track.kind == 'subtitles':
+                    # WebVTT 分片带绝对时间，先合并为一个文件（concat 会按文件时长依次平移，字幕错位）
+                    subtitle_path = os.path.join(track.temp_dir, "merged.vtt")
+                    content, first_cue = merge_webvtt(
+                        track.store.read(track.segment_name(i))
+                        for i in range(len(track.segments)) if track.has_segment(i))
+                    with open(subtitle_path, 'w', encoding='utf-8') as f:
+                        f.write(content)
+                    cmd += ['-itsoffset', f'{first_cue:.3f}', '-i', subtitle_path]
+                    continue
+                
+                if track.is_fmp4 or track.is_packed_audio:
+                    # fMP4 / 打包音频轨道先拼接成完整文件再作为输入
+                    # （打包音频是裸流，按字节拼接即可；concat 分离器会按文件时长重排时间戳）
+                    if track.is_fmp4:
+                        joined_path = os.path.join(track.temp_dir, "joined.mp4")
+                    else:
+                        joined_path = os.path.join(track.temp_dir, f"joined.{track.segment_ext}")
+                    if not self.concat_segments(track, joined_path):
+                        return False
+                    if track.is_packed_audio:
+                        cmd += ['-f', track.container]
+                    cmd += ['-i', joined_path]
+                    continue
+                
+                if track.store.memory_count() and stdin_track is None:
+                    # 内存中的 TS 分片按顺序写入 FFmpeg 标准输入，不落盘
+                    stdin_track = track
+                    cmd += ['-f', 'mpegts', '-i', 'pipe:0']
+                    continue
+                
+                # 只有一个标准输入，其余轨道的内存分片写入磁盘
+                track.store.spill()
+                filelist_path = os.path.join(track.temp_dir, "filelist.txt")
+                with open(filelist_path, 'w', encoding='utf-8') as f:
+                    for tf in track.segment_files():
+                        f.write(f"file '{os.path.basename(tf)}'\n")
+                cmd += ['-f', 'concat', '-safe', '0', '-i', filelist_path]
             
-            cmd = [
-                ffmpeg_path,
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', filelist_path,
-                '-c', 'copy',
+            if len(tracks) > 1:
+                has_audio = any(t.kind == 'audio' for t in tracks)
+                for idx, track in enumerate(tracks):
+                    if track.kind == 'video':
+                        # 有独立音轨时只取视频流，否则保留视频自带音频
+                        cmd += ['-map', f'{idx}:v' if has_audio else str(idx)]
+                    elif track.kind == 'audio':
+                        cmd += ['-map', f'{idx}:a']
+                    elif track.kind == 'subtitles':
+                        cmd += ['-map', f'{idx}:s']
+                        if track.language:
+                            cmd += ['-metadata:s:s:0', f'language={track.language}']
+            
+            cmd += ['-c', 'copy']
+            if any(t.kind == 'subtitles' for t in tracks):
+                cmd += ['-c:s', 'mov_text']
+            cmd += [
                 '-movflags', 'faststart',
                 '-y',
                 '-loglevel', 'quiet',
                 output_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return result.returncode == 0
+            if stdin_track is None:
+                result = subprocess.run(cmd, capture_output=True, text=True, stdin=subprocess.DEVNULL)
+                return result.returncode == 0
+            return self._run_ffmpeg_with_stdin(cmd, stdin_track)
                 
         except Exception as e:
             logger.error(f"FFmpeg合并失败: {str(e)}")
             return False
 
+    def _run_ffmpeg_with_stdin(self, cmd: List[str], track: MediaTrack) -> bool:
+        """运行 FFmpeg，并把轨道分片按顺序写入其标准输入，写完即释放内存"""
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            for i in range(len(track.segments)):
+                name = track.segment_name(i)
+                if track.store.exists(name):
+                    proc.stdin.write(track.store.read(name))
+                    track.store.discard(name)
+        except BrokenPipeError:
+            logger.error("FFmpeg提前退出")
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        return proc.wait() == 0
+
+    def _load_playlist(self, url: str) -> SegmentTable:
+        """下载并解析媒体播放列表"""
+        with self.tracer.span('playlist', url=url):
+            content = self.download_with_retry(url)
+            if not content:
+                raise Exception(f"无法下载播放列表: {url}")
+            return parse_media_playlist(content, url)
+
+    def _select_rendition(self, variant, media_type: str):
+        """从变体流关联的 EXT-X-MEDIA 分组中选择一个独立轨道（优先 DEFAULT=YES）"""
+        candidates = [m for m in variant.media
+                      if m.type == media_type and m.uri]
+        if not candidates:
+            return None
+        for media in candidates:
+            if (media.default or '').upper() == 'YES':
+                return media
+        return candidates[0]
+
+    def _probe_mirror(self, url: str):
+        resp = self.transport.get(url, headers=self._get_domain_headers(url), timeout=10)
+        try:
+            resp.raise_for_status()
+        finally:
+            resp.close()
+
+    def _probe_segment_size(self, url: str) -> Optional[int]:
+        try:
+            resp = self.transport.head(url, headers=self._get_domain_headers(url), timeout=10)
+            length = resp.headers.get('Content-Length')
+            if resp.ok and length and length.isdigit() and int(length) > 0:
+                return int(length)
+        except Exception as e:
+            logger.warning(f"探测分片大小失败: {str(e)}")
+        return None
+
+    def estimate_size(self, tracks: List[MediaTrack], samples: int = 3) -> Optional[int]:
+        """估算所有轨道的分片总大小
+
+        EXT-X-BYTERANGE 直接累加区间长度；否则 HEAD 抽样几个分片取平均大小 × 分片数；
+        探测失败时用主播放列表的 BANDWIDTH × 总时长。
+        """
+        total = 0
+        for track in tracks:
+            count = len(track.segments)
+            if count and all(track.byte_ranges):
+                total += sum(end - start + 1 for start, end in track.byte_ranges)
+                continue
+            picks = sorted({int(i * (count - 1) / max(1, samples - 1)) for i in range(samples)}) if count else []
+            sizes = [size for size in (self._probe_segment_size(track.urls[i]) for i in picks) if size]
+            if sizes:
+                total += sum(sizes) // len(sizes) * count
+            elif track.kind == 'video' and self.variant_info.get('bandwidth'):
+                duration = sum(track.table.durations)
+                total += int(self.variant_info['bandwidth'] * duration / 8)
+            elif track.kind != 'subtitles':
+                return None
+        return total
+
+    def interrupt(self):
+        """服务关闭：停止下载，把内存中的分片写入工作目录，保留已下载的进度"""
+        self.interrupted = True
+        self.is_stopped = True
+        self.spill_staged()
+
+    def spill_staged(self):
+        """把内存中暂存的分片写入工作目录（等待合并时让出共享内存预算）"""
+        for track in self.tracks:
+            track.store.spill()
+
+    @property
+    def staged_disk_bytes(self) -> int:
+        """本次下载写入工作目录的分片字节数（内存中暂存的分片不占磁盘，不计入）"""
+        return sum(track.store.disk_bytes for track in self.tracks)
+
+    def get_track(self, kind: str) -> Optional[MediaTrack]:
+        for track in self.tracks:
+            if track.kind == kind:
+                return track
+        return None
+
+    def freeze_playlists(self):
+        """分片全部下载后固定各轨道的本地播放列表（带 ENDLIST）
+
+        合并阶段会逐个消费并释放分片，EVENT 播放列表只能增长，不能随之缩短。
+        """
+        for track in self.tracks:
+            track.frozen_playlist = self.local_media_playlist(track)
+
+    def local_media_playlist(self, track: MediaTrack) -> str:
+        """已下载（已解密）分片组成的本地媒体播放列表，随下载进度增长
+
+        只列出从第一个分片开始连续的已完成分片，全部完成后加上 ENDLIST。
+        分片地址相对于播放列表: <kind>/<文件名>
+        """
+        if track.frozen_playlist is not None:
+            return track.frozen_playlist
+        lines = ['#EXTM3U', '#EXT-X-VERSION:7' if track.is_fmp4 else '#EXT-X-VERSION:3',
+                 f'#EXT-X-TARGETDURATION:{max([int(-(-d // 1)) for d in track.table.durations] + [1])}',
+                 '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:EVENT']
+        current_init = None
+        available = track.contiguous_completed()
+        durations = track.table.durations
+        for i in range(available):
+            duration = durations[i]
+            init_path = track.init_files[i]
+            if init_path and init_path != current_init:
+                lines.append(f'#EXT-X-MAP:URI="{track.kind}/{os.path.basename(init_path)}"')
+                current_init = init_path
+            lines.append(f'#EXTINF:{duration:.3f},')
+            lines.append(f'{track.kind}/{track.segment_name(i)}')
+        if available == len(durations):
+            lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def local_master_playlist(self) -> str:
+        """视频 + 独立音频/字幕轨道的本地主播放列表"""
+        lines = ['#EXTM3U']
+        attrs = [f'BANDWIDTH={self.variant_info.get("bandwidth") or 1000000}']
+        if self.variant_info.get('resolution'):
+            width, height = self.variant_info['resolution']
+            attrs.append(f'RESOLUTION={width}x{height}')
+        for track in self.tracks:
+            if track.kind == 'video':
+                continue
+            media_type, group = ('AUDIO', 'audio') if track.kind == 'audio' else ('SUBTITLES', 'subs')
+            media = [f'TYPE={media_type}', f'GROUP-ID="{group}"', f'NAME="{track.name or track.kind}"',
+                     'DEFAULT=YES', 'AUTOSELECT=YES', f'URI="{track.kind}.m3u8"']
+            if track.language:
+                media.append(f'LANGUAGE="{track.language}"')
+            lines.append('#EXT-X-MEDIA:' + ','.join(media))
+            attrs.append(f'{media_type}="{group}"')
+        lines.append('#EXT-X-STREAM-INF:' + ','.join(attrs))
+        lines.append('video.m3u8')
+        return '\n'.join(lines) + '\n'
+
     def download(self, progress_callback: Optional[Callable] = None, 
-                status_callback: Optional[Callable] = None) -> bool:
-        """主下载方法"""
+                status_callback: Optional[Callable] = None,
+                admission_callback: Optional[Callable] = None,
+                merge_slot: Optional[Callable] = None) -> bool:
+        """主下载方法
+
+        admission_callback(估算大小, 已下载字节) 在开始下载分片前调用，
+        磁盘空间不足时抛出 InsufficientDiskSpace，任务保留工作目录重新排队。
+        merge_slot() 在分片全部下载后调用，返回的上下文管理器限定合并阶段
+        （调用方借此释放下载槽位，并在独立的合并队列中排队）。
+        """
+        keep_work_dir = False
+        self.completed = False
         try:
             if status_callback:
                 status_callback("解析M3U8文件...")
@@ -309,25 +1049,38 @@ class M3U8Downloader:
             print(f"🔗 开始处理URL: {self.url}")
             print(f"🎯 使用线程数: {self.max_threads}")
             
+            if len(self.mirror_pool) > 1:
+                if status_callback:
+                    status_callback("探测镜像...")
+                with self.tracer.span('probe_mirrors'):
+                    self.mirror_pool.probe(self._probe_mirror)
+            
             # 初始化下载统计
             self.downloaded_bytes = 0
             self.start_time = time.time()
-            self.current_speed = 0
+            self.meter.reset()
             
             # 下载M3U8文件
-            m3u8_content = self.download_with_retry(self.url)
-            if not m3u8_content:
-                raise Exception("无法下载M3U8文件")
-            
-            content_text = m3u8_content.decode('utf-8', errors='ignore')
-            print(f"📄 M3U8内容类型: {'主播放列表' if '#EXT-X-STREAM-INF' in content_text else '媒体播放列表'}")
-            
-            # 解析M3U8
-            playlist = m3u8.loads(content_text, uri=self.url)
+            with self.tracer.span('playlist', url=self.url):
+                m3u8_content = self.download_with_retry(self.url)
+                if not m3u8_content:
+                    raise Exception("无法下载M3U8文件")
+                
+                content_text = m3u8_content.decode('utf-8', errors='ignore')
+                is_master = is_master_playlist(content_text)
+                print(f"📄 M3U8内容类型: {'主播放列表' if is_master else '媒体播放列表'}")
+                
+                # 主播放列表条目很少，用 m3u8 库解析；媒体播放列表解析为紧凑分片表
+                if is_master:
+                    playlist = m3u8.loads(content_text, uri=self.url)
+                else:
+                    playlist = parse_media_playlist(content_text, self.url)
+                del m3u8_content, content_text
             actual_url = self.url
+            renditions = []
             
             # 处理主播放列表
-            if playlist.is_variant:
+            if is_master:
                 if status_callback:
                     status_callback("选择最高质量流...")
                 
@@ -339,78 +1092,148 @@ class M3U8Downloader:
                 
                 if playlist.playlists:
                     selected_playlist = playlist.playlists[0]
+                    self.variant_info = {
+                        'bandwidth': getattr(selected_playlist.stream_info, 'bandwidth', None),
+                        'resolution': getattr(selected_playlist.stream_info, 'resolution', None),
+                    }
                     stream_url = selected_playlist.absolute_uri or urljoin(self.url, selected_playlist.uri)
                     print(f"🎬 选择流: {stream_url}")
                     
-                    stream_content = self.download_with_retry(stream_url)
-                    if not stream_content:
-                        raise Exception("无法下载媒体流")
+                    # 独立的音频/字幕轨道 (EXT-X-MEDIA)
+                    for media_type, kind in (('AUDIO', 'audio'), ('SUBTITLES', 'subtitles')):
+                        media = self._select_rendition(selected_playlist, media_type)
+                        if media:
+                            media_url = media.absolute_uri or urljoin(self.url, media.uri)
+                            print(f"🎧 选择{kind}轨道: {media.name or media.group_id} ({media.language or '未知语言'})")
+                            renditions.append((kind, media_url, media))
                     
-                    playlist = m3u8.loads(stream_content.decode('utf-8', errors='ignore'), uri=stream_url)
+                    try:
+                        playlist = self._load_playlist(stream_url)
+                    except Exception:
+                        raise Exception("无法下载媒体流")
                     actual_url = stream_url
-                    print(f"✅ 媒体播放列表加载成功，包含 {len(playlist.segments)} 个分片")
+                    print(f"✅ 媒体播放列表加载成功，包含 {len(playlist)} 个分片")
                 else:
                     raise Exception("主播放列表中无可用流")
             
-            base_uri = playlist.base_uri or '/'.join(actual_url.split('/')[:-1]) + '/'
-            if not base_uri.endswith('/'):
-                base_uri += '/'
-            
-            segments = [seg for seg in playlist.segments if seg.uri]
-            print(f"📊 有效分片数量: {len(segments)}")
-            
-            if not segments:
-                raise Exception("无有效分片")
-            
-            # 处理加密
-            if playlist.keys and any(k for k in playlist.keys if k):
-                first_key = next(k for k in playlist.keys if k)
-                print(f"🔐 检测到加密: {first_key.method}")
-                self.load_key(first_key.uri, base_uri)
-                if status_callback:
-                    status_callback("处理加密...")
-            
-            # 创建临时目录
-            temp_dir = tempfile.mkdtemp(prefix=f"m3u8_{self.task_id}_")
+            # 固定的工作目录：同一任务重新开始时复用已下载的分片
+            temp_dir = self.work_dir
+            os.makedirs(temp_dir, exist_ok=True)
+            tracks: List[MediaTrack] = []
             
             try:
+                video_track = MediaTrack('video', playlist, actual_url, os.path.join(temp_dir, 'video'))
+                print(f"📊 有效分片数量: {len(video_track.segments)}")
+                
+                if not video_track.segments:
+                    raise Exception("无有效分片")
+                
+                tracks = [video_track]
+                for kind, media_url, media in renditions:
+                    try:
+                        media_playlist = self._load_playlist(media_url)
+                    except Exception as e:
+                        # 字幕缺失不影响主任务，音频缺失则无法得到完整视频
+                        if kind == 'subtitles':
+                            logger.warning(f"字幕轨道加载失败，已跳过: {str(e)}")
+                            continue
+                        raise
+                    track = MediaTrack(kind, media_playlist, media_url, os.path.join(temp_dir, kind),
+                                       name=media.name, language=media.language)
+                    if track.segments:
+                        print(f"✅ {kind}轨道加载成功，包含 {len(track.segments)} 个分片")
+                        tracks.append(track)
+                
+                self.tracks = tracks
+                
+                # 处理加密
+                with self.tracer.span('keys'):
+                    for track in tracks:
+                        self.load_track_keys(track)
+                if self.keys and status_callback:
+                    status_callback("处理加密...")
+                
+                # 磁盘空间预留
+                if admission_callback:
+                    with self.tracer.span('estimate'):
+                        self.estimated_size = self.estimate_size(tracks)
+                    existing = sum(os.path.getsize(f) for track in tracks for f in track.segment_files())
+                    if self.estimated_size:
+                        print(f"💾 预计大小: {format_bytes(self.estimated_size)}")
+                    try:
+                        admission_callback(self.estimated_size, existing)
+                    except InsufficientDiskSpace:
+                        keep_work_dir = True
+                        raise
+                
                 # 下载分片
                 if status_callback:
                     status_callback("下载分片...")
                 
-                print(f"🚀 开始下载 {len(segments)} 个分片，使用 {self.max_threads} 线程")
-                success = self.download_segments(segments, base_uri, temp_dir, progress_callback)
+                total = sum(len(t.segments) for t in tracks)
+                print(f"🚀 开始下载 {len(tracks)} 个轨道共 {total} 个分片，使用 {self.max_threads} 线程")
+                with self.tracer.span('segments', count=total):
+                    success = self.download_segments(tracks, progress_callback)
                 
                 if not success:
-                    raise Exception("下载被中止")
+                    raise Exception(self.error or "下载被中止")
                 
-                # 合并视频
-                if status_callback:
-                    status_callback("合并视频...")
+                ts_count = sum(1 for i in range(len(video_track.segments)) if video_track.has_segment(i))
+                print(f"📦 准备合并 {ts_count} 个{'fMP4' if video_track.is_fmp4 else 'TS'}分片 ({len(tracks)} 个轨道)")
                 
-                ts_files = sorted([os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.endswith('.ts')])
-                print(f"📦 准备合并 {len(ts_files)} 个TS文件")
+                if not ts_count:
+                    raise Exception("无分片文件可合并")
                 
-                if not ts_files:
-                    raise Exception("无TS文件可合并")
+                # 边下边播的播放列表从此固定，合并消费分片时不再缩短
+                self.freeze_playlists()
                 
                 os.makedirs(os.path.dirname(self.save_path), exist_ok=True)
                 
-                # 使用FFmpeg合并
-                if not self.merge_with_ffmpeg(ts_files, self.save_path):
+                # 合并视频
+                with ExitStack() as stack:
+                    if merge_slot is not None:
+                        if status_callback:
+                            status_callback("等待合并...")
+                        with self.tracer.span('merge_wait'):
+                            stack.enter_context(merge_slot())
+                    if status_callback:
+                        status_callback("合并视频...")
+                    # fMP4 直接拼接，TS 使用FFmpeg合并
+                    with self.tracer.span('merge'):
+                        merged = self.merge_tracks(tracks, self.save_path)
+                if not merged:
                     raise Exception("视频合并失败")
                 
                 if status_callback:
                     status_callback("下载完成")
                 
+                if len(self.mirror_pool) > 1:
+                    for stats in self.mirror_pool.snapshot():
+                        print(f"🌐 镜像 {stats['url']}: {stats['requests']} 次请求, "
+                              f"{self._format_speed(stats['throughput'])}, 错误 {stats['errors']}")
+                
+                self.completed = True
                 print("🎉 下载任务圆满完成!")
                 return True
                 
             finally:
-                shutil.rmtree(temp_dir, ignore_errors=True)
+                self.tracks = []
+                if self.interrupted and not self.completed:
+                    # 内存中的分片写入工作目录，重启后作为已下载分片复用
+                    for track in tracks:
+                        track.store.spill()
+                    keep_work_dir = True
+                for track in tracks:
+                    track.store.clear()
+                if not keep_work_dir:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
                 
+        except InsufficientDiskSpace:
+            raise
         except Exception as e:
             logger.error(f"下载失败: {str(e)}")
             if status_callback:
                 status_callback(f"失败: {str(e)}")
             return False
+        finally:
+            self.transport.close()
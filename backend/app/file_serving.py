@@ -0,0 +1,153 @@
+import os
+from email.utils import formatdate
+from hashlib import md5
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+# 设置后由 nginx 直接发送文件，API 只负责鉴权，例如 "/protected-downloads/"
+# 需要 nginx 配置对应的 internal location（见 nginx/default.conf）
+ACCEL_REDIRECT_PREFIX = os.environ.get("M3U8_ACCEL_REDIRECT_PREFIX", "")
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """解析单段 Range 请求头，返回闭区间 (start, end)
+
+    无 Range、格式不支持、多段请求或结束位置小于起始位置时返回 None（按完整文件响应，RFC 7233）；
+    起始位置超出文件或后缀长度为 0 时抛出 ValueError（416）。
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    first, last = (part.strip() for part in spec.split("-", 1))
+    if not (first.isdigit() or first == "") or not (last.isdigit() or last == "") or first == last == "":
+        return None
+    if first == "":
+        # 后缀范围: bytes=-500 表示最后500字节
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        # 语法无效的范围，忽略 Range 头
+        return None
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return md5(base.encode()).hexdigest()
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+class RangeFileResponse(FileResponse):
+    """支持 Range/206 的文件响应
+
+    服务器支持 ASGI zerocopysend 扩展时使用 sendfile 发送，
+    否则在线程池中按块读取，不阻塞事件循环。
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path: str, stat_result: os.stat_result, byte_range: Optional[Tuple[int, int]] = None,
+                 **kwargs):
+        super().__init__(path, stat_result=stat_result, **kwargs)
+        self.headers["accept-ranges"] = "bytes"
+        self.byte_range = byte_range
+        if byte_range is not None:
+            start, end = byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+            self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        start, end = self.byte_range or (0, self.stat_result.st_size - 1)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only or end < start:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file.fileno(),
+                            "offset": start, "count": end - start + 1, "more_body": False})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # 文件在发送过程中被截断
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def serve_bytes(request: Request, data: bytes, media_type: str) -> Response:
+    """发送内存中的数据，支持单段 Range"""
+    headers = {"accept-ranges": "bytes"}
+    try:
+        byte_range = parse_range_header(request.headers.get("range"), len(data))
+    except ValueError:
+        return Response(status_code=416, headers={"content-range": f"bytes */{len(data)}"})
+    if byte_range is None:
+        return Response(content=b"" if request.method == "HEAD" else data, media_type=media_type,
+                        headers={**headers, "content-length": str(len(data))})
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{len(data)}"
+    body = b"" if request.method == "HEAD" else data[start:end + 1]
+    return Response(content=body, status_code=206, media_type=media_type,
+                    headers={**headers, "content-length": str(end - start + 1)})
+
+
+def serve_file(request: Request, file_path: str, filename: Optional[str] = None,
+               media_type: str = "application/octet-stream", accel_root: Optional[str] = None,
+               disposition: str = "attachment") -> Response:
+    """发送本地文件：支持 Range/If-Range/HEAD，配置了 X-Accel-Redirect 时交给 nginx
+
+    accel_root 为文件所在的根目录，X-Accel-Redirect 路径为相对该目录的路径。
+    """
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    headers = {}
+    if filename:
+        headers["content-disposition"] = content_disposition(filename, disposition)
+
+    if ACCEL_REDIRECT_PREFIX and accel_root:
+        relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(accel_root))
+        headers["x-accel-redirect"] = ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative.replace(os.sep, "/"))
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    etag = file_etag(stat_result)
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip('"') == etag or if_range == formatdate(stat_result.st_mtime, usegmt=True):
+        try:
+            byte_range = parse_range_header(request.headers.get("range"), stat_result.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{stat_result.st_size}"})
+
+    return RangeFileResponse(file_path, stat_result, byte_range, headers=headers, media_type=media_type,
+                             method=request.method)
@@ -0,0 +1,172 @@
+import os
+import threading
+import zlib
+from typing import Dict, Optional
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# 部分站点在 TS 分片前伪装了图片头，在此范围内查找 TS 起始位置
+TS_SYNC_SEARCH_LIMIT = 4096
+# fMP4 分片常见的首个 box 类型
+FMP4_BOX_TYPES = {b'styp', b'moof', b'sidx', b'emsg', b'prft', b'ftyp', b'moov', b'free'}
+# 打包音频（独立音频轨道常用的裸流分片，前面通常带 ID3 时间戳标签）：扩展名 -> 容器/FFmpeg 格式名
+PACKED_AUDIO_FORMATS = {'aac': 'aac', 'mp3': 'mp3', 'ac3': 'ac3', 'ec3': 'eac3'}
+ID3_HEADER_SIZE = 10
+ADTS_HEADER_SIZE = 7
+# 整段 AES-128 加密的分片解密后末尾保留 PKCS7 填充（最多一个块）
+AES_PADDING_LIMIT = 16
+
+
+class SegmentVerificationError(Exception):
+    """分片内容校验失败（截断、错误页面、密钥错误导致的乱码等）"""
+
+    def __init__(self, reason: str, detail: str):
+        super().__init__(f"{detail} ({reason})")
+        self.reason = reason
+
+
+def find_ts_start(data: bytes) -> Optional[int]:
+    """TS 数据的起始偏移：正常分片为 0，否则查找连续三个包都以同步字节开头的位置"""
+    if data[:1] == b'\x47':
+        return 0
+    limit = min(TS_SYNC_SEARCH_LIMIT, len(data))
+    offset = data.find(b'\x47', 0, limit)
+    while offset != -1:
+        if all(data[pos] == TS_SYNC_BYTE
+               for pos in range(offset, min(offset + 3 * TS_PACKET_SIZE, len(data)), TS_PACKET_SIZE)):
+            return offset
+        offset = data.find(b'\x47', offset + 1, limit)
+    return None
+
+
+def verify_ts(data: bytes):
+    """解密后的 TS 分片：每 188 字节一个同步字节 0x47
+
+    AES 解密后末尾可能带有填充，只检查完整的包。
+    """
+    if not data:
+        raise SegmentVerificationError('empty', "分片内容为空")
+    start = find_ts_start(data)
+    if start is None:
+        raise SegmentVerificationError('ts_sync', "未找到TS同步字节，可能是错误页面或密钥错误")
+    usable = start + (len(data) - start) // TS_PACKET_SIZE * TS_PACKET_SIZE
+    sync_bytes = data[start:usable:TS_PACKET_SIZE]
+    if sync_bytes.count(TS_SYNC_BYTE) != len(sync_bytes):
+        bad = next(i for i, b in enumerate(sync_bytes) if b != TS_SYNC_BYTE)
+        raise SegmentVerificationError(
+            'ts_sync', f"第 {bad} 个TS包同步字节错误 (偏移 {start + bad * TS_PACKET_SIZE})")
+
+
+def verify_fmp4(data: bytes):
+    """fMP4 分片：首个 box 类型合法"""
+    if len(data) < 8 or data[4:8] not in FMP4_BOX_TYPES:
+        raise SegmentVerificationError('fmp4_box', "分片不是有效的fMP4数据")
+
+
+def skip_id3(data: bytes, offset: int = 0) -> int:
+    """跳过 offset 处连续的 ID3v2 标签，返回之后的偏移"""
+    while data[offset:offset + 3] == b'ID3' and len(data) >= offset + ID3_HEADER_SIZE:
+        size = 0
+        for b in data[offset + 6:offset + 10]:
+            size = (size << 7) | (b & 0x7f)
+        footer = ID3_HEADER_SIZE if data[offset + 5] & 0x10 else 0
+        offset += ID3_HEADER_SIZE + size + footer
+    return offset
+
+
+def is_adts_header(data: bytes, offset: int) -> bool:
+    return len(data) >= offset + 2 and data[offset] == 0xff and data[offset + 1] & 0xf6 == 0xf0
+
+
+def sniff_packed_audio(data: bytes) -> Optional[str]:
+    """按开头的字节识别打包音频格式: ID3 标签之后的 ADTS (0xFFF) / AC-3 (0x0B77) / MPEG 音频帧同步"""
+    offset = skip_id3(data)
+    head = data[offset:offset + 6]
+    if len(head) < 2:
+        return None
+    if is_adts_header(data, offset):
+        return 'aac'
+    if head[:2] == b'\x0b\x77':
+        # bsid > 10 为 E-AC-3
+        return 'eac3' if len(head) == 6 and head[5] >> 3 > 10 else 'ac3'
+    if head[0] == 0xff and head[1] & 0xe0 == 0xe0 and (head[1] >> 1) & 0x03:
+        return 'mp3'
+    return None
+
+
+def verify_adts(data: bytes):
+    """ADTS 分片：逐帧按帧长跳转，每一帧都以同步字 0xFFF 开头，中间可夹带 ID3 标签"""
+    offset = skip_id3(data)
+    frames = 0
+    while len(data) - offset > AES_PADDING_LIMIT or (frames == 0 and offset < len(data)):
+        if data[offset:offset + 3] == b'ID3':
+            offset = skip_id3(data, offset)
+            continue
+        if not is_adts_header(data, offset) or len(data) < offset + ADTS_HEADER_SIZE:
+            raise SegmentVerificationError('adts_sync', f"第 {frames} 个ADTS帧同步字错误 (偏移 {offset})")
+        length = ((data[offset + 3] & 0x03) << 11) | (data[offset + 4] << 3) | (data[offset + 5] >> 5)
+        if length < ADTS_HEADER_SIZE:
+            raise SegmentVerificationError('adts_sync', f"ADTS帧长度无效 (偏移 {offset})")
+        offset += length
+        frames += 1
+    if offset > len(data):
+        raise SegmentVerificationError('adts_truncated', f"最后一个ADTS帧不完整: 缺少 {offset - len(data)} 字节")
+
+
+def verify_packed_audio(data: bytes, audio_format: str):
+    """打包音频分片：ADTS 逐帧检查，其余格式检查 ID3 标签之后的帧同步"""
+    if not data:
+        raise SegmentVerificationError('empty', "分片内容为空")
+    if audio_format == 'aac':
+        verify_adts(data)
+    elif sniff_packed_audio(data) != audio_format:
+        raise SegmentVerificationError('audio_sync', f"分片不是有效的{audio_format.upper()}音频数据")
+
+
+def verify_segment(data: bytes, container: str):
+    """按分片容器校验解密后的内容，字幕不校验"""
+    if container == 'ts':
+        verify_ts(data)
+    elif container == 'm4s':
+        verify_fmp4(data)
+    elif container in PACKED_AUDIO_FORMATS.values():
+        verify_packed_audio(data, container)
+
+
+def checksum(data: bytes) -> str:
+    return f"{zlib.crc32(data) & 0xffffffff:08x}"
+
+
+class ChecksumManifest:
+    """轨道目录中的分片校验和清单，断点续传时用于发现磁盘上损坏的分片
+
+    每行一条记录: <文件名> <crc32>，追加写入。
+    """
+
+    FILENAME = 'checksums.txt'
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, self.FILENAME)
+        self.lock = threading.Lock()
+        self.entries: Dict[str, str] = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        self.entries[parts[0]] = parts[1]
+
+    def record(self, filename: str, data: bytes):
+        value = checksum(data)
+        with self.lock:
+            self.entries[filename] = value
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(f"{filename} {value}\n")
+
+    def verify_file(self, path: str) -> bool:
+        """文件与清单一致时返回 True；清单中没有记录的文件视为无法校验"""
+        expected = self.entries.get(os.path.basename(path))
+        if expected is None:
+            return False
+        with open(path, 'rb') as f:
+            return checksum(f.read()) == expected
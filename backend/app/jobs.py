@@ -0,0 +1,67 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+
+class JobManager:
+    """后台作业 - 耗时的维护操作在线程池中执行，接口只返回作业ID"""
+
+    def __init__(self, max_workers: int = 2, history: int = 100):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs: Dict[str, Dict] = {}
+        self.history = history
+        self.lock = threading.Lock()
+
+    def submit(self, kind: str, func: Callable[[], Optional[Dict]], dedupe: bool = True) -> Dict:
+        """提交作业；dedupe 时同类作业未结束则直接返回已有作业"""
+        with self.lock:
+            if dedupe:
+                for job in self.jobs.values():
+                    if job["kind"] == kind and job["status"] in ("pending", "running"):
+                        return dict(job)
+            job = {
+                "job_id": str(uuid.uuid4())[:8],
+                "kind": kind,
+                "status": "pending",
+                "created_at": datetime.utcnow().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self.jobs[job["job_id"]] = job
+            self._trim()
+        self.executor.submit(self._run, job["job_id"], func)
+        return dict(job)
+
+    def _run(self, job_id: str, func: Callable[[], Optional[Dict]]):
+        self._update(job_id, status="running", started_at=datetime.utcnow().isoformat())
+        try:
+            result = func()
+            self._update(job_id, status="completed", result=result)
+        except Exception as e:
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            self._update(job_id, finished_at=datetime.utcnow().isoformat())
+
+    def _update(self, job_id: str, **fields):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+
+    def _trim(self):
+        """只保留最近的已结束作业"""
+        finished = [j for j in self.jobs.values() if j["status"] in ("completed", "failed")]
+        for job in finished[:max(0, len(self.jobs) - self.history)]:
+            self.jobs.pop(job["job_id"], None)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self) -> List[Dict]:
+        with self.lock:
+            return [dict(j) for j in reversed(list(self.jobs.values()))]
@@ -1,23 +1,40 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Set
 import uuid
 import os
-from datetime import datetime, timedelta
+import asyncio
+import anyio
+from datetime import datetime
 import threading
 import time
 import schedule
 import glob
+import json
+import re
+import shutil
+import io
+import pstats
+from sqlalchemy import case
 from sqlalchemy.orm import Session
 
 #from .downloader_fixed import M3U8Downloader
 #from .models import DownloadTask, TaskStatus
 #from .database import get_db, init_db, SessionLocal
-from downloader_fixed import M3U8Downloader
+from downloader_fixed import M3U8Downloader, WORK_ROOT
 from models import DownloadTask, TaskStatus
-from database import get_db, init_db, SessionLocal
+from database import get_db, init_db, SessionLocal, db_path
+from throughput import GLOBAL_METER, format_duration
+from tracing import TRACE_DIR, load_trace, remove_task_traces
+from jobs import JobManager
+from file_serving import serve_file, serve_bytes
+from disk_quota import DiskQuota, InsufficientDiskSpace, format_bytes
+from retention import RetentionEngine, RetentionPolicy
+from postprocess import MergePool
+from transport import TRANSPORTS, DEFAULT_TRANSPORT, http2_available
+import metrics
 
 app = FastAPI(title="M3U8 Downloader - Enhanced Version", version="1.5.0")
 
@@ -35,7 +52,31 @@ MAX_CONCURRENT_TASKS = 5
 MAX_CONCURRENT_TASKS_LIMIT = 10
 active_tasks: Dict[str, M3U8Downloader] = {}
 pending_tasks: List[str] = []
+merging_tasks: Set[str] = set()  # 分片已下载完、已释放下载槽位的任务（仍在 active_tasks 中）
 task_lock = threading.Lock()
+service_stopping = threading.Event()  # 服务关闭中，不再启动新任务
+SHUTDOWN_GRACE_SECONDS = 10  # 关闭时等待任务保存进度的时间
+API_THREADPOOL_SIZE = 64  # 同步接口线程池大小
+job_manager = JobManager()  # 清理等耗时维护操作的后台作业
+# 磁盘空间预留：分片在工作目录，合并输出在下载目录，一个任务约需要 2 倍视频大小
+disk_quota = DiskQuota(WORK_ROOT, "./downloads")
+task_estimates: Dict[str, int] = {}  # 因磁盘空间不足而排队的任务的估算大小
+# 合并/后处理在独立的队列中进行，并发数与下载分开限制
+merge_pool = MergePool()
+# 保留策略：后台持续分批清理过期文件和回收站
+retention_engine = RetentionEngine(SessionLocal.session_factory, "./downloads", RetentionPolicy.from_env(),
+                                   trace_dir=TRACE_DIR)
+
+# 调度相关指标
+metrics.REGISTRY.register(metrics.Gauge(
+    "m3u8_disk_reserved_bytes", "Disk space reserved for running tasks but not yet written",
+    func=lambda: disk_quota.reserved_bytes()))
+metrics.REGISTRY.register(metrics.Gauge(
+    "m3u8_active_tasks", "Tasks currently holding a download slot", func=lambda: download_slots_in_use()))
+metrics.REGISTRY.register(metrics.Gauge(
+    "m3u8_merging_tasks", "Tasks merging or waiting for a merge slot", func=lambda: len(merging_tasks)))
+metrics.REGISTRY.register(metrics.Gauge(
+    "m3u8_pending_tasks", "Tasks waiting in the scheduler queue", func=lambda: len(pending_tasks)))
 
 # 数据库初始化
 @app.on_event("startup")
@@ -44,20 +85,57 @@ async def startup_event():
     os.makedirs("./downloads", exist_ok=True)
     print("✅ 数据库初始化完成")
     print("✅ 下载目录创建完成")
+    reconcile_tasks()
     print("🚀 使用增强版本下载器")
     print(f"🎯 最大并发任务数: {MAX_CONCURRENT_TASKS} (可配置最大{MAX_CONCURRENT_TASKS_LIMIT})")
     print(f"🎯 默认线程数: 10 (可配置最大20)")
     
-    cleanup_thread = threading.Thread(target=run_scheduler, daemon=True)
-    cleanup_thread.start()
-    print("✅ 定时清理任务已启动")
+    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+    scheduler_thread.start()
+    retention_engine.start()
+    policy = retention_engine.policy
+    print(f"✅ 保留策略已启动: 文件保留 {policy.max_age_days} 天，回收站保留 {policy.recycle_bin_days} 天，"
+          f"每 {policy.interval:.0f} 秒检查一次")
+    
+    # 同步接口在线程池中执行，默认40个线程在面板轮询较多时不够用
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+    asyncio.get_running_loop().create_task(monitor_event_loop_lag())
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """服务关闭：停止调度，中断运行中的任务并保留已下载的分片，重启后自动继续"""
+    service_stopping.set()
+    retention_engine.stop()
+    with task_lock:
+        downloaders = list(active_tasks.values())
+    for downloader in downloaders:
+        downloader.interrupt()
+    deadline = time.time() + SHUTDOWN_GRACE_SECONDS
+    while time.time() < deadline:
+        with task_lock:
+            if not active_tasks:
+                break
+        time.sleep(0.2)
+    if downloaders:
+        print(f"⏹️ 已中断 {len(downloaders)} 个任务，重启后自动继续")
+
+async def monitor_event_loop_lag(interval: float = 0.1):
+    """定时器实际唤醒时间与预期的差值即事件循环被阻塞的时间"""
+    max_lag = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        metrics.EVENT_LOOP_LAG_SECONDS.observe(lag)
+        if lag > max_lag:
+            max_lag = lag
+            metrics.EVENT_LOOP_LAG_MAX.set(max_lag)
 
 def run_scheduler():
     """运行定时任务调度器"""
-    schedule.every().day.at("03:00").do(cleanup_old_files_task)
-    schedule.every(6).hours.do(cleanup_old_files_task)
-    
-    print("🕒 定时清理任务安排: 每天03:00和每6小时执行一次")
+    # 因磁盘空间不足排队的任务在空间释放后继续
+    schedule.every(1).minutes.do(start_next_pending_task)
     
     while True:
         try:
@@ -67,60 +145,35 @@ def run_scheduler():
             print(f"❌ 定时任务执行错误: {str(e)}")
             time.sleep(300)
 
-def cleanup_old_files_task():
-    """定时清理旧文件"""
-    try:
-        print(f"🧹 [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 开始定时清理任务...")
-        
-        db = SessionLocal()
-        try:
-            seven_days_ago = datetime.utcnow() - timedelta(days=7)
-            
-            old_tasks = db.query(DownloadTask).filter(
-                DownloadTask.status == TaskStatus.COMPLETED,
-                DownloadTask.updated_at < seven_days_ago
-            ).all()
-            
-            deleted_count = 0
-            for task in old_tasks:
-                file_path = os.path.join("./downloads", task.filename)
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        task.status = TaskStatus.DELETED
-                        deleted_count += 1
-                        print(f"   🗑️ 自动清理文件: {task.filename}")
-                    except Exception as e:
-                        print(f"   ❌ 清理文件失败 {task.filename}: {str(e)}")
-            
-            db.commit()
-            
-            deleted_records = db.query(DownloadTask).filter(
-                DownloadTask.status == TaskStatus.DELETED
-            ).delete()
-            db.commit()
-            
-            print(f"✅ 定时清理完成: 删除 {deleted_count} 个文件, 清理 {deleted_records} 条记录")
-        finally:
-            db.close()
-        
-    except Exception as e:
-        print(f"❌ 定时清理任务失败: {str(e)}")
+def download_slots_in_use() -> int:
+    """占用下载槽位的任务数，等待合并/合并中的任务不计入"""
+    return len(active_tasks) - len(merging_tasks)
+
+def next_admissible_task() -> Optional[str]:
+    """队列中第一个磁盘空间足够的任务（需在 task_lock 内调用）"""
+    for task_id in pending_tasks:
+        estimate = task_estimates.get(task_id)
+        if estimate is None or disk_quota.can_admit(estimate, estimate):
+            return task_id
+    return None
 
-def start_next_pending_task():
-    """启动下一个等待任务"""
+def start_next_pending_task(count: int = 1):
+    """启动下一个（最多 count 个）等待任务，跳过磁盘空间不足的任务"""
+    if service_stopping.is_set():
+        return
     with task_lock:
-        if pending_tasks and len(active_tasks) < MAX_CONCURRENT_TASKS:
-            next_task_id = pending_tasks.pop(0)
+        # 新线程注册到 active_tasks 之前也占用槽位
+        started = 0
+        while started < count and download_slots_in_use() + started < MAX_CONCURRENT_TASKS:
+            next_task_id = next_admissible_task()
+            if not next_task_id:
+                break
+            pending_tasks.remove(next_task_id)
             db = SessionLocal()
             try:
                 task = db.query(DownloadTask).filter(DownloadTask.task_id == next_task_id).first()
                 if task:
-                    request = DownloadRequest(
-                        url=task.url,
-                        filename=task.filename,
-                        max_threads=task.max_threads
-                    )
+                    request = build_download_request(task)
                     thread = threading.Thread(
                         target=run_download_task,
                         args=(next_task_id, request),
@@ -129,17 +182,108 @@ def start_next_pending_task():
                     thread.start()
                     task.status = TaskStatus.DOWNLOADING
                     db.commit()
+                    started += 1
                     print(f"🚀 从队列启动任务: {next_task_id}")
             finally:
                 db.close()
 
+WORK_DIR_PATTERN = re.compile(r"m3u8_([0-9a-f]{8})")
+# 工作目录的归属标记：同一工作根目录可能被多个实例（或基准测试）共用，只清理本实例创建的目录
+WORK_DIR_OWNER_FILE = ".owner"
+WORK_DIR_OWNER = os.path.abspath(db_path)
+
+def claim_work_dir(work_dir: str):
+    """在任务工作目录中写入本实例的归属标记"""
+    os.makedirs(work_dir, exist_ok=True)
+    with open(os.path.join(work_dir, WORK_DIR_OWNER_FILE), "w", encoding="utf-8") as f:
+        f.write(WORK_DIR_OWNER)
+
+def owns_work_dir(work_dir: str) -> bool:
+    try:
+        with open(os.path.join(work_dir, WORK_DIR_OWNER_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() == WORK_DIR_OWNER
+    except OSError:
+        return False
+
+def work_dir_segments(task_id: str) -> int:
+    """任务工作目录中已下载的分片数"""
+    work_dir = os.path.join(WORK_ROOT, f"m3u8_{task_id}")
+    return sum(len(glob.glob(os.path.join(work_dir, kind, pattern)))
+               for kind in ("video", "audio", "subtitles") for pattern in ("*.ts", "*.m4s", "*.vtt"))
+
+def reconcile_tasks():
+    """服务重启后恢复中断的任务
+
+    重启前处于下载中/排队状态的任务重新加入调度队列（原来正在下载的排在前面），
+    重新开始时直接复用工作目录中已下载的分片；本实例已完成、已删除任务残留的工作目录被清理，
+    没有本实例归属标记的目录（其他实例、命令行）保持不动。
+    """
+    db = SessionLocal()
+    try:
+        interrupted = db.query(DownloadTask).filter(
+            DownloadTask.status.in_([TaskStatus.DOWNLOADING, TaskStatus.QUEUED, TaskStatus.PENDING])
+        ).order_by(case((DownloadTask.status == TaskStatus.DOWNLOADING, 0), else_=1),
+                   DownloadTask.created_at).all()
+        with task_lock:
+            for task in interrupted:
+                if task.task_id in pending_tasks or task.task_id in active_tasks:
+                    continue
+                segments = work_dir_segments(task.task_id)
+                if task.status == TaskStatus.DOWNLOADING:
+                    print(f"🔁 恢复中断的任务: {task.task_id} (已下载 {segments} 个分片, 进度 {task.progress:.1f}%)")
+                task.status = TaskStatus.QUEUED
+                task.download_speed = None
+                pending_tasks.append(task.task_id)
+        db.commit()
+        
+        # 清理不再需要的工作目录（只处理任务ID格式、带本实例归属标记的目录）
+        removed = 0
+        for work_dir in glob.glob(os.path.join(WORK_ROOT, "m3u8_*")):
+            match = WORK_DIR_PATTERN.fullmatch(os.path.basename(work_dir))
+            if not match or not os.path.isdir(work_dir) or not owns_work_dir(work_dir):
+                continue
+            task_id = match.group(1)
+            task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
+            if task is None or task.status in (TaskStatus.COMPLETED, TaskStatus.DELETED):
+                shutil.rmtree(work_dir, ignore_errors=True)
+                removed += 1
+        if interrupted or removed:
+            print(f"✅ 任务恢复: {len(interrupted)} 个任务重新排队，清理 {removed} 个残留工作目录")
+    finally:
+        db.close()
+    start_next_pending_task(MAX_CONCURRENT_TASKS)
+
 class DownloadRequest(BaseModel):
     url: str
     filename: str
     max_threads: int = 10  # 默认改为10线程
+    mirrors: List[str] = []  # 等价的镜像播放列表地址
+    hedge: bool = False  # 对慢分片发起对冲请求
+    trace: bool = False  # 记录分阶段/分片耗时
+    profile: bool = False  # 在 cProfile 下运行任务（包括分片下载线程）
+    verify: bool = True  # 校验分片长度和 TS 同步字节，损坏的分片立即重试
+    checksums: bool = False  # 记录分片校验和，断点续传时校验已下载的分片
+    transport: Optional[str] = None  # http1 / http2，默认取 M3U8_TRANSPORT
+
+    def task_options(self) -> Dict:
+        """需要随任务持久化的下载选项"""
+        return {"hedge": self.hedge, "trace": self.trace, "profile": self.profile,
+                "verify": self.verify, "checksums": self.checksums, "transport": self.transport}
+
+def build_download_request(task: DownloadTask) -> DownloadRequest:
+    """根据数据库记录重建下载请求"""
+    options = json.loads(task.options) if task.options else {}
+    return DownloadRequest(
+        url=task.url,
+        filename=task.filename,
+        max_threads=task.max_threads,
+        mirrors=json.loads(task.mirrors) if task.mirrors else [],
+        **options
+    )
 
 class ConcurrencyUpdateRequest(BaseModel):
     max_tasks: int
+    max_merges: Optional[int] = None  # 同时合并的任务数，不填则不变
 
 class TaskResponse(BaseModel):
     task_id: str
@@ -150,6 +294,43 @@ class TaskResponse(BaseModel):
     file_size: Optional[str] = None
     download_speed: Optional[str] = None
     error_message: Optional[str] = None
+    eta_seconds: Optional[int] = None
+    eta: Optional[str] = None
+    # 下载中任务的实时统计（/metrics 的计数器不按任务区分）
+    downloaded_bytes: Optional[int] = None
+    completed_segments: Optional[int] = None
+    total_segments: Optional[int] = None
+
+def task_to_response(task: DownloadTask) -> TaskResponse:
+    """数据库记录转换为响应，下载中的任务使用实时速度和剩余时间"""
+    download_speed = task.download_speed
+    eta_seconds = None
+    live = {}
+    downloader = active_tasks.get(task.task_id)
+    if downloader and task.status == TaskStatus.DOWNLOADING:
+        download_speed = downloader._format_speed(downloader.current_speed)
+        eta = downloader.eta_seconds()
+        eta_seconds = int(eta) if eta is not None else None
+        with downloader.stats_lock:
+            live = {
+                "downloaded_bytes": downloader.downloaded_bytes,
+                "completed_segments": downloader.completed_segments,
+                "total_segments": downloader.total_segments,
+            }
+    
+    return TaskResponse(
+        task_id=task.task_id,
+        status=task.status.value,
+        progress=task.progress,
+        filename=task.filename,
+        created_at=task.created_at.isoformat(),
+        file_size=task.file_size,
+        download_speed=download_speed,
+        error_message=task.error_message,
+        eta_seconds=eta_seconds,
+        eta=format_duration(eta_seconds),
+        **live
+    )
 
 def update_task_progress(task_id: str, progress: float, status: TaskStatus = None, 
                         error_message: str = None, download_speed: str = None):
@@ -166,7 +347,8 @@ def update_task_progress(task_id: str, progress: float, status: TaskStatus = Non
                     task.error_message = error_message
                 if download_speed:
                     task.download_speed = download_speed
-                db.commit()
+                with metrics.DB_FLUSH_SECONDS.time():
+                    db.commit()
         finally:
             db.close()
     except Exception as e:
@@ -189,19 +371,52 @@ def run_download_task(task_id: str, request: DownloadRequest):
             task_id=task_id,
             url=request.url,
             save_path=save_path,
-            max_threads=min(request.max_threads, 20)  # 限制最大20线程
+            max_threads=min(request.max_threads, 20),  # 限制最大20线程
+            mirrors=request.mirrors,
+            hedge=request.hedge,
+            trace=request.trace,
+            verify=request.verify,
+            checksums=request.checksums,
+            transport=request.transport,
+            profile=request.profile
         )
         
         with task_lock:
             active_tasks[task_id] = downloader
+        claim_work_dir(downloader.work_dir)
         
-        def progress_callback(progress, current, total, speed):
+        def progress_callback(progress, current, total, speed, eta=None):
             update_task_progress(task_id, progress, download_speed=speed)
         
         def status_callback(status):
             print(f"🔄 任务 {task_id} 状态: {status}")
         
-        success = downloader.download(progress_callback, status_callback)
+        def admission_callback(estimate, existing):
+            # 已下载的分片不再占用新空间；估算失败时只检查保留空间
+            # 预留按实际落盘的字节扣减，仍暂存在内存中的分片之后可能溢出到磁盘
+            estimate = estimate or 0
+            task_estimates[task_id] = estimate
+            disk_quota.reserve(task_id, max(0, estimate - existing), estimate,
+                               written=lambda: downloader.staged_disk_bytes)
+            task_estimates.pop(task_id, None)
+        
+        def merge_slot():
+            # 分片已全部下载：释放下载槽位让排队的任务开始，合并在独立的队列中排队
+            with task_lock:
+                merging_tasks.add(task_id)
+            start_next_pending_task()
+            return merge_pool.slot(task_id, on_wait=downloader.spill_staged,
+                                   cancelled=lambda: downloader.is_stopped)
+        
+        if downloader.profiler:
+            success = downloader.profiler.run(downloader.download, progress_callback, status_callback,
+                                              admission_callback, merge_slot)
+            downloader.profiler.save(os.path.join(TRACE_DIR, f"{task_id}.prof"))
+        else:
+            success = downloader.download(progress_callback, status_callback, admission_callback, merge_slot)
+        
+        if downloader.tracer.enabled:
+            downloader.tracer.save(os.path.join(TRACE_DIR, f"{task_id}.json"))
         
         if success:
             update_task_progress(task_id, 100, TaskStatus.COMPLETED, download_speed=None)
@@ -212,233 +427,319 @@ def run_download_task(task_id: str, request: DownloadRequest):
                     task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
                     if task:
                         task.file_size = f"{size / 1024 / 1024:.1f}MB"
+                        task.file_bytes = size
+                        task.last_accessed_at = datetime.utcnow()
                         db.commit()
                 finally:
                     db.close()
             print(f"✅ 任务 {task_id} 下载完成")
+        elif downloader.interrupted:
+            # 保持原状态，服务重启后由 reconcile_tasks 重新排队
+            print(f"⏹️ 任务 {task_id} 因服务关闭中断，已下载的分片保留在工作目录")
         else:
             update_task_progress(task_id, 0, TaskStatus.FAILED, "下载失败")
             print(f"❌ 任务 {task_id} 下载失败")
         
+    except InsufficientDiskSpace as e:
+        # 保留工作目录，回到队列等待空间释放
+        with task_lock:
+            pending_tasks.insert(0, task_id)
+        update_task_progress(task_id, 0, TaskStatus.QUEUED, f"等待磁盘空间: {str(e)}")
+        print(f"💾 任务 {task_id} 等待磁盘空间: {str(e)}")
     except Exception as e:
         update_task_progress(task_id, 0, TaskStatus.FAILED, str(e))
         print(f"💥 任务 {task_id} 发生错误: {str(e)}")
     finally:
+        disk_quota.release(task_id)
         with task_lock:
             active_tasks.pop(task_id, None)
+            merging_tasks.discard(task_id)
         start_next_pending_task()
 
 @app.post("/api/tasks", response_model=TaskResponse)
-async def create_download_task(request: DownloadRequest, background_tasks: BackgroundTasks):
+def create_download_task(request: DownloadRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """创建下载任务"""
     task_id = str(uuid.uuid4())[:8]
     
+    if request.transport and request.transport.lower() not in TRANSPORTS:
+        raise HTTPException(status_code=400, detail=f"不支持的传输方式: {request.transport}，可选 {', '.join(TRANSPORTS)}")
+    
     print(f"📝 创建新任务: {task_id}, 线程数: {request.max_threads}")
     
-    db = SessionLocal()
-    try:
-        task = DownloadTask(
-            task_id=task_id,
-            url=request.url,
-            filename=request.filename,
-            max_threads=min(request.max_threads, 20),  # 限制最大20线程
-            status=TaskStatus.PENDING
-        )
-        
-        db.add(task)
+    task = DownloadTask(
+        task_id=task_id,
+        url=request.url,
+        filename=request.filename,
+        max_threads=min(request.max_threads, 20),  # 限制最大20线程
+        mirrors=json.dumps(request.mirrors) if request.mirrors else None,
+        options=json.dumps(request.task_options()),
+        status=TaskStatus.PENDING
+    )
+    
+    db.add(task)
+    db.commit()
+    
+    # 检查并发限制
+    with task_lock:
+        if download_slots_in_use() >= MAX_CONCURRENT_TASKS:
+            pending_tasks.append(task_id)
+            task.status = TaskStatus.QUEUED
+            db.commit()
+            print(f"⏳ 任务 {task_id} 进入等待队列 (活跃: {download_slots_in_use()}, 等待: {len(pending_tasks)})")
+        else:
+            thread = threading.Thread(
+                target=run_download_task,
+                args=(task_id, request),
+                daemon=True
+            )
+            thread.start()
+    
+    return TaskResponse(
+        task_id=task_id,
+        status=task.status.value,
+        progress=0.0,
+        filename=task.filename,
+        created_at=task.created_at.isoformat()
+    )
+
+@app.api_route("/api/files/{task_id}/download", methods=["GET", "HEAD"])
+def download_file(task_id: str, request: Request, db: Session = Depends(get_db)):
+    """下载文件到客户端 - 支持断点续传/拖动 (Range)，可配置由 nginx 直接发送"""
+    task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
+    
+    if not task or task.status != TaskStatus.COMPLETED:
+        raise HTTPException(status_code=404, detail="文件不存在或未完成下载")
+    
+    file_path = os.path.join("./downloads", task.filename)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="文件不存在")
+    
+    # 记录最近下载时间（保留策略按最近最少使用淘汰），不改变 updated_at
+    if request.method == "GET" and request.headers.get("range", "bytes=0-").startswith("bytes=0-"):
+        db.query(DownloadTask).filter(DownloadTask.id == task.id).update(
+            {DownloadTask.last_accessed_at: datetime.utcnow(), DownloadTask.updated_at: DownloadTask.updated_at},
+            synchronize_session=False)
         db.commit()
-        
-        # 检查并发限制
-        with task_lock:
-            if len(active_tasks) >= MAX_CONCURRENT_TASKS:
-                pending_tasks.append(task_id)
-                task.status = TaskStatus.QUEUED
-                db.commit()
-                print(f"⏳ 任务 {task_id} 进入等待队列 (活跃: {len(active_tasks)}, 等待: {len(pending_tasks)})")
-            else:
-                thread = threading.Thread(
-                    target=run_download_task,
-                    args=(task_id, request),
-                    daemon=True
-                )
-                thread.start()
-        
-        return TaskResponse(
-            task_id=task_id,
-            status=task.status.value,
-            progress=0.0,
-            filename=task.filename,
-            created_at=task.created_at.isoformat()
-        )
-    finally:
-        db.close()
+    
+    return serve_file(request, file_path, filename=task.filename, accel_root="./downloads")
 
-@app.get("/api/files/{task_id}/download")
-async def download_file(task_id: str):
-    """下载文件到客户端"""
-    db = SessionLocal()
+@app.delete("/api/files/{task_id}")
+def delete_file(task_id: str, db: Session = Depends(get_db)):
+    """删除服务器上的文件（软删除到回收站）"""
     try:
         task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
         
-        if not task or task.status != TaskStatus.COMPLETED:
-            raise HTTPException(status_code=404, detail="文件不存在或未完成下载")
+        if not task:
+            raise HTTPException(status_code=404, detail="任务不存在")
         
-        file_path = os.path.join("./downloads", task.filename)
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="文件不存在")
+        task.status = TaskStatus.DELETED
+        task.deleted_at = datetime.utcnow()
+        db.commit()
         
-        return FileResponse(
-            path=file_path,
-            filename=task.filename,
-            media_type='application/octet-stream'
-        )
-    finally:
-        db.close()
-
-@app.delete("/api/files/{task_id}")
-async def delete_file(task_id: str):
-    """删除服务器上的文件（软删除到回收站）"""
-    try:
-        db = SessionLocal()
-        try:
-            task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
-            
-            if not task:
-                raise HTTPException(status_code=404, detail="任务不存在")
-            
-            task.status = TaskStatus.DELETED
-            db.commit()
-            
-            print(f"🗑️ 任务 {task_id} 已移到回收站")
-            return {"message": "文件已移到回收站"}
-        finally:
-            db.close()
+        print(f"🗑️ 任务 {task_id} 已移到回收站")
+        return {"message": "文件已移到回收站"}
     except Exception as e:
         print(f"❌ 删除文件失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
         
 @app.post("/api/tasks/{task_id}/restore")
-async def restore_task(task_id: str):
+def restore_task(task_id: str, db: Session = Depends(get_db)):
     """还原回收站中的任务"""
-    db = SessionLocal()
-    try:
-        task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
-        
-        if not task:
-            raise HTTPException(status_code=404, detail="任务不存在")
-        
-        if task.status != TaskStatus.DELETED:
-            raise HTTPException(status_code=400, detail="任务不在回收站中")
-        
-        if task.progress == 100:
-            task.status = TaskStatus.COMPLETED
-        else:
-            task.status = TaskStatus.PAUSED
-        
-        db.commit()
-        
-        print(f"♻️ 任务 {task_id} 已还原")
-        return {"message": "任务已还原"}
-    finally:
-        db.close()
+    task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    if task.status != TaskStatus.DELETED:
+        raise HTTPException(status_code=400, detail="任务不在回收站中")
+    
+    if task.progress == 100:
+        task.status = TaskStatus.COMPLETED
+        task.last_accessed_at = datetime.utcnow()
+    else:
+        task.status = TaskStatus.PAUSED
+    task.deleted_at = None
+    
+    db.commit()
+    
+    print(f"♻️ 任务 {task_id} 已还原")
+    return {"message": "任务已还原"}
 
 @app.post("/api/system/cleanup-all")
-async def cleanup_all_files():
+def cleanup_all_files(db: Session = Depends(get_db)):
     """清理所有下载文件和缓存"""
     try:
-        db = SessionLocal()
-        try:
-            download_dir = "./downloads"
-            deleted_files = 0
-            if os.path.exists(download_dir):
-                for filename in os.listdir(download_dir):
-                    file_path = os.path.join(download_dir, filename)
-                    if os.path.isfile(file_path):
-                        try:
-                            os.remove(file_path)
-                            deleted_files += 1
-                            print(f"🗑️ 清理文件: {filename}")
-                        except Exception as e:
-                            print(f"❌ 清理文件失败 {filename}: {str(e)}")
-            
-            deleted_records = db.query(DownloadTask).delete()
-            db.commit()
-            
-            with task_lock:
-                active_tasks.clear()
-                pending_tasks.clear()
-            
-            return {
-                "message": "清理完成",
-                "deleted_files": deleted_files,
-                "deleted_records": deleted_records
-            }
-        finally:
-            db.close()
+        download_dir = "./downloads"
+        deleted_files = 0
+        if os.path.exists(download_dir):
+            for filename in os.listdir(download_dir):
+                file_path = os.path.join(download_dir, filename)
+                if os.path.isfile(file_path):
+                    try:
+                        os.remove(file_path)
+                        deleted_files += 1
+                        print(f"🗑️ 清理文件: {filename}")
+                    except Exception as e:
+                        print(f"❌ 清理文件失败 {filename}: {str(e)}")
+        
+        for (task_id,) in db.query(DownloadTask.task_id).all():
+            remove_task_traces(TRACE_DIR, task_id)
+        deleted_records = db.query(DownloadTask).delete()
+        db.commit()
+        
+        with task_lock:
+            active_tasks.clear()
+            pending_tasks.clear()
+            merging_tasks.clear()
+        
+        return {
+            "message": "清理完成",
+            "deleted_files": deleted_files,
+            "deleted_records": deleted_records
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清理失败: {str(e)}")
 
 @app.get("/api/system/cleanup")
 async def cleanup_old_files():
-    """手动清理7天前的文件"""
-    try:
-        cleanup_old_files_task()
-        return {"message": "手动清理完成"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"清理失败: {str(e)}")
+    """立即执行一轮保留策略 - 后台执行，立即返回作业ID"""
+    job = job_manager.submit("cleanup", retention_engine.run_once)
+    return {"message": "清理任务已提交", "job_id": job["job_id"], "status": job["status"]}
+
+@app.get("/api/system/jobs")
+async def list_jobs():
+    """后台作业列表"""
+    return job_manager.list()
+
+@app.get("/api/system/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询后台作业状态"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="作业不存在")
+    return job
 
 @app.get("/api/tasks", response_model=List[TaskResponse])
-async def get_tasks(limit: int = 100):
+def get_tasks(limit: int = 100, db: Session = Depends(get_db)):
     """获取任务列表"""
     try:
-        db = SessionLocal()
-        try:
-            tasks = db.query(DownloadTask).order_by(DownloadTask.created_at.desc()).limit(limit).all()
-            
-            return [
-                TaskResponse(
-                    task_id=task.task_id,
-                    status=task.status.value,
-                    progress=task.progress,
-                    filename=task.filename,
-                    created_at=task.created_at.isoformat(),
-                    file_size=task.file_size,
-                    download_speed=task.download_speed,
-                    error_message=task.error_message
-                )
-                for task in tasks
-            ]
-        finally:
-            db.close()
+        tasks = db.query(DownloadTask).order_by(DownloadTask.created_at.desc()).limit(limit).all()
+        
+        return [task_to_response(task) for task in tasks]
     except Exception as e:
         print(f"❌ 获取任务列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail="获取任务列表失败")
 
 @app.get("/api/tasks/{task_id}", response_model=TaskResponse)
-async def get_task(task_id: str):
+def get_task(task_id: str, db: Session = Depends(get_db)):
     """获取任务详情"""
-    db = SessionLocal()
-    try:
+    task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    return task_to_response(task)
+
+STREAM_MEDIA_TYPES = {
+    "ts": "video/mp2t",
+    "m4s": "video/iso.segment",
+    "mp4": "video/mp4",
+    "vtt": "text/vtt",
+    "aac": "audio/aac",
+    "mp3": "audio/mpeg",
+    "ac3": "audio/ac3",
+    "ec3": "audio/eac3",
+}
+STREAM_FILE_PATTERN = re.compile(r'^(\d{5,}\.(ts|m4s|vtt|aac|mp3|ac3|ec3)|init_\d{3}\.mp4)$')
+
+def get_streaming_downloader(task_id: str, db: Session) -> M3U8Downloader:
+    """边下边播只对正在下载（分片仍在工作目录中）的任务可用
+
+    已完成的任务分片已合并并删除，返回 410 并指向完整文件。
+    """
+    downloader = active_tasks.get(task_id)
+    if downloader and downloader.tracks:
+        return downloader
+    completed = downloader is not None and downloader.completed
+    if not completed:
         task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
-        
-        if not task:
-            raise HTTPException(status_code=404, detail="任务不存在")
-        
-        return TaskResponse(
-            task_id=task.task_id,
-            status=task.status.value,
-            progress=task.progress,
-            filename=task.filename,
-            created_at=task.created_at.isoformat(),
-            file_size=task.file_size,
-            download_speed=task.download_speed,
-            error_message=task.error_message
-        )
-    finally:
-        db.close()
+        completed = task is not None and task.status == TaskStatus.COMPLETED
+    if completed:
+        raise HTTPException(status_code=410, detail=f"任务已完成，请下载完整文件: /api/files/{task_id}/download")
+    raise HTTPException(status_code=404, detail="任务不在下载中")
+
+def playlist_response(content: str) -> Response:
+    # 播放列表随下载进度变化，不能缓存
+    return Response(content=content, media_type="application/vnd.apple.mpegurl",
+                    headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/tasks/{task_id}/stream/index.m3u8")
+def get_stream_index(task_id: str, db: Session = Depends(get_db)):
+    """边下边播入口 - 只有视频轨道时直接返回媒体播放列表"""
+    downloader = get_streaming_downloader(task_id, db)
+    if len(downloader.tracks) == 1:
+        return playlist_response(downloader.local_media_playlist(downloader.tracks[0]))
+    return playlist_response(downloader.local_master_playlist())
+
+@app.get("/api/tasks/{task_id}/stream/{kind}.m3u8")
+def get_stream_playlist(task_id: str, kind: str, db: Session = Depends(get_db)):
+    """单个轨道的本地播放列表，列出已下载并解密的分片"""
+    downloader = get_streaming_downloader(task_id, db)
+    track = downloader.get_track(kind)
+    if not track:
+        raise HTTPException(status_code=404, detail="轨道不存在")
+    return playlist_response(downloader.local_media_playlist(track))
+
+@app.api_route("/api/tasks/{task_id}/stream/{kind}/{filename}", methods=["GET", "HEAD"])
+def get_stream_segment(task_id: str, kind: str, filename: str, request: Request,
+                       db: Session = Depends(get_db)):
+    """工作目录中的分片/初始化段，支持 Range"""
+    track = get_streaming_downloader(task_id, db).get_track(kind)
+    if not track or not STREAM_FILE_PATTERN.match(filename):
+        raise HTTPException(status_code=404, detail="分片不存在")
+    media_type = STREAM_MEDIA_TYPES[filename.rsplit('.', 1)[1]]
+    # 暂存在内存中的分片直接发送
+    data = track.store.get_memory(filename)
+    if data is not None:
+        return serve_bytes(request, data, media_type)
+    path = os.path.join(track.temp_dir, filename)
+    if track.frozen_playlist is not None and not os.path.exists(path):
+        # 合并阶段已消费并释放的分片
+        raise HTTPException(status_code=410, detail=f"分片已合并，请在任务完成后下载完整文件: /api/files/{task_id}/download")
+    return serve_file(request, path, media_type=media_type)
+
+@app.get("/api/tasks/{task_id}/trace")
+def get_task_trace(task_id: str, format: str = "json"):
+    """获取任务耗时追踪，format=chrome 返回 Chrome trace-event 格式"""
+    downloader = active_tasks.get(task_id)
+    if downloader and downloader.tracer.enabled:
+        return downloader.tracer.to_chrome() if format == "chrome" else downloader.tracer.to_dict()
+    
+    trace = load_trace(os.path.join(TRACE_DIR, f"{task_id}.json"), chrome=(format == "chrome"))
+    if trace is None:
+        raise HTTPException(status_code=404, detail="该任务没有追踪数据")
+    return trace
+
+@app.get("/api/tasks/{task_id}/profile")
+def get_task_profile(task_id: str, raw: bool = False, limit: int = 40):
+    """获取任务的 cProfile 结果，raw=true 下载原始 .prof 文件
+
+    统计合并了任务主线程（解析播放列表、密钥、合并调度）和每个分片下载线程、对冲请求线程，
+    按函数汇总而不区分线程；FFmpeg 子进程的耗时只体现为主线程上的等待。
+    """
+    prof_path = os.path.join(TRACE_DIR, f"{task_id}.prof")
+    if not os.path.exists(prof_path):
+        raise HTTPException(status_code=404, detail="该任务没有性能分析数据")
+    if raw:
+        return FileResponse(path=prof_path, filename=f"{task_id}.prof", media_type='application/octet-stream')
+    
+    output = io.StringIO()
+    stats = pstats.Stats(prof_path, stream=output)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return PlainTextResponse(output.getvalue())
 
 @app.post("/api/tasks/{task_id}/pause")
-async def pause_task(task_id: str):
+def pause_task(task_id: str):
     """暂停任务"""
     downloader = active_tasks.get(task_id)
     if downloader:
@@ -448,96 +749,90 @@ async def pause_task(task_id: str):
     return {"message": "任务已暂停"}
 
 @app.post("/api/tasks/{task_id}/resume")
-async def resume_task(task_id: str):
+def resume_task(task_id: str, db: Session = Depends(get_db)):
     """恢复任务"""
-    db = SessionLocal()
-    try:
-        task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
-        
-        if not task:
-            raise HTTPException(status_code=404, detail="任务不存在")
-        
-        if task.status != TaskStatus.PAUSED:
-            raise HTTPException(status_code=400, detail="任务不是暂停状态")
-        
-        if task_id in active_tasks:
-            downloader = active_tasks[task_id]
-            downloader.is_paused = False
-            task.status = TaskStatus.DOWNLOADING
-            db.commit()
-            print(f"▶️ 任务 {task_id} 已恢复")
-            return {"message": "任务已恢复"}
-        
-        if task.progress < 100:
-            with task_lock:
-                if len(active_tasks) >= MAX_CONCURRENT_TASKS:
-                    pending_tasks.append(task_id)
-                    task.status = TaskStatus.QUEUED
-                    db.commit()
-                    print(f"⏳ 任务 {task_id} 进入等待队列 (活跃: {len(active_tasks)}, 等待: {len(pending_tasks)})")
-                    return {"message": "任务已加入队列等待"}
-                else:
-                    request = DownloadRequest(
-                        url=task.url,
-                        filename=task.filename,
-                        max_threads=task.max_threads
-                    )
-                    
-                    thread = threading.Thread(
-                        target=run_download_task,
-                        args=(task_id, request),
-                        daemon=True
-                    )
-                    thread.start()
-                    
-                    task.status = TaskStatus.DOWNLOADING
-                    db.commit()
-                    print(f"🚀 任务 {task_id} 重新开始下载")
-                    return {"message": "任务已开始下载"}
-        
+    task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    if task.status != TaskStatus.PAUSED:
+        raise HTTPException(status_code=400, detail="任务不是暂停状态")
+    
+    if task_id in active_tasks:
+        downloader = active_tasks[task_id]
+        downloader.is_paused = False
         task.status = TaskStatus.DOWNLOADING
         db.commit()
         print(f"▶️ 任务 {task_id} 已恢复")
         return {"message": "任务已恢复"}
-    finally:
-        db.close()
+    
+    if task.progress < 100:
+        with task_lock:
+            if download_slots_in_use() >= MAX_CONCURRENT_TASKS:
+                pending_tasks.append(task_id)
+                task.status = TaskStatus.QUEUED
+                db.commit()
+                print(f"⏳ 任务 {task_id} 进入等待队列 (活跃: {download_slots_in_use()}, 等待: {len(pending_tasks)})")
+                return {"message": "任务已加入队列等待"}
+            else:
+                request = build_download_request(task)
+                
+                thread = threading.Thread(
+                    target=run_download_task,
+                    args=(task_id, request),
+                    daemon=True
+                )
+                thread.start()
+                
+                task.status = TaskStatus.DOWNLOADING
+                db.commit()
+                print(f"🚀 任务 {task_id} 重新开始下载")
+                return {"message": "任务已开始下载"}
+    
+    task.status = TaskStatus.DOWNLOADING
+    db.commit()
+    print(f"▶️ 任务 {task_id} 已恢复")
+    return {"message": "任务已恢复"}
     
 @app.delete("/api/tasks/{task_id}")
-async def delete_task(task_id: str):
+def delete_task(task_id: str, db: Session = Depends(get_db)):
     """永久删除任务（从回收站中删除）"""
     downloader = active_tasks.get(task_id)
     if downloader:
         downloader.is_stopped = True
     
-    db = SessionLocal()
-    try:
-        task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
-        if task:
-            file_path = os.path.join("./downloads", task.filename)
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    print(f"🗑️ 已删除文件: {file_path}")
-                except Exception as e:
-                    print(f"❌ 删除文件失败: {str(e)}")
-            
-            db.delete(task)
-            db.commit()
+    task = db.query(DownloadTask).filter(DownloadTask.task_id == task_id).first()
+    if task:
+        file_path = os.path.join("./downloads", task.filename)
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                print(f"🗑️ 已删除文件: {file_path}")
+            except Exception as e:
+                print(f"❌ 删除文件失败: {str(e)}")
         
-        print(f"🗑️ 任务 {task_id} 已永久删除")
-        return {"message": "任务已永久删除"}
-    finally:
-        db.close()
+        remove_task_traces(TRACE_DIR, task_id)
+        db.delete(task)
+        db.commit()
+    
+    print(f"🗑️ 任务 {task_id} 已永久删除")
+    return {"message": "任务已永久删除"}
 
 @app.post("/api/system/update-concurrency")
-async def update_concurrency(request: ConcurrencyUpdateRequest):
+def update_concurrency(request: ConcurrencyUpdateRequest):
     """更新最大并发任务数"""
     global MAX_CONCURRENT_TASKS
     if request.max_tasks < 1 or request.max_tasks > MAX_CONCURRENT_TASKS_LIMIT:
         raise HTTPException(status_code=400, detail=f"并发任务数必须在1-{MAX_CONCURRENT_TASKS_LIMIT}之间")
+    if request.max_merges is not None and not 1 <= request.max_merges <= MAX_CONCURRENT_TASKS_LIMIT:
+        raise HTTPException(status_code=400, detail=f"合并并发数必须在1-{MAX_CONCURRENT_TASKS_LIMIT}之间")
     
     MAX_CONCURRENT_TASKS = request.max_tasks
     print(f"🔄 更新最大并发任务数为: {MAX_CONCURRENT_TASKS}")
+    if request.max_merges is not None:
+        merge_pool.set_limit(request.max_merges)
+        print(f"🔄 更新最大合并并发数为: {request.max_merges}")
     
     # 尝试启动等待的任务
     start_next_pending_task()
@@ -545,36 +840,44 @@ async def update_concurrency(request: ConcurrencyUpdateRequest):
     return {"message": f"并发任务数已更新为 {MAX_CONCURRENT_TASKS}"}
 
 @app.get("/api/system/info")
-async def get_system_info():
+def get_system_info():
     """获取系统信息"""
-    import shutil
+    download_dir = "./downloads"
+    total_size = 0
+    file_count = 0
+    if os.path.exists(download_dir):
+        for file in os.listdir(download_dir):
+            file_path = os.path.join(download_dir, file)
+            if os.path.isfile(file_path):
+                total_size += os.path.getsize(file_path)
+                file_count += 1
     
-    db = SessionLocal()
-    try:
-        download_dir = "./downloads"
-        total_size = 0
-        file_count = 0
-        if os.path.exists(download_dir):
-            for file in os.listdir(download_dir):
-                file_path = os.path.join(download_dir, file)
-                if os.path.isfile(file_path):
-                    total_size += os.path.getsize(file_path)
-                    file_count += 1
-        
-        return {
-            "version": "1.5.0",
-            "status": "running",
-            "download_dir": download_dir,
-            "file_count": file_count,
-            "disk_usage": f"{total_size / 1024 / 1024:.1f}MB",
-            "next_cleanup": "每天03:00",
-            "max_concurrent_tasks": MAX_CONCURRENT_TASKS,
-            "max_concurrent_limit": MAX_CONCURRENT_TASKS_LIMIT,
-            "default_threads": 10,
-            "max_threads": 20
-        }
-    finally:
-        db.close()
+    return {
+        "version": "1.5.0",
+        "status": "running",
+        "download_dir": download_dir,
+        "file_count": file_count,
+        "disk_usage": f"{total_size / 1024 / 1024:.1f}MB",
+        "next_cleanup": f"每{retention_engine.policy.interval:.0f}秒",
+        "retention": {"policy": retention_engine.policy.to_dict(), "last_run": retention_engine.last_run},
+        "total_speed": M3U8Downloader._format_speed(GLOBAL_METER.rate()),
+        "disk_reservations": disk_quota.snapshot(),
+        "waiting_for_disk": [
+            {"task_id": task_id, "estimated_size": format_bytes(task_estimates[task_id])}
+            for task_id in list(pending_tasks) if task_id in task_estimates
+        ],
+        "max_concurrent_tasks": MAX_CONCURRENT_TASKS,
+        "merge_queue": merge_pool.snapshot(),
+        "max_concurrent_limit": MAX_CONCURRENT_TASKS_LIMIT,
+        "default_threads": 10,
+        "max_threads": 20,
+        "transports": {"default": DEFAULT_TRANSPORT, "http2_available": http2_available()}
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 指标"""
+    return Response(content=metrics.REGISTRY.exposition(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/")
 async def root():
@@ -588,10 +891,15 @@ async def root():
             "下载文件": "GET /api/files/{id}/download",
             "删除文件": "DELETE /api/files/{id}",
             "还原文件": "POST /api/tasks/{id}/restore",
+            "耗时追踪": "GET /api/tasks/{id}/trace",
+            "边下边播": "GET /api/tasks/{id}/stream/index.m3u8",
+            "性能分析": "GET /api/tasks/{id}/profile",
             "系统信息": "GET /api/system/info",
             "手动清理": "GET /api/system/cleanup",
+            "作业状态": "GET /api/system/jobs/{id}",
             "清理所有": "POST /api/system/cleanup-all",
-            "更新并发": "POST /api/system/update-concurrency"
+            "更新并发": "POST /api/system/update-concurrency",
+            "监控指标": "GET /metrics"
         }
     }
 
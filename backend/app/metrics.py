@@ -0,0 +1,199 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Callable
+
+# 默认直方图分桶 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类，按标签值保存子序列"""
+
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.series: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def remove(self, **labels):
+        """删除一组标签对应的序列（任务结束后清理高基数标签）"""
+        with self.lock:
+            self.series.pop(self._key(labels), None)
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self.lock:
+            items = list(self.series.items())
+        for key, value in items:
+            lines.extend(self._sample_lines(key, value))
+        return lines
+
+    def _sample_lines(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """只增计数器"""
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值，也可以绑定一个取值函数"""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 func: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.series[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self) -> List[str]:
+        if self.func is not None:
+            self.set(self.func())
+        return super().collect()
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            data = self.series.get(key)
+            if data is None:
+                data = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self.series[key] = data
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data["counts"][i] += 1
+                    break
+            data["sum"] += value
+            data["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文: with histogram.time(stage="merge"): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _sample_lines(self, key, data) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, data["counts"]):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(data['sum'])}")
+        lines.append(f"{self.name}_count{labels} {data['count']}")
+        return lines
+
+
+class Registry:
+    """指标注册表，输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+
+# 计数器不带 task_id 标签：任务数量无上限，单个任务的字节数/分片数由任务接口提供
+BYTES_DOWNLOADED = REGISTRY.register(Counter(
+    "m3u8_bytes_downloaded_total", "Bytes downloaded from origins", ("host",)))
+SEGMENTS_DOWNLOADED = REGISTRY.register(Counter(
+    "m3u8_segments_downloaded_total", "Segments downloaded and written"))
+SEGMENT_FETCH_SECONDS = REGISTRY.register(Histogram(
+    "m3u8_segment_fetch_seconds", "Segment fetch latency including retries", ("host",)))
+RETRIES = REGISTRY.register(Counter(
+    "m3u8_request_retries_total", "Failed HTTP attempts by error class", ("error_class",)))
+VERIFY_FAILURES = REGISTRY.register(Counter(
+    "m3u8_segment_verify_failures_total", "Segments rejected by integrity checks", ("reason",)))
+DECRYPT_SECONDS = REGISTRY.register(Histogram(
+    "m3u8_decrypt_seconds", "AES segment decrypt time",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)))
+WRITE_SECONDS = REGISTRY.register(Histogram(
+    "m3u8_segment_write_seconds", "Segment disk write time",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)))
+STAGING_SPILLED_BYTES = REGISTRY.register(Counter(
+    "m3u8_staging_spilled_bytes_total", "Segment bytes written to disk because the staging memory budget was full"))
+MERGE_SECONDS = REGISTRY.register(Histogram(
+    "m3u8_merge_seconds", "Merge / remux time per task", ("method",)))
+SEGMENT_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "m3u8_segment_queue_depth", "Segments waiting in a task's download queue", ("task_id",)))
+DB_FLUSH_SECONDS = REGISTRY.register(Histogram(
+    "m3u8_db_flush_seconds", "Latency of task progress DB commits",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)))
+ACTIVE_THREADS = REGISTRY.register(Gauge(
+    "m3u8_active_threads", "Python threads alive in the process", func=threading.active_count))
+EVENT_LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "m3u8_event_loop_lag_seconds", "Delay of a periodic asyncio timer, i.e. time the event loop was blocked",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+EVENT_LOOP_LAG_MAX = REGISTRY.register(Gauge(
+    "m3u8_event_loop_lag_max_seconds", "Largest event loop lag observed since startup"))
@@ -0,0 +1,138 @@
+import threading
+import time
+import logging
+from typing import Optional, Dict, List
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class Mirror:
+    """单个镜像源及其统计信息"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.prefix = url.rsplit('/', 1)[0] + '/'
+        parsed = urlparse(url)
+        self.origin = f"{parsed.scheme}://{parsed.netloc}"
+
+        self.latency: Optional[float] = None      # 探测延迟 (秒)
+        self.throughput: Optional[float] = None   # 吞吐 EWMA (bytes/s)
+        self.inflight = 0
+        self.bytes_downloaded = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.time() >= self.cooldown_until
+
+    def to_dict(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "throughput": round(self.throughput or 0, 1),
+            "inflight": self.inflight,
+            "bytes_downloaded": self.bytes_downloaded,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class MirrorPool:
+    """多镜像/CDN 故障转移 - 按预计耗时选择最快的健康镜像
+
+    各镜像的播放列表内容等价，分片 URL 通过把主地址的目录前缀（或域名）
+    替换为镜像的前缀得到。每次请求都会重新选择镜像，所以某个镜像变慢或
+    出错后，后续分片会自动转移到其他镜像上。
+    """
+
+    EWMA_ALPHA = 0.3
+    MAX_CONSECUTIVE_ERRORS = 3
+    COOLDOWN_SECONDS = 30
+    DEFAULT_SEGMENT_BYTES = 1024 * 1024
+
+    def __init__(self, primary_url: str, mirror_urls: Optional[List[str]] = None):
+        urls = [primary_url] + [u for u in (mirror_urls or []) if u and u != primary_url]
+        self.mirrors = [Mirror(u) for u in urls]
+        self.primary = self.mirrors[0]
+        self.lock = threading.Lock()
+        self.avg_bytes = 0.0
+
+    def __len__(self) -> int:
+        return len(self.mirrors)
+
+    def probe(self, fetch) -> None:
+        """探测所有镜像的延迟，fetch(url) 返回内容或抛出异常"""
+        for mirror in self.mirrors:
+            start = time.time()
+            try:
+                fetch(mirror.url)
+                mirror.latency = time.time() - start
+                print(f"🌐 镜像探测: {mirror.origin} 延迟 {mirror.latency * 1000:.0f}ms")
+            except Exception as e:
+                mirror.errors += 1
+                mirror.cooldown_until = time.time() + self.COOLDOWN_SECONDS
+                logger.warning(f"镜像不可用 {mirror.url}: {str(e)}")
+
+    def rewrite(self, url: str, mirror: Mirror) -> str:
+        """把主地址下的 URL 映射到指定镜像"""
+        if mirror is self.primary:
+            return url
+        if url.startswith(self.primary.prefix):
+            return mirror.prefix + url[len(self.primary.prefix):]
+        if url.startswith(self.primary.origin + '/'):
+            return mirror.origin + url[len(self.primary.origin):]
+        # 不在主站下的资源（如第三方密钥服务器）不做映射
+        return url
+
+    def _expected_time(self, mirror: Mirror, best_throughput: float) -> float:
+        avg_bytes = self.avg_bytes or self.DEFAULT_SEGMENT_BYTES
+        # 尚无吞吐样本的镜像按当前最优值估计，保证它们会被尝试
+        throughput = mirror.throughput or best_throughput
+        return ((mirror.latency or 0) + avg_bytes / throughput) * (mirror.inflight + 1)
+
+    def acquire(self, url: str):
+        """为一次请求选择镜像，返回 (mirror, 映射后的URL)"""
+        with self.lock:
+            candidates = [m for m in self.mirrors if m is self.primary or self.rewrite(url, m) != url]
+            healthy = [m for m in candidates if m.healthy] or candidates
+            best_throughput = max((m.throughput or 0 for m in healthy), default=0) or self.DEFAULT_SEGMENT_BYTES
+            mirror = min(healthy, key=lambda m: self._expected_time(m, best_throughput))
+            mirror.inflight += 1
+            mirror.requests += 1
+        return mirror, self.rewrite(url, mirror)
+
+    def release(self, mirror: Mirror, size: int = 0, elapsed: float = 0.0, error: bool = False) -> None:
+        """记录一次请求的结果"""
+        with self.lock:
+            mirror.inflight = max(0, mirror.inflight - 1)
+            if error:
+                mirror.errors += 1
+                mirror.consecutive_errors += 1
+                if mirror.throughput:
+                    mirror.throughput *= 0.5
+                if mirror.consecutive_errors >= self.MAX_CONSECUTIVE_ERRORS and len(self.mirrors) > 1:
+                    mirror.cooldown_until = time.time() + self.COOLDOWN_SECONDS
+                    mirror.consecutive_errors = 0
+                    print(f"⚠️ 镜像 {mirror.origin} 连续出错，暂停使用 {self.COOLDOWN_SECONDS} 秒")
+                return
+
+            mirror.consecutive_errors = 0
+            mirror.bytes_downloaded += size
+            if size and elapsed > 0:
+                sample = size / elapsed
+                if mirror.throughput is None:
+                    mirror.throughput = sample
+                else:
+                    mirror.throughput = self.EWMA_ALPHA * sample + (1 - self.EWMA_ALPHA) * mirror.throughput
+                self.avg_bytes = size if not self.avg_bytes else \
+                    self.EWMA_ALPHA * size + (1 - self.EWMA_ALPHA) * self.avg_bytes
+
+    def snapshot(self) -> List[Dict]:
+        """各镜像的统计信息"""
+        with self.lock:
+            return [m.to_dict() for m in self.mirrors]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, Text, Enum
+from sqlalchemy import Column, String, Integer, BigInteger, Float, DateTime, Text, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 import enum
@@ -25,7 +25,18 @@ class DownloadTask(Base):
     status = Column(Enum(TaskStatus), default=TaskStatus.PENDING)
     progress = Column(Float, default=0.0)
     file_size = Column(String(50))
+    file_bytes = Column(BigInteger)  # 文件字节数，用于保留策略统计总占用
     download_speed = Column(String(50))
     error_message = Column(Text)
+    mirrors = Column(Text)  # 镜像播放列表地址 (JSON 数组)
+    options = Column(Text)  # 其他下载选项 (JSON 对象)，如对冲请求
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_accessed_at = Column(DateTime)  # 完成或最近一次被下载的时间，按最近最少使用淘汰
+    deleted_at = Column(DateTime)  # 移到回收站的时间
+    
+    # 保留策略按状态分批扫描
+    __table_args__ = (
+        Index("ix_download_tasks_status_accessed", "status", "last_accessed_at"),
+        Index("ix_download_tasks_status_deleted", "status", "deleted_at"),
+    )
@@ -0,0 +1,247 @@
+import re
+from array import array
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urljoin
+
+# 属性列表: KEY=VALUE 或 KEY="VALUE"，以逗号分隔
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(value: str) -> Dict[str, str]:
+    """解析 #EXT-X-KEY / #EXT-X-MAP 等标签的属性列表，去掉值两侧的引号"""
+    return {name: raw.strip('"') for name, raw in ATTRIBUTE_PATTERN.findall(value)}
+
+
+def is_master_playlist(text: str) -> bool:
+    return '#EXT-X-STREAM-INF' in text
+
+
+class KeyInfo:
+    """分片密钥 (EXT-X-KEY)，uri 为绝对地址"""
+
+    __slots__ = ('method', 'uri', 'iv')
+
+    def __init__(self, method: str, uri: Optional[str], iv: Optional[str]):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+
+    @property
+    def absolute_uri(self) -> Optional[str]:
+        return self.uri
+
+
+class InitSection:
+    """初始化段 (EXT-X-MAP)，uri 为绝对地址，byterange 保持 "<长度>[@<偏移>]" 原文"""
+
+    __slots__ = ('uri', 'byterange')
+
+    def __init__(self, uri: str, byterange: Optional[str]):
+        self.uri = uri
+        self.byterange = byterange
+
+    @property
+    def absolute_uri(self) -> str:
+        return self.uri
+
+
+class SegmentView:
+    """分片表中一行的轻量视图，按需创建，不常驻内存"""
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table: "SegmentTable", index: int):
+        self.table = table
+        self.index = index
+
+    @property
+    def uri(self) -> str:
+        return self.table.uris[self.index]
+
+    absolute_uri = uri
+
+    @property
+    def duration(self) -> float:
+        return self.table.durations[self.index]
+
+    @property
+    def media_sequence(self) -> int:
+        return self.table.media_sequence + self.index
+
+    @property
+    def byte_range(self) -> Optional[Tuple[int, int]]:
+        return self.table.byte_range(self.index)
+
+    @property
+    def key(self) -> Optional[KeyInfo]:
+        return self.table.key(self.index)
+
+    @property
+    def init_section(self) -> Optional[InitSection]:
+        return self.table.init_section(self.index)
+
+
+class ByteRangeColumn:
+    """按下标返回分片绝对字节区间 (start, end)，没有 EXT-X-BYTERANGE 的分片为 None"""
+
+    __slots__ = ('table',)
+
+    def __init__(self, table: "SegmentTable"):
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, index: int) -> Optional[Tuple[int, int]]:
+        return self.table.byte_range(index)
+
+
+class SegmentTable:
+    """媒体播放列表的紧凑分片表
+
+    每列一个数组，不为分片创建对象：
+    - uris: 绝对地址（同一资源的字节区间分片共享同一个字符串）
+    - durations: 时长
+    - range_starts / range_ends: 绝对字节区间，-1 表示整个资源
+    - key_indices: keys 表的下标，-1 表示未加密
+    - init_indices: init_sections 表的下标，-1 表示没有初始化段 (TS)
+    分片序号为 media_sequence + 下标。
+    """
+
+    def __init__(self, playlist_url: str):
+        self.playlist_url = playlist_url
+        self.uris: List[str] = []
+        self.durations = array('d')
+        self.range_starts = array('q')
+        self.range_ends = array('q')
+        self.key_indices = array('i')
+        self.init_indices = array('i')
+        self.keys: List[KeyInfo] = []
+        self.init_sections: List[InitSection] = []
+        self.media_sequence = 0
+        self.target_duration = 0.0
+        self.is_endlist = False
+
+    def __len__(self) -> int:
+        return len(self.uris)
+
+    def __getitem__(self, index: int) -> SegmentView:
+        if index < 0:
+            index += len(self.uris)
+        if not 0 <= index < len(self.uris):
+            raise IndexError(index)
+        return SegmentView(self, index)
+
+    def __iter__(self):
+        for i in range(len(self.uris)):
+            yield SegmentView(self, i)
+
+    def byte_range(self, index: int) -> Optional[Tuple[int, int]]:
+        start = self.range_starts[index]
+        return None if start < 0 else (start, self.range_ends[index])
+
+    @property
+    def byte_ranges(self) -> ByteRangeColumn:
+        return ByteRangeColumn(self)
+
+    def key(self, index: int) -> Optional[KeyInfo]:
+        key_index = self.key_indices[index]
+        return None if key_index < 0 else self.keys[key_index]
+
+    def init_section(self, index: int) -> Optional[InitSection]:
+        init_index = self.init_indices[index]
+        return None if init_index < 0 else self.init_sections[init_index]
+
+
+def parse_media_playlist(content: Union[bytes, str], playlist_url: str) -> SegmentTable:
+    """单遍解析媒体播放列表，生成 SegmentTable
+
+    只处理下载需要的标签 (EXTINF / EXT-X-BYTERANGE / EXT-X-KEY / EXT-X-MAP /
+    EXT-X-MEDIA-SEQUENCE / EXT-X-TARGETDURATION / EXT-X-ENDLIST)，其余标签忽略。
+    主播放列表仍由 m3u8 库解析（条目很少）。
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='ignore')
+    table = SegmentTable(playlist_url)
+    base_dir = playlist_url.split('?', 1)[0].rsplit('/', 1)[0] + '/'
+
+    uris, durations = table.uris, table.durations
+    range_starts, range_ends = table.range_starts, table.range_ends
+    key_indices, init_indices = table.key_indices, table.init_indices
+    key_lookup: Dict[Tuple, int] = {}
+    init_lookup: Dict[Tuple, int] = {}
+    uri_cache: Dict[str, str] = {}
+    # EXT-X-BYTERANGE 省略偏移时紧接同一资源的上一分片
+    next_offset: Dict[str, int] = {}
+
+    duration = 0.0
+    pending_range: Optional[str] = None
+    key_index = -1
+    init_index = -1
+
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != '#':
+            url = uri_cache.get(line)
+            if url is None:
+                if '://' in line or line.startswith('/') or line.startswith('.'):
+                    url = urljoin(playlist_url, line)
+                else:
+                    url = base_dir + line
+                uri_cache[line] = url
+            uris.append(url)
+            durations.append(duration)
+            if pending_range is not None:
+                length, _, offset = pending_range.partition('@')
+                start = int(offset) if offset else next_offset.get(url, 0)
+                end = start + int(length) - 1
+                next_offset[url] = end + 1
+                range_starts.append(start)
+                range_ends.append(end)
+            else:
+                range_starts.append(-1)
+                range_ends.append(-1)
+            key_indices.append(key_index)
+            init_indices.append(init_index)
+            duration = 0.0
+            pending_range = None
+            continue
+
+        tag, _, value = line.partition(':')
+        if tag == '#EXTINF':
+            try:
+                duration = float(value.split(',', 1)[0])
+            except ValueError:
+                duration = 0.0
+        elif tag == '#EXT-X-BYTERANGE':
+            pending_range = value.strip()
+        elif tag == '#EXT-X-KEY':
+            attrs = parse_attributes(value)
+            method = attrs.get('METHOD', 'NONE')
+            if method == 'NONE' or not attrs.get('URI'):
+                key_index = -1
+                continue
+            lookup = (method, urljoin(playlist_url, attrs['URI']), attrs.get('IV'))
+            key_index = key_lookup.get(lookup, -1)
+            if key_index < 0:
+                key_index = key_lookup[lookup] = len(table.keys)
+                table.keys.append(KeyInfo(*lookup))
+        elif tag == '#EXT-X-MAP':
+            attrs = parse_attributes(value)
+            if not attrs.get('URI'):
+                init_index = -1
+                continue
+            lookup = (urljoin(playlist_url, attrs['URI']), attrs.get('BYTERANGE'))
+            init_index = init_lookup.get(lookup, -1)
+            if init_index < 0:
+                init_index = init_lookup[lookup] = len(table.init_sections)
+                table.init_sections.append(InitSection(*lookup))
+        elif tag == '#EXT-X-MEDIA-SEQUENCE':
+            table.media_sequence = int(value.strip() or 0)
+        elif tag == '#EXT-X-TARGETDURATION':
+            table.target_duration = float(value.strip() or 0)
+        elif tag == '#EXT-X-ENDLIST':
+            table.is_endlist = True
+    return table
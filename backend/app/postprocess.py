@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+
+def default_merge_workers() -> int:
+    """合并 (-c copy) 主要受磁盘带宽限制：CPU 核数的一半，最多 4 个"""
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+
+# 同时进行的合并数量，与下载并发数分开限制
+MERGE_WORKERS = int(os.environ.get("M3U8_MERGE_WORKERS", 0)) or default_merge_workers()
+
+
+class MergeCancelled(Exception):
+    """等待合并期间任务被停止"""
+
+    def __init__(self):
+        super().__init__("等待合并时任务被中止")
+
+
+class MergePool:
+    """合并/后处理队列 - 分片下载完成的任务按先后顺序排队，同时最多 max_workers 个在合并
+
+    任务在进入队列前释放下载槽位，排队中的下载任务可以立即开始。
+    """
+
+    def __init__(self, max_workers: int = MERGE_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self.cond = threading.Condition()
+        self.running: Dict[str, float] = {}  # 任务ID -> 开始合并时间
+        self.waiting: List[str] = []
+
+    def _ready(self, task_id: str) -> bool:
+        """需在 cond 内调用"""
+        return len(self.running) < self.max_workers and self.waiting[0] == task_id
+
+    @contextmanager
+    def slot(self, task_id: str, on_wait: Optional[Callable[[], None]] = None,
+             cancelled: Optional[Callable[[], bool]] = None):
+        """占用一个合并名额
+
+        需要排队时先调用一次 on_wait（例如把内存中的分片写入磁盘，让出共享内存预算）；
+        cancelled() 返回 True 时放弃排队并抛出 MergeCancelled。
+        """
+        with self.cond:
+            self.waiting.append(task_id)
+            ready = self._ready(task_id)
+        try:
+            if not ready and on_wait is not None:
+                on_wait()
+            with self.cond:
+                while not self._ready(task_id):
+                    if cancelled is not None and cancelled():
+                        raise MergeCancelled()
+                    self.cond.wait(1)
+                self.waiting.remove(task_id)
+                self.running[task_id] = time.time()
+        except BaseException:
+            with self.cond:
+                if task_id in self.waiting:
+                    self.waiting.remove(task_id)
+                self.cond.notify_all()
+            raise
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.running.pop(task_id, None)
+                self.cond.notify_all()
+
+    def set_limit(self, max_workers: int):
+        with self.cond:
+            self.max_workers = max(1, max_workers)
+            self.cond.notify_all()
+
+    def snapshot(self) -> Dict:
+        now = time.time()
+        with self.cond:
+            return {
+                "max_workers": self.max_workers,
+                "running": [{"task_id": task_id, "seconds": round(now - started, 1)}
+                            for task_id, started in self.running.items()],
+                "waiting": list(self.waiting),
+            }
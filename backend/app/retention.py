@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import DownloadTask, TaskStatus
+from tracing import remove_task_traces
+
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value: Optional[str]) -> int:
+    """解析 "50G" / "500M" / 字节数，空值为 0（不启用）"""
+    if not value:
+        return 0
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+class RetentionPolicy:
+    """保留策略
+
+    - max_age_days: 已完成的文件超过该天数未被下载则删除
+    - recycle_bin_days: 回收站中的任务保留天数
+    - high_watermark / low_watermark: 下载目录总占用超过高水位时，
+      按回收站优先、最近最少下载的顺序删除，直到低于低水位（0 为不启用）
+    """
+
+    def __init__(self, max_age_days: float = 7, recycle_bin_days: float = 1,
+                 high_watermark: int = 0, low_watermark: int = 0,
+                 batch_size: int = 100, interval: float = 60):
+        self.max_age_days = max_age_days
+        self.recycle_bin_days = recycle_bin_days
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark or high_watermark, high_watermark)
+        self.batch_size = batch_size
+        self.interval = interval
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        env = os.environ.get
+        return cls(max_age_days=float(env("M3U8_RETENTION_DAYS", 7)),
+                   recycle_bin_days=float(env("M3U8_RECYCLE_BIN_DAYS", 1)),
+                   high_watermark=parse_size(env("M3U8_RETENTION_HIGH_WATERMARK")),
+                   low_watermark=parse_size(env("M3U8_RETENTION_LOW_WATERMARK")),
+                   batch_size=int(env("M3U8_RETENTION_BATCH", 100)),
+                   interval=float(env("M3U8_RETENTION_INTERVAL", 60)))
+
+    def to_dict(self) -> Dict:
+        return {
+            "max_age_days": self.max_age_days,
+            "recycle_bin_days": self.recycle_bin_days,
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "batch_size": self.batch_size,
+            "interval": self.interval,
+        }
+
+
+class RetentionEngine:
+    """后台保留引擎 - 定期按策略分批删除文件及其任务记录
+
+    每批最多 batch_size 条记录，文件删除成功（或文件已不存在）后才删除记录，
+    每批单独提交，不会长时间持有数据库写锁。
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], download_dir: str,
+                 policy: Optional[RetentionPolicy] = None, trace_dir: Optional[str] = None):
+        self.session_factory = session_factory
+        self.download_dir = download_dir
+        self.trace_dir = trace_dir
+        self.policy = policy or RetentionPolicy()
+        self.run_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.last_run: Optional[Dict] = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ 保留策略执行失败: {str(e)}")
+            self.stop_event.wait(self.policy.interval)
+
+    def run_once(self) -> Dict:
+        """执行一轮保留策略，返回统计"""
+        with self.run_lock:
+            start = time.perf_counter()
+            stats = {"recycle_bin": 0, "expired": 0, "evicted": 0, "freed_bytes": 0, "failed": 0}
+            db = self.session_factory()
+            try:
+                self._backfill(db)
+                now = datetime.utcnow()
+                self._purge(db, stats, "recycle_bin", [
+                    DownloadTask.status == TaskStatus.DELETED,
+                    DownloadTask.deleted_at < now - timedelta(days=self.policy.recycle_bin_days),
+                ], DownloadTask.deleted_at)
+                if self.policy.max_age_days > 0:
+                    self._purge(db, stats, "expired", [
+                        DownloadTask.status == TaskStatus.COMPLETED,
+                        DownloadTask.last_accessed_at < now - timedelta(days=self.policy.max_age_days),
+                    ], DownloadTask.last_accessed_at)
+                self._enforce_watermark(db, stats)
+                stats["total_bytes"] = self.total_bytes(db)
+            finally:
+                db.close()
+            stats["seconds"] = round(time.perf_counter() - start, 3)
+            stats["finished_at"] = datetime.utcnow().isoformat()
+            self.last_run = stats
+            removed = stats["recycle_bin"] + stats["expired"] + stats["evicted"]
+            if removed:
+                print(f"🧹 保留策略: 回收站 {stats['recycle_bin']}、过期 {stats['expired']}、"
+                      f"超出水位 {stats['evicted']}，释放 {stats['freed_bytes'] / 1024 / 1024:.1f}MB")
+            return stats
+
+    def _backfill(self, db: Session):
+        """旧记录补齐保留策略依赖的列"""
+        db.query(DownloadTask).filter(
+            DownloadTask.status == TaskStatus.DELETED, DownloadTask.deleted_at.is_(None)
+        ).update({DownloadTask.deleted_at: DownloadTask.updated_at,
+                  DownloadTask.updated_at: DownloadTask.updated_at}, synchronize_session=False)
+        db.query(DownloadTask).filter(
+            DownloadTask.status == TaskStatus.COMPLETED, DownloadTask.last_accessed_at.is_(None)
+        ).update({DownloadTask.last_accessed_at: DownloadTask.updated_at,
+                  DownloadTask.updated_at: DownloadTask.updated_at}, synchronize_session=False)
+        db.commit()
+
+        while not self.stop_event.is_set():
+            batch = db.query(DownloadTask).filter(
+                DownloadTask.status.in_([TaskStatus.COMPLETED, TaskStatus.DELETED]),
+                DownloadTask.file_bytes.is_(None)
+            ).limit(self.policy.batch_size).all()
+            if not batch:
+                break
+            for task in batch:
+                path = os.path.join(self.download_dir, task.filename)
+                task.file_bytes = os.path.getsize(path) if os.path.isfile(path) else 0
+            db.commit()
+
+    def total_bytes(self, db: Session) -> int:
+        return db.query(func.coalesce(func.sum(DownloadTask.file_bytes), 0)).filter(
+            DownloadTask.status.in_([TaskStatus.COMPLETED, TaskStatus.DELETED])).scalar()
+
+    def _remove(self, db: Session, task: DownloadTask) -> bool:
+        """删除文件、追踪文件和记录；其他未删除的任务引用同一文件时只删除记录"""
+        path = os.path.join(self.download_dir, task.filename)
+        shared = db.query(DownloadTask.id).filter(
+            DownloadTask.filename == task.filename,
+            DownloadTask.id != task.id,
+            DownloadTask.status != TaskStatus.DELETED,
+        ).first()
+        if not shared:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"   ❌ 删除文件失败 {task.filename}: {str(e)}")
+                return False
+        if self.trace_dir:
+            remove_task_traces(self.trace_dir, task.task_id)
+        db.delete(task)
+        return True
+
+    def _purge(self, db: Session, stats: Dict, name: str, conditions: List, order_column,
+               limit_bytes: Optional[int] = None):
+        """按条件分批删除；limit_bytes 为需要释放的字节数"""
+        failed: Set[int] = set()
+        freed = 0
+        while not self.stop_event.is_set():
+            query = db.query(DownloadTask).filter(*conditions)
+            if failed:
+                query = query.filter(DownloadTask.id.notin_(failed))
+            batch = query.order_by(order_column, DownloadTask.id).limit(self.policy.batch_size).all()
+            if not batch:
+                break
+            for task in batch:
+                if limit_bytes is not None and freed >= limit_bytes:
+                    break
+                size = task.file_bytes or 0
+                if self._remove(db, task):
+                    stats[name] += 1
+                    stats["freed_bytes"] += size
+                    freed += size
+                else:
+                    failed.add(task.id)
+                    stats["failed"] += 1
+            db.commit()
+            if limit_bytes is not None and freed >= limit_bytes:
+                break
+        return freed
+
+    def _enforce_watermark(self, db: Session, stats: Dict):
+        if not self.policy.high_watermark:
+            return
+        total = self.total_bytes(db)
+        if total <= self.policy.high_watermark:
+            return
+        excess = total - self.policy.low_watermark
+        print(f"💾 下载目录占用 {total / 1024 / 1024:.1f}MB 超过高水位，开始淘汰")
+        # 先清空回收站，再按最近最少下载淘汰已完成的文件
+        excess -= self._purge(db, stats, "evicted", [DownloadTask.status == TaskStatus.DELETED],
+                              DownloadTask.deleted_at, limit_bytes=excess)
+        if excess > 0:
+            self._purge(db, stats, "evicted", [DownloadTask.status == TaskStatus.COMPLETED],
+                        DownloadTask.last_accessed_at, limit_bytes=excess)
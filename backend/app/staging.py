@@ -0,0 +1,120 @@
+import os
+import threading
+from typing import Dict, List, Optional
+
+import metrics
+
+# 所有任务共享的分片内存预算，超出后新分片直接写入磁盘
+STAGING_MEMORY_BYTES = int(os.environ.get("M3U8_STAGING_MEMORY", 256 * 1024 * 1024))
+
+
+def write_atomic(path: str, data: bytes):
+    """先写临时文件再改名，已存在的分片文件总是完整的（断点续传、边下边播依赖这一点）"""
+    part_path = path + '.part'
+    with open(part_path, 'wb') as f:
+        f.write(data)
+    os.replace(part_path, path)
+
+
+class MemoryBudget:
+    """共享内存预算"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self, size: int) -> bool:
+        with self.lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size: int):
+        with self.lock:
+            self.used = max(0, self.used - size)
+
+
+GLOBAL_STAGING_BUDGET = MemoryBudget(STAGING_MEMORY_BYTES)
+metrics.REGISTRY.register(metrics.Gauge(
+    "m3u8_staging_memory_bytes", "Segment bytes held in memory awaiting merge",
+    func=lambda: GLOBAL_STAGING_BUDGET.used))
+
+
+class SegmentStore:
+    """轨道的分片暂存区：预算内保存在内存中直到被合并消费，超出预算写入磁盘
+
+    budget 为 None 时全部写入磁盘。
+    """
+
+    def __init__(self, directory: str, budget: Optional[MemoryBudget] = GLOBAL_STAGING_BUDGET):
+        self.directory = directory
+        self.budget = budget
+        self.memory: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+        # 本暂存区写入磁盘的字节数（直接写盘 + 溢出），内存中的分片不计入
+        self.disk_bytes = 0
+
+    def put(self, name: str, data: bytes):
+        if self.budget is not None and self.budget.try_acquire(len(data)):
+            with self.lock:
+                old = self.memory.get(name)
+                self.memory[name] = data
+            if old is not None:
+                self.budget.release(len(old))
+            return
+        self._write(name, data)
+
+    def _write(self, name: str, data: bytes):
+        write_atomic(os.path.join(self.directory, name), data)
+        with self.lock:
+            self.disk_bytes += len(data)
+        metrics.STAGING_SPILLED_BYTES.inc(len(data))
+
+    def in_memory(self, name: str) -> bool:
+        with self.lock:
+            return name in self.memory
+
+    def exists(self, name: str) -> bool:
+        return self.in_memory(name) or os.path.exists(os.path.join(self.directory, name))
+
+    def get_memory(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            return self.memory.get(name)
+
+    def read(self, name: str) -> bytes:
+        data = self.get_memory(name)
+        if data is not None:
+            return data
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            return f.read()
+
+    def memory_count(self) -> int:
+        with self.lock:
+            return len(self.memory)
+
+    def discard(self, name: str):
+        """合并阶段消费后释放内存"""
+        with self.lock:
+            data = self.memory.pop(name, None)
+        if data is not None and self.budget is not None:
+            self.budget.release(len(data))
+
+    def spill(self, names: Optional[List[str]] = None):
+        """把内存中的分片写入磁盘（FFmpeg 需要文件输入、任务中断保留进度时）"""
+        with self.lock:
+            names = list(self.memory) if names is None else [n for n in names if n in self.memory]
+        for name in names:
+            data = self.get_memory(name)
+            if data is None:
+                continue
+            self._write(name, data)
+            self.discard(name)
+
+    def clear(self):
+        """释放全部内存（任务结束）"""
+        with self.lock:
+            names = list(self.memory)
+        for name in names:
+            self.discard(name)
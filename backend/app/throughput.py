@@ -0,0 +1,77 @@
+import threading
+import time
+from typing import Optional
+
+
+class ThroughputMeter:
+    """线程安全的滑动窗口吞吐统计
+
+    以固定宽度的时间片组成环形缓冲区累加字节数，速度 = 窗口内字节数 / 窗口时长。
+    多个下载线程同时调用 add()，读取方随时调用 rate()，不会像单个分片的
+    瞬时速度那样大幅跳动。
+    """
+
+    def __init__(self, window: float = 10.0, resolution: float = 0.5):
+        self.resolution = resolution
+        self.slots = max(1, int(window / resolution))
+        self.buckets = [0] * self.slots
+        self.bucket_ids = [0] * self.slots
+        self.total_bytes = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.buckets = [0] * self.slots
+            self.bucket_ids = [0] * self.slots
+            self.total_bytes = 0
+            self.started = time.monotonic()
+
+    def add(self, nbytes: int):
+        """记录新到达的字节"""
+        if nbytes <= 0:
+            return
+        now_id = int(time.monotonic() / self.resolution)
+        idx = now_id % self.slots
+        with self.lock:
+            if self.bucket_ids[idx] != now_id:
+                self.bucket_ids[idx] = now_id
+                self.buckets[idx] = 0
+            self.buckets[idx] += nbytes
+            self.total_bytes += nbytes
+
+    def rate(self) -> float:
+        """窗口内的平均速度 (bytes/s)"""
+        now = time.monotonic()
+        now_id = int(now / self.resolution)
+        oldest_id = now_id - self.slots + 1
+        with self.lock:
+            window_bytes = sum(b for b, bid in zip(self.buckets, self.bucket_ids) if bid >= oldest_id)
+            # 刚开始时窗口还没填满，按实际经过的时间计算
+            elapsed = min(now - self.started, self.slots * self.resolution)
+        if elapsed <= 0:
+            return 0.0
+        return window_bytes / max(elapsed, self.resolution)
+
+    def eta(self, remaining_bytes: float) -> Optional[float]:
+        """按当前速度估算剩余时间 (秒)，速度未知时返回 None"""
+        speed = self.rate()
+        if speed <= 0:
+            return None
+        return max(0.0, remaining_bytes) / speed
+
+
+# 全部任务的总吞吐
+GLOBAL_METER = ThroughputMeter()
+
+
+def format_duration(seconds: Optional[float]) -> Optional[str]:
+    """格式化剩余时间显示"""
+    if seconds is None:
+        return None
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}秒"
+    if seconds < 3600:
+        return f"{seconds // 60}分{seconds % 60:02d}秒"
+    return f"{seconds // 3600}小时{seconds % 3600 // 60:02d}分"
@@ -0,0 +1,182 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+# 任务追踪 ({task_id}.json / .chrome.json) 和 cProfile 结果 ({task_id}.prof) 的保存目录
+TRACE_DIR = os.environ.get("M3U8_TRACE_DIR", "./traces")
+
+
+class TaskTracer:
+    """单个任务的耗时追踪 (可选开启)
+
+    记录阶段级 (解析播放列表、密钥、下载分片、合并) 和分片级 (排队等待、
+    首字节、传输、解密、写盘) 的时间段，可导出为 JSON 汇总或 Chrome
+    trace-event 格式 (chrome://tracing / Perfetto 可直接打开)。
+    """
+
+    def __init__(self, task_id: str, enabled: bool = False):
+        self.task_id = task_id
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans: List[Dict] = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, category: str, start: float, end: float, **args):
+        """记录一个时间段，start/end 为 time.perf_counter() 的值"""
+        if not self.enabled:
+            return
+        span = {
+            "name": name,
+            "cat": category,
+            "start": start - self.origin,
+            "dur": max(0.0, end - start),
+            "tid": threading.get_ident(),
+        }
+        if args:
+            span["args"] = args
+        with self.lock:
+            self.spans.append(span)
+
+    def span(self, name: str, category: str = "phase", **args):
+        """计时上下文，未开启追踪时没有额外开销"""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name: str, category: str, args: Dict):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.perf_counter(), **args)
+
+    def summary(self) -> Dict:
+        """按 (类别, 名称) 汇总次数、总耗时和最大耗时"""
+        totals: Dict[str, Dict] = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            key = f"{span['cat']}.{span['name']}"
+            item = totals.setdefault(key, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            item["count"] += 1
+            item["total_seconds"] += span["dur"]
+            item["max_seconds"] = max(item["max_seconds"], span["dur"])
+        for item in totals.values():
+            item["total_seconds"] = round(item["total_seconds"], 6)
+            item["max_seconds"] = round(item["max_seconds"], 6)
+        return totals
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            "task_id": self.task_id,
+            "started_at": self.wall_start,
+            "summary": self.summary(),
+            "spans": spans,
+        }
+
+    def to_chrome(self) -> Dict:
+        """Chrome trace-event 格式 (完整事件 ph=X，时间单位微秒)"""
+        with self.lock:
+            spans = list(self.spans)
+        events = []
+        for span in spans:
+            event = {
+                "name": span["name"],
+                "cat": span["cat"],
+                "ph": "X",
+                "ts": round(span["start"] * 1e6, 3),
+                "dur": round(span["dur"] * 1e6, 3),
+                "pid": self.task_id,
+                "tid": span["tid"],
+            }
+            if "args" in span:
+                event["args"] = span["args"]
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path: str):
+        """保存为 JSON 文件，同时生成 Chrome trace-event 文件"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        with open(chrome_trace_path(path), "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome(), f)
+
+
+class TaskProfiler:
+    """任务的 cProfile 性能分析 (可选开启)
+
+    cProfile 只记录调用它的线程，分片下载在线程池中进行：任务主线程和每个下载/对冲线程
+    各用一个 Profile，保存时用 pstats.Stats.add 合并。FFmpeg 子进程不在统计范围内。
+    """
+
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        self.lock = threading.Lock()
+
+    def run(self, func: Callable, *args, **kwargs):
+        """在当前线程中开启一个新的 Profile 运行 func"""
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        return profile.runcall(func, *args, **kwargs)
+
+    def wrap(self, func: Callable) -> Callable:
+        """包装线程入口 / 线程池任务"""
+        def wrapper(*args, **kwargs):
+            return self.run(func, *args, **kwargs)
+        return wrapper
+
+    def save(self, path: str):
+        """合并所有线程的统计并保存为 .prof 文件"""
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        stats.dump_stats(path)
+
+
+def chrome_trace_path(path: str) -> str:
+    """x.json -> x.chrome.json"""
+    root, _ = os.path.splitext(path)
+    return root + ".chrome.json"
+
+
+def task_trace_files(trace_dir: str, task_id: str) -> List[str]:
+    """任务可能生成的追踪和性能分析文件"""
+    path = os.path.join(trace_dir, f"{task_id}.json")
+    return [path, chrome_trace_path(path), os.path.join(trace_dir, f"{task_id}.prof")]
+
+
+def remove_task_traces(trace_dir: str, task_id: str):
+    """删除任务的追踪和性能分析文件（任务记录删除时调用）"""
+    for path in task_trace_files(trace_dir, task_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"❌ 删除追踪文件失败 {path}: {str(e)}")
+
+
+def load_trace(path: str, chrome: bool = False) -> Optional[Dict]:
+    """读取已保存的追踪文件"""
+    if chrome:
+        path = chrome_trace_path(path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+from typing import Dict, Iterator, Optional
+
+# 在模块加载时导入：在下载线程里首次导入会持有导入锁，并发任务一起等待并拖慢事件循环
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 未指定时使用的传输方式: http1 (requests) / http2 (httpx，需要 pip install "httpx[http2]")
+DEFAULT_TRANSPORT = os.environ.get("M3U8_TRANSPORT", "http1")
+TRANSPORTS = ("http1", "http2")
+
+# HTTP/2 不允许的逐跳请求头
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"}
+
+
+class RequestsTransport:
+    """HTTP/1.1 传输 - 每个任务一个 requests.Session，每个并发分片占用一个连接"""
+
+    name = "http1"
+
+    def __init__(self, cookies: Optional[Dict] = None, proxy: Optional[Dict] = None):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=10,  # 减少连接数
+            pool_maxsize=50,      # 减少最大连接
+            max_retries=2
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if cookies:
+            self.session.cookies.update(cookies)
+        if proxy:
+            self.session.proxies.update(proxy)
+
+    def get(self, url: str, headers: Dict, timeout: float, stream: bool = True):
+        return self.session.get(url, timeout=timeout, headers=headers, stream=stream)
+
+    def head(self, url: str, headers: Dict, timeout: float):
+        return self.session.head(url, timeout=timeout, headers=headers, allow_redirects=True)
+
+    def close(self):
+        self.session.close()
+
+
+class HTTPXResponse:
+    """把 httpx 响应适配为下载器使用的 requests 风格接口"""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            # 释放多路复用连接上的流
+            self.response.close()
+        self.response.raise_for_status()
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        try:
+            yield from self.response.iter_bytes(chunk_size)
+        finally:
+            self.response.close()
+
+    def close(self):
+        self.response.close()
+
+
+class HTTP2Transport:
+    """HTTP/2 传输 - 同一主机的并发分片复用少量连接上的多路流
+
+    httpx 客户端按代理在所有任务间共享，同一主机的连接跨任务复用；
+    Cookie 随请求发送，不写入共享客户端。
+    """
+
+    name = "http2"
+
+    _clients: Dict[str, object] = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, cookies: Optional[Dict] = None, proxy: Optional[Dict] = None):
+        self.cookie_header = "; ".join(f"{k}={v}" for k, v in (cookies or {}).items())
+        self.proxy_url = (proxy or {}).get('https') or (proxy or {}).get('http')
+        self.client = self._shared_client(self.proxy_url)
+
+    @classmethod
+    def _shared_client(cls, proxy_url: Optional[str]):
+        import httpx
+
+        key = proxy_url or ""
+        with cls._clients_lock:
+            client = cls._clients.get(key)
+            if client is None:
+                limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+                transport = httpx.HTTPTransport(http2=True, retries=2, limits=limits, proxy=proxy_url)
+                client = httpx.Client(transport=transport, follow_redirects=True)
+                cls._clients[key] = client
+            return client
+
+    def _headers(self, headers: Dict) -> Dict:
+        headers = {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        if self.cookie_header:
+            headers['Cookie'] = self.cookie_header
+        return headers
+
+    def get(self, url: str, headers: Dict, timeout: float, stream: bool = True):
+        request = self.client.build_request('GET', url, headers=self._headers(headers), timeout=timeout)
+        return HTTPXResponse(self.client.send(request, stream=True))
+
+    def head(self, url: str, headers: Dict, timeout: float):
+        response = self.client.head(url, headers=self._headers(headers), timeout=timeout)
+        return HTTPXResponse(response)
+
+    def close(self):
+        """共享客户端由进程持有，任务结束时不关闭"""
+
+
+def http2_available() -> bool:
+    try:
+        import httpx  # noqa: F401
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def create_transport(name: Optional[str] = None, cookies: Optional[Dict] = None,
+                     proxy: Optional[Dict] = None):
+    """按名称创建传输，HTTP/2 依赖未安装时回退到 requests"""
+    name = (name or DEFAULT_TRANSPORT).lower()
+    if name not in TRANSPORTS:
+        raise ValueError(f"不支持的传输方式: {name}")
+    if name == "http2":
+        if http2_available():
+            return HTTP2Transport(cookies, proxy)
+        logger.warning("未安装 httpx[http2]，回退到 HTTP/1.1 传输")
+    return RequestsTransport(cookies, proxy)
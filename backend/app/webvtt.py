@@ -0,0 +1,109 @@
+import re
+from typing import Iterable, List, Optional, Set, Tuple
+
+# MPEG-TS 时间戳为 33 位、90kHz
+MPEGTS_CLOCK = 90000
+MPEGTS_ROLLOVER = (1 << 33) / MPEGTS_CLOCK
+
+TIMESTAMP_PATTERN = r'(?:(\d+):)?(\d{2}):(\d{2})[.,](\d{3})'
+CUE_TIMING = re.compile(rf'^\s*{TIMESTAMP_PATTERN}\s+-->\s+{TIMESTAMP_PATTERN}(.*)$')
+TIMESTAMP_MAP = re.compile(r'X-TIMESTAMP-MAP=(.*)', re.IGNORECASE)
+
+
+def parse_timestamp(hours: Optional[str], minutes: str, seconds: str, millis: str) -> float:
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 1000
+
+
+def format_timestamp(value: float) -> str:
+    millis = int(round(max(0.0, value) * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    seconds, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{millis:03d}"
+
+
+def parse_timestamp_map(value: str) -> Optional[float]:
+    """X-TIMESTAMP-MAP=MPEGTS:<90kHz>,LOCAL:<时间> -> 分片内时间到媒体时间的偏移（秒）"""
+    mpegts, local = None, None
+    for part in value.split(','):
+        name, _, attr = part.strip().partition(':')
+        if name.upper() == 'MPEGTS' and attr.strip().isdigit():
+            mpegts = int(attr.strip()) / MPEGTS_CLOCK
+        elif name.upper() == 'LOCAL':
+            match = re.match(TIMESTAMP_PATTERN, attr.strip())
+            if match:
+                local = parse_timestamp(*match.groups())
+    if mpegts is None:
+        return None
+    return mpegts - (local or 0.0)
+
+
+def parse_segment(text: str) -> Tuple[Optional[float], List[Tuple[float, float, str, str]]]:
+    """解析一个 WebVTT 分片，返回 (时间偏移, [(开始, 结束, 设置, 文本)])
+
+    只保留字幕块，NOTE / STYLE / REGION 块和字幕ID丢弃。
+    """
+    offset = None
+    cues = []
+    blocks = re.split(r'\n\s*\n', text.lstrip('\ufeff').replace('\r\n', '\n').replace('\r', '\n'))
+    for n, block in enumerate(blocks):
+        lines = [line for line in block.split('\n') if line.strip()]
+        if not lines:
+            continue
+        if n == 0 and lines[0].startswith('WEBVTT'):
+            for line in lines[1:]:
+                match = TIMESTAMP_MAP.match(line.strip())
+                if match:
+                    offset = parse_timestamp_map(match.group(1))
+            continue
+        timing_index = next((i for i, line in enumerate(lines[:2]) if '-->' in line), None)
+        if timing_index is None:
+            continue
+        match = CUE_TIMING.match(lines[timing_index])
+        if not match:
+            continue
+        groups = match.groups()
+        start = parse_timestamp(*groups[0:4])
+        end = parse_timestamp(*groups[4:8])
+        cues.append((start, end, groups[8].rstrip(), '\n'.join(lines[timing_index + 1:])))
+    return offset, cues
+
+
+def merge_segments(segments: Iterable[bytes]) -> Tuple[str, float]:
+    """把 HLS WebVTT 分片合并为一个从 0 开始的 .vtt
+
+    分片的字幕时间是媒体时间轴上的绝对时间（经 X-TIMESTAMP-MAP 映射到 MPEG-TS 时间），
+    不能像音视频那样按文件时长依次平移。以第一个分片的映射为起点（与视频的起始时间一致），
+    跨分片重复出现的字幕只保留一次，空分片直接跳过。
+
+    返回 (.vtt 内容, 第一条字幕的开始时间)。FFmpeg 会把每个输入平移到从 0 开始，
+    合并时需用 -itsoffset 补回第一条字幕之前的空白。
+    """
+    base = None
+    previous = None
+    first = None
+    seen: Set[Tuple[int, int, str]] = set()
+    output = ['WEBVTT', '']
+    for data in segments:
+        offset, cues = parse_segment(data.decode('utf-8', errors='replace'))
+        if offset is not None:
+            # 33 位 MPEG-TS 时间戳回绕
+            while previous is not None and offset < previous - MPEGTS_ROLLOVER / 2:
+                offset += MPEGTS_ROLLOVER
+            previous = offset
+            if base is None:
+                base = offset
+        shift = 0.0 if offset is None or base is None else offset - base
+        for start, end, settings, text in cues:
+            start, end = start + shift, end + shift
+            if end <= 0 or not text:
+                continue
+            key = (int(round(start * 1000)), int(round(end * 1000)), text)
+            if key in seen:
+                continue
+            seen.add(key)
+            first = start if first is None else min(first, start)
+            output.append(f"{format_timestamp(start)} --> {format_timestamp(end)}{settings}")
+            output.append(text)
+            output.append('')
+    return '\n'.join(output), max(0.0, first or 0.0)
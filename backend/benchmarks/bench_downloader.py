@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""M3U8Downloader 离线基准测试
+
+每个场景启动一个独立进程的合成 HLS 源站（见 hls_origin.py），在本进程内运行
+M3U8Downloader.download()，统计端到端吞吐、峰值 RSS、峰值线程数和数据库写入次数。
+进度回调与 main_fixed.update_task_progress 一致，写入一个临时 SQLite 数据库。
+
+    python benchmarks/bench_downloader.py                 # 内置场景
+    python benchmarks/bench_downloader.py --segments 500 --encrypt --latency 0.05
+    python benchmarks/bench_downloader.py --json result.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from hls_origin import OriginConfig, start_origin_process, add_origin_arguments  # noqa: E402
+
+# 内置场景: (名称, 源站参数)
+SCENARIOS = [
+    ("baseline", dict(segments=200, segment_size=512 * 1024)),
+    ("aes128", dict(segments=200, segment_size=512 * 1024, encrypt=True)),
+    ("latency_jitter", dict(segments=200, segment_size=256 * 1024, latency=0.05, jitter=0.03)),
+    ("errors_5pct", dict(segments=200, segment_size=256 * 1024, error_rate=0.05)),
+    ("throttled", dict(segments=100, segment_size=512 * 1024, throttle=2 * 1024 * 1024)),
+    ("byterange", dict(segments=400, segment_size=128 * 1024, byterange=True)),
+    # 独立音频轨道为打包 AAC（ID3 + ADTS），校验失败会使 ok 为 False
+    ("demuxed_aac", dict(segments=100, segment_size=256 * 1024, audio=True, encrypt=True)),
+]
+
+
+def read_rss() -> int:
+    """当前 RSS (bytes)，优先读取 /proc"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ResourceSampler:
+    """后台采样峰值 RSS 和线程数"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, read_rss())
+            # 不计采样线程自身
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class DatabaseProbe:
+    """临时 SQLite 数据库，统计进度写入次数"""
+
+    def __init__(self, work_dir: str):
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.orm import sessionmaker
+        from models import Base, DownloadTask, TaskStatus
+
+        self.engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'bench.db')}",
+                                    connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.DownloadTask = DownloadTask
+        self.commits = 0
+        self.commit_seconds = 0.0
+        self.lock = threading.Lock()
+        event.listen(self.engine, "commit", self._on_commit)
+
+        db = self.Session()
+        db.add(DownloadTask(task_id="bench", url="", filename="bench.mp4", status=TaskStatus.DOWNLOADING))
+        db.commit()
+        db.close()
+        self.commits = 0
+
+    def _on_commit(self, conn):
+        with self.lock:
+            self.commits += 1
+
+    def progress_callback(self, progress, current, total, speed, eta=None):
+        """与 main_fixed.update_task_progress 相同的写入方式"""
+        start = time.perf_counter()
+        db = self.Session()
+        try:
+            task = db.query(self.DownloadTask).filter(self.DownloadTask.task_id == "bench").first()
+            task.progress = progress
+            task.download_speed = speed
+            db.commit()
+        finally:
+            db.close()
+        with self.lock:
+            self.commit_seconds += time.perf_counter() - start
+
+
+def run_scenario(name: str, config: OriginConfig, threads: int, merge: bool, hedge: bool = False) -> dict:
+    from downloader_fixed import M3U8Downloader
+
+    class BenchDownloader(M3U8Downloader):
+        def merge_tracks(self, tracks, output_path):
+            if merge:
+                return super().merge_tracks(tracks, output_path)
+            # 只测下载/解密/写盘
+            return True
+
+    proc, url = start_origin_process(config)
+    work_dir = tempfile.mkdtemp(prefix="m3u8_bench_")
+    try:
+        db = DatabaseProbe(work_dir)
+        downloader = BenchDownloader(task_id="bench", url=url, save_path=os.path.join(work_dir, "out.mp4"),
+                                     max_threads=threads, hedge=hedge)
+        rss_before = read_rss()
+        with ResourceSampler() as sampler:
+            start = time.perf_counter()
+            ok = downloader.download(db.progress_callback)
+            elapsed = time.perf_counter() - start
+
+        payload = config.total_bytes
+        return {
+            "scenario": name,
+            "ok": ok,
+            "segments": config.segments,
+            "segment_size": config.segment_size,
+            "threads": threads,
+            "seconds": round(elapsed, 3),
+            "throughput_mb_s": round(payload / elapsed / 1024 / 1024, 2) if elapsed > 0 else 0,
+            "segments_per_s": round(config.segments / elapsed, 1) if elapsed > 0 else 0,
+            "peak_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+            "rss_growth_mb": round((sampler.peak_rss - rss_before) / 1024 / 1024, 1),
+            "peak_threads": sampler.peak_threads,
+            "db_writes": db.commits,
+            "db_write_seconds": round(db.commit_seconds, 3),
+        }
+    finally:
+        proc.terminate()
+        proc.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_table(results):
+    columns = ["scenario", "ok", "seconds", "throughput_mb_s", "segments_per_s",
+               "peak_rss_mb", "peak_threads", "db_writes", "db_write_seconds"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="M3U8Downloader 离线基准测试")
+    add_origin_arguments(parser)
+    parser.add_argument('--threads', type=int, default=10, help='下载线程数')
+    parser.add_argument('--scenario', action='append', help='只运行指定的内置场景 (可重复)')
+    parser.add_argument('--custom', action='store_true', help='使用命令行源站参数运行单个场景')
+    parser.add_argument('--hedge', action='store_true', help='开启对冲请求')
+    parser.add_argument('--merge', action='store_true', help='包含 FFmpeg 合并阶段 (需要 ffmpeg)')
+    parser.add_argument('--json', help='结果写入 JSON 文件')
+    parser.add_argument('--quiet', action='store_true', help='屏蔽下载器输出')
+    args = parser.parse_args()
+
+    if args.custom:
+        scenarios = [("custom", OriginConfig.from_args(args))]
+    else:
+        selected = [s for s in SCENARIOS if not args.scenario or s[0] in args.scenario]
+        scenarios = [(name, OriginConfig(**params)) for name, params in selected]
+
+    results = []
+    for name, config in scenarios:
+        print(f"▶️ 场景 {name}: {config.segments} 个分片 × {config.segment_size // 1024}KB", file=sys.stderr)
+        if args.quiet:
+            with open(os.devnull, 'w') as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    result = run_scenario(name, config, args.threads, args.merge, args.hedge)
+                finally:
+                    sys.stdout = stdout
+        else:
+            result = run_scenario(name, config, args.threads, args.merge, args.hedge)
+        results.append(result)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
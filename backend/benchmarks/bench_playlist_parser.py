@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""媒体播放列表解析基准测试 - playlist_parser.parse_media_playlist 对比 m3u8.loads
+
+生成合成的大型 VOD 播放列表（可选密钥轮换、EXT-X-BYTERANGE、EXT-X-MAP），
+分别统计两种解析方式的耗时和 tracemalloc 峰值内存，并校验解析结果一致。
+
+    python benchmarks/bench_playlist_parser.py
+    python benchmarks/bench_playlist_parser.py --segments 100000 --repeat 3
+    python benchmarks/bench_playlist_parser.py --json result.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import m3u8  # noqa: E402
+
+from playlist_parser import parse_media_playlist  # noqa: E402
+
+PLAYLIST_URL = "https://cdn.example.com/vod/movie/index.m3u8?token=abc"
+
+# 内置场景: (名称, 生成参数)
+SCENARIOS = [
+    ("plain", dict()),
+    ("aes_key_rotation", dict(key_every=100)),
+    ("byterange", dict(byterange=True)),
+    ("fmp4", dict(fmp4=True)),
+]
+
+
+def generate_playlist(segments: int, key_every: int = 0, byterange: bool = False, fmp4: bool = False) -> str:
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7' if fmp4 else '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6',
+             '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+    if fmp4:
+        lines.append('#EXT-X-MAP:URI="init.mp4"')
+    ext = 'm4s' if fmp4 else 'ts'
+    for i in range(segments):
+        if key_every and i % key_every == 0:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="keys/{i // key_every}.key",IV=0x{i:032x}')
+        lines.append(f'#EXTINF:{5.005 + (i % 3) * 0.5:.3f},')
+        if byterange:
+            lines.append(f'#EXT-X-BYTERANGE:{500000 + i % 7}')
+            lines.append(f'media.{ext}')
+        else:
+            lines.append(f'seg/{i:06d}.{ext}?token=abc')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def measure(parse, content: str, repeat: int):
+    """返回 (最短耗时, 峰值内存, 解析结果)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        start = time.perf_counter()
+        result = parse(content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    result = None
+    gc.collect()
+    tracemalloc.start()
+    result = parse(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def check_equivalent(table, playlist):
+    """分片地址、时长、密钥与 m3u8 库一致"""
+    segments = [seg for seg in playlist.segments if seg.uri]
+    assert len(table) == len(segments), (len(table), len(segments))
+    for i in (0, len(segments) // 2, len(segments) - 1):
+        seg, view = segments[i], table[i]
+        assert view.uri == seg.absolute_uri, (view.uri, seg.absolute_uri)
+        assert abs(view.duration - seg.duration) < 1e-6
+        assert (view.key.uri if view.key else None) == (seg.key.absolute_uri if seg.key else None)
+
+
+def run_scenario(name: str, segments: int, repeat: int, params: dict) -> dict:
+    content = generate_playlist(segments, **params)
+    m3u8_seconds, m3u8_peak, playlist = measure(lambda c: m3u8.loads(c, uri=PLAYLIST_URL), content, repeat)
+    table_seconds, table_peak, table = measure(lambda c: parse_media_playlist(c, PLAYLIST_URL), content, repeat)
+    check_equivalent(table, playlist)
+    return {
+        "scenario": name,
+        "segments": segments,
+        "playlist_kb": round(len(content) / 1024),
+        "m3u8_seconds": round(m3u8_seconds, 3),
+        "table_seconds": round(table_seconds, 3),
+        "speedup": round(m3u8_seconds / table_seconds, 1),
+        "m3u8_peak_mb": round(m3u8_peak / 1024 / 1024, 1),
+        "table_peak_mb": round(table_peak / 1024 / 1024, 1),
+    }
+
+
+def print_table(results):
+    columns = ["scenario", "segments", "playlist_kb", "m3u8_seconds", "table_seconds", "speedup",
+               "m3u8_peak_mb", "table_peak_mb"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="媒体播放列表解析基准测试")
+    parser.add_argument('--segments', type=int, default=20000, help='分片数量')
+    parser.add_argument('--repeat', type=int, default=3, help='计时重复次数（取最短）')
+    parser.add_argument('--scenario', action='append', help='只运行指定的内置场景 (可重复)')
+    parser.add_argument('--json', help='结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    results = []
+    for name, params in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        print(f"▶️ 场景 {name}: {args.segments} 个分片", file=sys.stderr)
+        results.append(run_scenario(name, args.segments, args.repeat, params))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""本地合成 HLS 源站 - 离线基准测试用
+
+生成指定数量/大小的 TS 分片（可选 AES-128 加密、EXT-X-BYTERANGE 单文件模式、
+独立的打包 AAC 音频轨道），并可注入延迟、抖动、错误率和单连接限速，
+用来在没有网络的情况下复现各种 CDN 表现。
+
+    python hls_origin.py --segments 200 --segment-size 1048576 --encrypt --latency 0.05
+
+地址:
+    /index.m3u8        媒体播放列表
+    /seg/<n>.ts        分片
+    /master.m3u8       主播放列表（--audio 时，带 EXT-X-MEDIA 音频分组）
+    /audio.m3u8        音频媒体播放列表
+    /audio/<n>.aac     打包音频分片: ID3 时间戳标签 + ADTS 帧
+    /all.ts            byterange 模式下的整个文件
+    /key.bin           AES-128 密钥
+"""
+import argparse
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TS_PACKET = 188
+# TS 包长与 AES 块长的最小公倍数，保证加密分片无需填充
+SEGMENT_ALIGN = 752
+KEY = bytes(range(16))
+# ADTS 帧（AAC-LC 48kHz 双声道，每帧 1024 个采样）
+AAC_FRAME_SIZE = 384
+AAC_FRAME_SECONDS = 1024 / 48000
+
+
+class OriginConfig:
+    """源站参数"""
+
+    def __init__(self, segments: int = 100, segment_size: int = 512 * 1024, duration: float = 4.0,
+                 encrypt: bool = False, byterange: bool = False, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, throttle: int = 0, seed: int = 1,
+                 audio: bool = False):
+        self.segments = segments
+        self.segment_size = max(SEGMENT_ALIGN, segment_size // SEGMENT_ALIGN * SEGMENT_ALIGN)
+        self.duration = duration
+        self.encrypt = encrypt
+        self.byterange = byterange
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = throttle  # 每个连接的速率上限 bytes/s，0 为不限速
+        self.seed = seed
+        self.audio = audio  # 独立的打包 AAC 音频轨道，入口为 master.m3u8
+
+    @classmethod
+    def from_args(cls, args) -> "OriginConfig":
+        return cls(segments=args.segments, segment_size=args.segment_size, duration=args.duration,
+                   encrypt=args.encrypt, byterange=args.byterange, latency=args.latency,
+                   jitter=args.jitter, error_rate=args.error_rate, throttle=args.throttle, seed=args.seed,
+                   audio=args.audio)
+
+    @property
+    def total_bytes(self) -> int:
+        return self.segments * self.segment_size
+
+
+class SyntheticMedia:
+    """按需生成分片内容（不占用 分片数×大小 的内存）"""
+
+    def __init__(self, config: OriginConfig):
+        self.config = config
+        packets = config.segment_size // TS_PACKET
+        rng = random.Random(config.seed)
+        body = bytearray()
+        for _ in range(packets):
+            body += b'\x47' + bytes(rng.getrandbits(8) for _ in range(3)) + b'\xff' * (TS_PACKET - 4)
+        body += b'\xff' * (config.segment_size - len(body))
+        self.plain = bytes(body)
+        self.audio_frames = int(config.duration / AAC_FRAME_SECONDS)
+        payload = bytes(rng.getrandbits(8) for _ in range(AAC_FRAME_SIZE - 7))
+        self.aac_frame = self._adts_header(AAC_FRAME_SIZE) + payload
+
+    @staticmethod
+    def _adts_header(frame_length: int) -> bytes:
+        # 同步字 0xFFF、MPEG-4、无 CRC；AAC-LC、48kHz、双声道
+        return bytes([0xff, 0xf1, 0x4c, 0x80 | (frame_length >> 11), (frame_length >> 3) & 0xff,
+                      ((frame_length & 0x07) << 5) | 0x1f, 0xfc])
+
+    @staticmethod
+    def _id3_timestamp(pts: int) -> bytes:
+        """打包音频分片开头的 ID3 PRIV 标签，记录第一帧的 MPEG-TS 时间戳"""
+        owner = b'com.apple.streaming.transportStreamTimestamp\x00'
+        frame_body = owner + pts.to_bytes(8, 'big')
+        frame = b'PRIV' + len(frame_body).to_bytes(4, 'big') + b'\x00\x00' + frame_body
+        size = len(frame)
+        synchsafe = bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f])
+        return b'ID3\x04\x00\x00' + synchsafe + frame
+
+    def _encrypt(self, data: bytes, index: int) -> bytes:
+        from Crypto.Cipher import AES
+        return AES.new(KEY, AES.MODE_CBC, index.to_bytes(16, 'big')).encrypt(data)
+
+    def segment(self, index: int) -> bytes:
+        if not self.config.encrypt:
+            return self.plain
+        return self._encrypt(self.plain, index)
+
+    def audio_segment(self, index: int) -> bytes:
+        pts = 900000 + int(index * self.config.duration * 90000)
+        data = self._id3_timestamp(pts) + self.aac_frame * self.audio_frames
+        if not self.config.encrypt:
+            return data
+        # 打包音频长度不是块长的整数倍，按 PKCS7 填充
+        pad = 16 - len(data) % 16
+        return self._encrypt(data + bytes([pad]) * pad, index)
+
+    def master_playlist(self) -> str:
+        return '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="main",LANGUAGE="en",DEFAULT=YES,AUTOSELECT=YES,'
+            'URI="audio.m3u8"',
+            f'#EXT-X-STREAM-INF:BANDWIDTH={int(self.config.segment_size * 8 / self.config.duration)},'
+            'CODECS="avc1.64001f,mp4a.40.2",AUDIO="aud"',
+            'index.m3u8',
+        ]) + '\n'
+
+    def audio_playlist(self) -> str:
+        cfg = self.config
+        lines = ['#EXTM3U', '#EXT-X-VERSION:4', f'#EXT-X-TARGETDURATION:{int(cfg.duration + 0.999)}',
+                 '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+        if cfg.encrypt:
+            lines.append('#EXT-X-KEY:METHOD=AES-128,URI="key.bin"')
+        for i in range(cfg.segments):
+            lines.append(f'#EXTINF:{cfg.duration:.3f},')
+            lines.append(f'audio/{i}.aac')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def playlist(self) -> str:
+        cfg = self.config
+        lines = ['#EXTM3U', '#EXT-X-VERSION:4', f'#EXT-X-TARGETDURATION:{int(cfg.duration + 0.999)}',
+                 '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+        if cfg.encrypt:
+            lines.append('#EXT-X-KEY:METHOD=AES-128,URI="key.bin"')
+        for i in range(cfg.segments):
+            lines.append(f'#EXTINF:{cfg.duration:.3f},')
+            if cfg.byterange:
+                lines.append(f'#EXT-X-BYTERANGE:{cfg.segment_size}@{i * cfg.segment_size}')
+                lines.append('all.ts')
+            else:
+                lines.append(f'seg/{i}.ts')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def read_all(self, start: int, end: int) -> bytes:
+        """byterange 模式：读取整个文件的 [start, end] 区间"""
+        size = self.config.segment_size
+        out = bytearray()
+        pos = start
+        while pos <= end:
+            index, offset = divmod(pos, size)
+            chunk = self.segment(index)[offset:offset + (end - pos + 1)]
+            out += chunk
+            pos += len(chunk)
+        return bytes(out)
+
+
+class OriginStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+
+
+def make_handler(config: OriginConfig, media: SyntheticMedia, stats: OriginStats):
+    rng = random.Random(config.seed)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str = 'application/octet-stream',
+                  extra_headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Accept-Ranges', 'bytes')
+            for k, v in (extra_headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            if self.command == 'HEAD':
+                return
+            # 限速：按块发送并休眠
+            chunk = 64 * 1024
+            for pos in range(0, len(body), chunk):
+                piece = body[pos:pos + chunk]
+                self.wfile.write(piece)
+                if config.throttle:
+                    time.sleep(len(piece) / config.throttle)
+            with stats.lock:
+                stats.bytes_sent += len(body)
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            with stats.lock:
+                stats.requests += 1
+            with rng_lock:
+                delay = config.latency + (rng.uniform(-config.jitter, config.jitter) if config.jitter else 0)
+                fail = rng.random() < config.error_rate
+            if delay > 0:
+                time.sleep(delay)
+
+            path = self.path.split('?')[0]
+            if path.endswith(('.ts', '.aac')) and fail:
+                with stats.lock:
+                    stats.errors += 1
+                return self._send(500, b'injected error', 'text/plain')
+
+            if path == '/index.m3u8':
+                return self._send(200, media.playlist().encode(), 'application/vnd.apple.mpegurl')
+            if path == '/key.bin':
+                return self._send(200, KEY)
+            if config.audio and path == '/master.m3u8':
+                return self._send(200, media.master_playlist().encode(), 'application/vnd.apple.mpegurl')
+            if config.audio and path == '/audio.m3u8':
+                return self._send(200, media.audio_playlist().encode(), 'application/vnd.apple.mpegurl')
+
+            total = config.total_bytes
+            match = re.match(r'^/seg/(\d+)\.ts$', path)
+            audio_match = re.match(r'^/audio/(\d+)\.aac$', path) if config.audio else None
+            if match and int(match.group(1)) < config.segments:
+                body = media.segment(int(match.group(1)))
+            elif audio_match and int(audio_match.group(1)) < config.segments:
+                body = media.audio_segment(int(audio_match.group(1)))
+            elif path == '/all.ts' and config.byterange:
+                body = None
+            else:
+                return self._send(404, b'not found', 'text/plain')
+
+            size = len(body) if body is not None else total
+            range_header = self.headers.get('Range')
+            if range_header:
+                m = re.match(r'bytes=(\d+)-(\d*)', range_header)
+                start = int(m.group(1))
+                end = min(int(m.group(2)) if m.group(2) else size - 1, size - 1)
+                data = body[start:end + 1] if body is not None else media.read_all(start, end)
+                return self._send(206, data, extra_headers={'Content-Range': f'bytes {start}-{end}/{size}'})
+            data = body if body is not None else media.read_all(0, total - 1)
+            return self._send(200, data)
+
+    return Handler
+
+
+class OriginServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端取消请求（对冲、超时）时的断连属于正常情况
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def serve(config: OriginConfig, host: str = '127.0.0.1', port: int = 0, ready=None):
+    """启动源站（阻塞）；ready 为 multiprocessing 队列时回传实际端口"""
+    media = SyntheticMedia(config)
+    stats = OriginStats()
+    server = OriginServer((host, port), make_handler(config, media, stats))
+    if ready is not None:
+        ready.put(server.server_address[1])
+    else:
+        entry = 'master' if config.audio else 'index'
+        print(f"🌐 合成HLS源站: http://{host}:{server.server_address[1]}/{entry}.m3u8")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def start_origin_process(config: OriginConfig, host: str = '127.0.0.1'):
+    """在独立进程中启动源站，避免与被测下载器争抢 GIL，返回 (进程, 播放列表URL)
+
+    带独立音频轨道时返回主播放列表地址。
+    """
+    ready = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=serve, args=(config, host, 0, ready), daemon=True)
+    proc.start()
+    port = ready.get(timeout=30)
+    return proc, f"http://{host}:{port}/{'master' if config.audio else 'index'}.m3u8"
+
+
+def add_origin_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--segments', type=int, default=100, help='分片数量')
+    parser.add_argument('--segment-size', type=int, default=512 * 1024, help='分片大小 (bytes)')
+    parser.add_argument('--duration', type=float, default=4.0, help='分片时长 (秒)')
+    parser.add_argument('--encrypt', action='store_true', help='AES-128 加密')
+    parser.add_argument('--byterange', action='store_true', help='所有分片切自同一个文件 (EXT-X-BYTERANGE)')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟 (秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='延迟抖动幅度 (秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='分片请求返回 500 的概率')
+    parser.add_argument('--throttle', type=int, default=0, help='单连接限速 (bytes/s)，0 为不限速')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--audio', action='store_true', help='独立的打包 AAC 音频轨道 (入口为 master.m3u8)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地合成 HLS 源站')
+    add_origin_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+    serve(OriginConfig.from_args(args), args.host, args.port)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""FastAPI 控制面并发压测
+
+启动合成 HLS 源站（限速，让任务持续处于下载中）和一个独立的 uvicorn 进程
+（临时目录、临时数据库），然后模拟大量任务创建和多个前端面板轮询：
+
+  - 并发创建任务            POST /api/tasks
+  - 面板轮询                GET  /api/tasks, GET /api/system/info, GET /api/tasks/{id}
+  - 随机暂停/恢复           POST /api/tasks/{id}/pause, POST /api/tasks/{id}/resume
+
+输出各接口的 p50/p95/p99 延迟，以及服务端 /metrics 中的事件循环阻塞时间
+(m3u8_event_loop_lag_seconds)，用于定位阻塞事件循环的同步调用。
+
+    python benchmarks/load_test_api.py --tasks 200 --dashboards 30 --duration 30
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from hls_origin import OriginConfig, start_origin_process
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+
+
+class LatencyRecorder:
+    """按接口记录请求耗时"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self):
+        rows = []
+        with self.lock:
+            for endpoint, values in sorted(self.samples.items()):
+                values = sorted(values)
+
+                def pct(p):
+                    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+
+                rows.append({
+                    "endpoint": endpoint,
+                    "count": len(values),
+                    "errors": self.errors.get(endpoint, 0),
+                    "p50_ms": round(pct(50), 1),
+                    "p95_ms": round(pct(95), 1),
+                    "p99_ms": round(pct(99), 1),
+                    "max_ms": round(values[-1] * 1000, 1),
+                })
+        return rows
+
+
+class ApiClient:
+    def __init__(self, base_url: str, recorder: LatencyRecorder):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def call(self, method: str, path: str, endpoint: str, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        try:
+            resp = self.session.request(method, self.base_url + path, timeout=60, **kwargs)
+            ok = resp.status_code < 500
+            return resp
+        except requests.RequestException:
+            return None
+        finally:
+            self.recorder.record(endpoint, time.perf_counter() - start, ok)
+
+
+def start_api_server(work_dir: str, port: int, log_path: str):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.abspath(APP_DIR) + os.pathsep + env.get("PYTHONPATH", "")
+    env["M3U8_DB_PATH"] = os.path.join(work_dir, "loadtest.db")
+    env["M3U8_DB_ECHO"] = "0"
+    # 分片工作目录放在临时目录内，结束时一并删除，也不会与其他实例的工作目录互相清理
+    env["M3U8_WORK_DIR"] = os.path.join(work_dir, "work")
+    log = open(log_path, "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main_fixed:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=1).ok:
+                return proc, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"API 服务启动失败，日志: {log_path}")
+
+
+def parse_loop_lag(metrics_text: str):
+    """从 /metrics 中解析事件循环阻塞统计"""
+    buckets = []
+    total = count = max_lag = 0.0
+    for line in metrics_text.splitlines():
+        m = re.match(r'm3u8_event_loop_lag_seconds_bucket\{le="([^"]+)"\} (\S+)', line)
+        if m:
+            buckets.append((float("inf") if m.group(1) == "+Inf" else float(m.group(1)), float(m.group(2))))
+        elif line.startswith("m3u8_event_loop_lag_seconds_sum "):
+            total = float(line.split()[1])
+        elif line.startswith("m3u8_event_loop_lag_seconds_count "):
+            count = float(line.split()[1])
+        elif line.startswith("m3u8_event_loop_lag_max_seconds "):
+            max_lag = float(line.split()[1])
+
+    def bucket_pct(p):
+        target = count * p / 100
+        for bound, cumulative in buckets:
+            if cumulative >= target:
+                return bound
+        return None
+
+    return {
+        "samples": int(count),
+        "blocked_seconds_total": round(total, 3),
+        "p50_le_s": bucket_pct(50),
+        "p99_le_s": bucket_pct(99),
+        "max_s": round(max_lag, 3),
+    }
+
+
+def run_load_test(args) -> dict:
+    recorder = LatencyRecorder()
+    work_dir = tempfile.mkdtemp(prefix="m3u8_loadtest_")
+    origin_config = OriginConfig(segments=args.segments, segment_size=args.segment_size, throttle=args.throttle)
+    origin, playlist_url = start_origin_process(origin_config)
+    server, base_url = start_api_server(work_dir, args.port, os.path.join(work_dir, "server.log"))
+    client = ApiClient(base_url, recorder)
+    task_ids = []
+    task_ids_lock = threading.Lock()
+    stop = threading.Event()
+
+    try:
+        if args.max_tasks:
+            client.call("POST", "/api/system/update-concurrency", "POST /api/system/update-concurrency",
+                        json={"max_tasks": args.max_tasks})
+
+        # 阶段一：并发创建任务
+        def create(i):
+            resp = client.call("POST", "/api/tasks", "POST /api/tasks", json={
+                "url": playlist_url, "filename": f"load_{i:05d}.mp4", "max_threads": args.threads})
+            if resp is not None and resp.ok:
+                with task_ids_lock:
+                    task_ids.append(resp.json()["task_id"])
+
+        print(f"📝 创建 {args.tasks} 个任务...", file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=args.create_concurrency) as pool:
+            list(pool.map(create, range(args.tasks)))
+
+        # 阶段二：面板轮询 + 暂停/恢复
+        def dashboard():
+            while not stop.is_set():
+                client.call("GET", "/api/tasks", "GET /api/tasks")
+                client.call("GET", "/api/system/info", "GET /api/system/info")
+                with task_ids_lock:
+                    task_id = random.choice(task_ids) if task_ids else None
+                if task_id:
+                    client.call("GET", f"/api/tasks/{task_id}", "GET /api/tasks/{id}")
+                stop.wait(args.poll_interval)
+
+        def mutator():
+            while not stop.is_set():
+                with task_ids_lock:
+                    task_id = random.choice(task_ids) if task_ids else None
+                if task_id:
+                    client.call("POST", f"/api/tasks/{task_id}/pause", "POST /api/tasks/{id}/pause")
+                    stop.wait(args.pause_interval)
+                    client.call("POST", f"/api/tasks/{task_id}/resume", "POST /api/tasks/{id}/resume")
+                stop.wait(args.pause_interval)
+
+        print(f"📊 {args.dashboards} 个面板轮询 {args.duration}s...", file=sys.stderr)
+        workers = [threading.Thread(target=dashboard, daemon=True) for _ in range(args.dashboards)]
+        workers += [threading.Thread(target=mutator, daemon=True) for _ in range(args.mutators)]
+        for w in workers:
+            w.start()
+        time.sleep(args.duration)
+        stop.set()
+        for w in workers:
+            w.join()
+
+        metrics_text = requests.get(base_url + "/metrics", timeout=30).text
+        return {
+            "tasks_created": len(task_ids),
+            "endpoints": recorder.report(),
+            "event_loop": parse_loop_lag(metrics_text),
+        }
+    finally:
+        stop.set()
+        server.terminate()
+        server.wait()
+        origin.terminate()
+        origin.join()
+        if args.keep:
+            print(f"📁 工作目录保留在: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(result: dict):
+    rows = result["endpoints"]
+    columns = ["endpoint", "count", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns} if rows else {}
+    print(f"任务数: {result['tasks_created']}")
+    if rows:
+        print("  ".join(c.ljust(widths[c]) for c in columns))
+        for r in rows:
+            print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+    loop = result["event_loop"]
+    print(f"事件循环阻塞: 总计 {loop['blocked_seconds_total']}s, p50 ≤ {loop['p50_le_s']}s, "
+          f"p99 ≤ {loop['p99_le_s']}s, 最大 {loop['max_s']}s ({loop['samples']} 个采样)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastAPI 控制面并发压测")
+    parser.add_argument('--tasks', type=int, default=200, help='创建的任务数')
+    parser.add_argument('--create-concurrency', type=int, default=20, help='并发创建任务的客户端数')
+    parser.add_argument('--dashboards', type=int, default=30, help='轮询的前端面板数')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='面板轮询间隔 (秒)')
+    parser.add_argument('--mutators', type=int, default=2, help='执行暂停/恢复的客户端数')
+    parser.add_argument('--pause-interval', type=float, default=0.5, help='暂停/恢复间隔 (秒)')
+    parser.add_argument('--duration', type=float, default=30, help='轮询阶段时长 (秒)')
+    parser.add_argument('--max-tasks', type=int, default=10, help='服务端最大并发任务数')
+    parser.add_argument('--threads', type=int, default=4, help='每个任务的下载线程数')
+    parser.add_argument('--segments', type=int, default=200, help='源站分片数')
+    parser.add_argument('--segment-size', type=int, default=256 * 1024, help='源站分片大小')
+    parser.add_argument('--throttle', type=int, default=256 * 1024, help='源站单连接限速 (bytes/s)')
+    parser.add_argument('--port', type=int, default=18765, help='API 服务端口')
+    parser.add_argument('--json', help='结果写入 JSON 文件')
+    parser.add_argument('--keep', action='store_true', help='保留工作目录（数据库、服务日志）')
+    args = parser.parse_args()
+
+    result = run_load_test(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
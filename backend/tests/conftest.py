@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 后端模块使用平铺导入 (from models import ...)，与运行时一致地把 app/ 加入搜索路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
@@ -0,0 +1,39 @@
+import pytest
+
+from file_serving import content_disposition, parse_range_header
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('', None),
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=900-5000', (900, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=0-0', (0, 0)),
+    ('items=0-99', None),
+    ('bytes=0-99,200-299', None),
+    ('bytes=-', None),
+    ('bytes=a-b', None),
+    ('bytes=100-50', None),
+    ('bytes=2000-1500', None),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header, size', [
+    ('bytes=1000-', 1000),
+    ('bytes=1000-2000', 1000),
+    ('bytes=-0', 1000),
+    ('bytes=-100', 0),
+])
+def test_unsatisfiable_range(header, size):
+    with pytest.raises(ValueError):
+        parse_range_header(header, size)
+
+
+def test_content_disposition():
+    assert content_disposition('video.mp4') == 'attachment; filename="video.mp4"'
+    assert content_disposition('视频.mp4', 'inline') == "inline; filename*=utf-8''%E8%A7%86%E9%A2%91.mp4"
@@ -0,0 +1,85 @@
+import pytest
+
+from integrity import (SegmentVerificationError, find_ts_start, sniff_packed_audio, verify_adts,
+                       verify_segment, verify_ts)
+
+
+def ts_segment(packets=4):
+    return (b'\x47' + b'\x00' * 187) * packets
+
+
+def adts_frame(length=64):
+    header = bytes([0xff, 0xf1, 0x4c, 0x80 | (length >> 11), (length >> 3) & 0xff, ((length & 0x07) << 5) | 0x1f,
+                    0xfc])
+    return header + b'\x00' * (length - len(header))
+
+
+def id3_tag(body=b'\x00' * 20):
+    size = len(body)
+    synchsafe = bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f])
+    return b'ID3\x04\x00\x00' + synchsafe + body
+
+
+def reason(data, container):
+    with pytest.raises(SegmentVerificationError) as info:
+        verify_segment(data, container)
+    return info.value.reason
+
+
+def test_ts_ok_with_aes_padding():
+    verify_segment(ts_segment() + b'\x10' * 16, 'ts')
+
+
+def test_ts_with_fake_image_header():
+    data = b'\x89PNG' + b'\x00' * 100 + ts_segment()
+    assert find_ts_start(data) == 104
+    verify_ts(data)
+
+
+def test_ts_bad_sync_byte():
+    data = bytearray(ts_segment())
+    data[188 * 2] = 0x00
+    assert reason(bytes(data), 'ts') == 'ts_sync'
+
+
+def test_ts_error_page_and_empty():
+    assert reason(b'<html>403 Forbidden</html>', 'ts') == 'ts_sync'
+    assert reason(b'', 'ts') == 'empty'
+
+
+def test_fmp4_box_type():
+    verify_segment(b'\x00\x00\x00\x18styp' + b'\x00' * 16, 'm4s')
+    assert reason(b'\x00\x00\x00\x18html', 'm4s') == 'fmp4_box'
+
+
+def test_adts_ok_with_id3():
+    verify_segment(id3_tag() + adts_frame() * 5, 'aac')
+
+
+def test_adts_tolerates_aes_padding():
+    verify_adts(adts_frame() * 3 + b'\x04' * 4)
+
+
+def test_adts_truncated_frame():
+    assert reason(id3_tag() + adts_frame() * 3 + adts_frame()[:40], 'aac') == 'adts_truncated'
+
+
+def test_adts_bad_sync():
+    assert reason(id3_tag() + adts_frame() + b'\x00' * 64, 'aac') == 'adts_sync'
+
+
+def test_packed_audio_is_not_checked_as_ts():
+    assert reason(id3_tag() + adts_frame() * 2, 'ts') == 'ts_sync'
+
+
+def test_sniff_packed_audio():
+    assert sniff_packed_audio(id3_tag() + adts_frame()) == 'aac'
+    assert sniff_packed_audio(b'\x0b\x77\x00\x00\x00\x40') == 'ac3'
+    assert sniff_packed_audio(b'\x0b\x77\x00\x00\x00\x80') == 'eac3'
+    assert sniff_packed_audio(id3_tag() + b'\xff\xfb\x90\x00') == 'mp3'
+    assert sniff_packed_audio(ts_segment()) is None
+    assert reason(b'\x0b\x77\x00\x00\x00\x40', 'mp3') == 'audio_sync'
+
+
+def test_subtitles_are_not_verified():
+    verify_segment(b'WEBVTT\n\n', 'vtt')
@@ -0,0 +1,80 @@
+import m3u8
+import pytest
+
+from playlist_parser import is_master_playlist, parse_media_playlist
+
+PLAYLIST_URL = "https://cdn.example.com/vod/movie/index.m3u8?token=abc"
+
+
+def make_playlist(segments=6, key_every=0, byterange=False, fmp4=False):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:10']
+    if fmp4:
+        lines.append('#EXT-X-MAP:URI="init.mp4"')
+    ext = 'm4s' if fmp4 else 'ts'
+    for i in range(segments):
+        if key_every and i % key_every == 0:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="keys/{i // key_every}.key",IV=0x{i:032x}')
+        lines.append(f'#EXTINF:{5.005 + i % 3 * 0.5:.3f},')
+        if byterange:
+            lines.append(f'#EXT-X-BYTERANGE:{1000 + i}')
+            lines.append(f'media.{ext}')
+        else:
+            lines.append(f'seg/{i:06d}.{ext}?token=abc')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.mark.parametrize('params', [
+    dict(),
+    dict(key_every=2),
+    dict(byterange=True),
+    dict(fmp4=True),
+], ids=['plain', 'key_rotation', 'byterange', 'fmp4'])
+def test_matches_m3u8(params):
+    content = make_playlist(**params)
+    table = parse_media_playlist(content, PLAYLIST_URL)
+    playlist = m3u8.loads(content, uri=PLAYLIST_URL)
+
+    assert len(table) == len(playlist.segments)
+    assert table.media_sequence == playlist.media_sequence
+    assert table.target_duration == playlist.target_duration
+    assert table.is_endlist
+    for view, seg in zip(table, playlist.segments):
+        assert view.uri == seg.absolute_uri
+        assert view.duration == pytest.approx(seg.duration)
+        assert (view.key.uri if view.key else None) == (seg.key.absolute_uri if seg.key else None)
+        assert (view.key.iv if view.key else None) == (seg.key.iv if seg.key else None)
+        assert (view.init_section.uri if view.init_section else None) == \
+               (seg.init_section.absolute_uri if seg.init_section else None)
+
+
+def test_key_and_init_tables_are_shared():
+    table = parse_media_playlist(make_playlist(segments=6, key_every=2, fmp4=True), PLAYLIST_URL)
+    assert len(table.keys) == 3
+    assert len(table.init_sections) == 1
+    assert table.key(0) is table.key(1)
+    assert table.key(1) is not table.key(2)
+
+
+def test_byterange_offsets_continue_per_resource():
+    table = parse_media_playlist(make_playlist(segments=3, byterange=True), PLAYLIST_URL)
+    assert list(table.byte_ranges[i] for i in range(3)) == [(0, 999), (1000, 2000), (2001, 3002)]
+    # 同一资源的分片共享地址字符串
+    assert table.uris[0] is table.uris[2]
+
+
+def test_key_method_none_clears_key():
+    content = '\n'.join([
+        '#EXTM3U', '#EXT-X-TARGETDURATION:4',
+        '#EXT-X-KEY:METHOD=AES-128,URI="k.key"', '#EXTINF:4,', 'a.ts',
+        '#EXT-X-KEY:METHOD=NONE', '#EXTINF:4,', 'b.ts',
+    ])
+    table = parse_media_playlist(content, PLAYLIST_URL)
+    assert table[0].key.uri == "https://cdn.example.com/vod/movie/k.key"
+    assert table[1].key is None
+    assert not table.is_endlist
+
+
+def test_is_master_playlist():
+    assert is_master_playlist('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nlow.m3u8\n')
+    assert not is_master_playlist(make_playlist())
@@ -0,0 +1,65 @@
+from webvtt import MPEGTS_ROLLOVER, merge_segments, parse_segment, parse_timestamp_map
+
+
+def vtt(mpegts, *cues, local='00:00:00.000'):
+    lines = ['WEBVTT', f'X-TIMESTAMP-MAP=MPEGTS:{mpegts},LOCAL:{local}', '']
+    for start, end, text in cues:
+        lines += [f'{start} --> {end}', text, '']
+    return '\n'.join(lines).encode()
+
+
+def cue_lines(text):
+    return [line for line in text.split('\n') if '-->' in line]
+
+
+def test_parse_timestamp_map():
+    assert parse_timestamp_map('MPEGTS:900000,LOCAL:00:00:00.000') == 10.0
+    assert parse_timestamp_map('LOCAL:00:00:01.000,MPEGTS:900000') == 9.0
+    assert parse_timestamp_map('LOCAL:00:00:00.000') is None
+
+
+def test_parse_segment_drops_note_and_cue_ids():
+    offset, cues = parse_segment('WEBVTT\n\nNOTE comment\n\n1\n00:01.000 --> 00:02.500 align:start\nHello\n')
+    assert offset is None
+    assert cues == [(1.0, 2.5, ' align:start', 'Hello')]
+
+
+def test_offsets_follow_timestamp_map():
+    text, first = merge_segments([
+        vtt(900000, ('00:00:01.000', '00:00:02.000', 'one')),
+        vtt(1440000, ('00:00:02.000', '00:00:03.000', 'two')),
+    ])
+    # 第二个分片的映射比第一个晚 6 秒
+    assert cue_lines(text) == ['00:00:01.000 --> 00:00:02.000', '00:00:08.000 --> 00:00:09.000']
+    assert first == 1.0
+
+
+def test_duplicate_cues_are_kept_once():
+    cue = ('00:00:03.000', '00:00:07.000', 'spans two segments')
+    text, _ = merge_segments([vtt(900000, cue), vtt(900000, cue)])
+    assert text.count('spans two segments') == 1
+
+
+def test_empty_segments_are_skipped():
+    text, first = merge_segments([
+        vtt(900000),
+        b'WEBVTT\n\n',
+        vtt(900000, ('00:00:04.000', '00:00:05.000', 'late')),
+    ])
+    assert cue_lines(text) == ['00:00:04.000 --> 00:00:05.000']
+    assert first == 4.0
+
+
+def test_mpegts_rollover():
+    before = int((MPEGTS_ROLLOVER - 2) * 90000)
+    text, _ = merge_segments([
+        vtt(before, ('00:00:00.000', '00:00:01.000', 'before')),
+        vtt(90000 * 4, ('00:00:00.000', '00:00:01.000', 'after')),
+    ])
+    assert cue_lines(text) == ['00:00:00.000 --> 00:00:01.000', '00:00:06.000 --> 00:00:07.000']
+
+
+def test_no_cues():
+    text, first = merge_segments([b'WEBVTT\n\n'])
+    assert text.startswith('WEBVTT')
+    assert first == 0.0
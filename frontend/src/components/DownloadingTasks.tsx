@@ -80,7 +80,7 @@ const DownloadingTasks: React.FC<DownloadingTasksProps> = ({
                   </Typography>
                   {task.download_speed && task.status === 'downloading' && (
                     <Typography variant="caption" color="primary" sx={{ display: 'block' }}>
-                      速度: {task.download_speed}
+                      速度: {task.download_speed}{task.eta ? ` · 剩余 ${task.eta}` : ''}
                     </Typography>
                   )}
                   {task.error_message && (
@@ -92,7 +92,7 @@ const TaskList: React.FC<TaskListProps> = ({
                   )}
                   {task.download_speed && task.status === 'downloading' && (
                     <Typography variant="caption" color="primary" sx={{ display: 'block' }}>
-                      速度: {task.download_speed}
+                      速度: {task.download_speed}{task.eta ? ` · 剩余 ${task.eta}` : ''}
                     </Typography>
                   )}
                   {task.error_message && (
@@ -5,6 +5,12 @@ export interface DownloadTask {
   status: 'pending' | 'downloading' | 'completed' | 'paused' | 'failed';
   progress: number;
   file_size?: string;
+  download_speed?: string;
+  eta_seconds?: number;
+  eta?: string;
+  downloaded_bytes?: number;
+  completed_segments?: number;
+  total_segments?: number;
   error_message?: string;
   created_at: string;
   max_threads: number;